@@ -0,0 +1,89 @@
+"""FFT匹配引擎基准测试 - 对比逐模板 cv2.matchTemplate 与 FFT批量引擎在模板数量增加时的每帧耗时
+
+模板频谱在第一帧计算后缓存，之后每帧只需计算一次帧频谱和积分图。
+
+用法:
+    python benchmarks/bench_fft_engine.py [--width 1920 --height 1080 --template-size 48 --counts 1,4,16,64]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from core.fft_engine import FFTCorrelationEngine
+from core.frame_context import FrameContext
+
+
+def make_scene(width, height, template_size, count, seed=0):
+    """生成低频纹理截图，并从中截取 count 个同尺寸模板"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    templates = []
+    for i in range(count):
+        x = int(rng.integers(0, width - template_size))
+        y = int(rng.integers(0, height - template_size))
+        templates.append((i, frame[y:y + template_size, x:x + template_size].copy()))
+    return frame, templates
+
+
+def run_opencv(frame_image, templates, method):
+    return {key: cv2.matchTemplate(frame_image, template, method) for key, template in templates}
+
+
+def run_fft(engine, frame_image, templates, method):
+    # 每帧新建上下文，帧频谱不跨帧复用
+    frame = FrameContext(frame_image)
+    return dict(engine.match_batch(frame, 'color', templates, method))
+
+
+def time_call(func, repeat):
+    best = float('inf')
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--template-size', type=int, default=48)
+    parser.add_argument('--counts', default='1,4,16,64')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--method', default='TM_CCOEFF_NORMED',
+                        choices=['TM_CCOEFF_NORMED', 'TM_CCORR_NORMED', 'TM_SQDIFF_NORMED'])
+    args = parser.parse_args()
+
+    method = getattr(cv2, args.method)
+    counts = [int(c) for c in args.counts.split(',')]
+    frame_image, all_templates = make_scene(args.width, args.height, args.template_size, max(counts))
+
+    print(f"帧尺寸: {args.width}x{args.height}, 模板: {args.template_size}x{args.template_size}, "
+          f"方法: {args.method}, OpenCV线程数: {cv2.getNumThreads()}")
+    print(f"{'模板数':>6} {'OpenCV(ms)':>12} {'FFT首帧(ms)':>12} {'FFT(ms)':>10} {'加速比':>8} {'最大误差':>10}")
+
+    for count in counts:
+        templates = all_templates[:count]
+        engine = FFTCorrelationEngine()
+
+        cv_time, cv_results = time_call(lambda: run_opencv(frame_image, templates, method), args.repeat)
+        # 首帧包含模板频谱计算，之后的帧命中频谱缓存
+        cold_time, _ = time_call(lambda: run_fft(engine, frame_image, templates, method), 1)
+        fft_time, fft_results = time_call(lambda: run_fft(engine, frame_image, templates, method), args.repeat)
+
+        max_error = max(float(np.abs(fft_results[key] - cv_results[key]).max()) for key, _ in templates)
+        print(f"{count:>6} {cv_time * 1000:>12.1f} {cold_time * 1000:>12.1f} {fft_time * 1000:>10.1f} "
+              f"{cv_time / max(fft_time, 1e-9):>7.2f}x {max_error:>10.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""每帧内存分配基准测试 - 对比截图转RGB（花式索引复制）+ 每帧新分配平面 与 原始BGRA视图 + 平面缓冲区池
+
+模拟 Win32 截图得到的BGRA位图数据，每帧构建匹配常用的平面（彩色/灰度及金字塔第1、2层），
+用 tracemalloc 统计每帧新分配的内存量（numpy 和 OpenCV 返回的数组都会被统计）。
+
+用法:
+    python benchmarks/bench_frame_allocations.py [--width 1920 --height 1080 --frames 50 --levels 2]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from core.frame_context import FrameContext, FramePlanePool
+
+
+def make_bitmaps(width, height, count=2, seed=0):
+    """生成几帧BGRA位图数据（bytes，与 GetBitmapBits 返回的格式相同）"""
+    rng = np.random.default_rng(seed)
+    bitmaps = []
+    for _ in range(count):
+        coarse = rng.integers(0, 255, (height // 16 + 1, width // 16 + 1, 4), dtype=np.uint8)
+        bitmaps.append(cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC).tobytes())
+    return bitmaps
+
+
+def legacy_capture(bitmap, width, height):
+    """旧版截图：BGRA -> RGB 花式索引（每帧复制整帧）"""
+    img_array = np.frombuffer(bitmap, dtype='uint8')
+    img_array.shape = (height, width, 4)
+    return img_array[:, :, [2, 1, 0]]
+
+
+def native_capture(bitmap, width, height):
+    """原始BGRA布局的视图（不复制）"""
+    return np.frombuffer(bitmap, dtype=np.uint8).reshape(height, width, 4)
+
+
+def build_planes(frame, levels):
+    for plane in ('color', 'gray'):
+        for level in range(levels + 1):
+            frame.get_plane(plane, level)
+
+
+def run(name, bitmaps, width, height, frames, levels, capture, pool):
+    # 预热（缓冲区池在前几帧分配）
+    previous = None
+    for i in range(4):
+        frame = FrameContext(capture(bitmaps[i % len(bitmaps)], width, height), seq=i, plane_pool=pool)
+        build_planes(frame, levels)
+        if previous is not None:
+            previous.release_buffers()
+        previous = frame
+
+    tracemalloc.start()
+    allocated = []
+    start = time.perf_counter()
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        frame = FrameContext(capture(bitmaps[i % len(bitmaps)], width, height), seq=i, plane_pool=pool)
+        build_planes(frame, levels)
+        # 上一帧结束（与 ImageMatcher.begin_frame 的顺序一致）
+        previous.release_buffers()
+        previous = frame
+        allocated.append(tracemalloc.get_traced_memory()[1] - baseline)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    per_frame = sum(allocated) / len(allocated)
+    print(f"{name:<28} 每帧分配: {per_frame / 1024 / 1024:8.2f}MB   每帧耗时: {elapsed / frames * 1000:6.2f}ms")
+    return per_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--levels', type=int, default=2, help='构建的金字塔层数')
+    args = parser.parse_args()
+
+    bitmaps = make_bitmaps(args.width, args.height)
+    print(f"帧尺寸: {args.width}x{args.height}, 帧数: {args.frames}, 金字塔层数: {args.levels}")
+    legacy = run('RGB复制 + 每帧新分配', bitmaps, args.width, args.height, args.frames, args.levels,
+                 legacy_capture, None)
+    run('BGRA视图 + 每帧新分配', bitmaps, args.width, args.height, args.frames, args.levels,
+        native_capture, None)
+    pooled = run('BGRA视图 + 平面缓冲区池', bitmaps, args.width, args.height, args.frames, args.levels,
+                 native_capture, FramePlanePool())
+    print(f"每帧少分配: {(legacy - pooled) / 1024 / 1024:.2f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""灰度匹配基准测试 - 离线测量灰度模板相对彩色匹配的耗时比（ImageMatcher.calibrate_gray_speedup）
+
+匹配时不再额外做彩色匹配来统计节省的时间；应用中每个灰度模板首次匹配时在后台线程测量一次耗时比，
+之后 get_statistics() 中的灰度节省时间按该比例估算。本脚本直接测量并输出各模板的耗时比。
+
+用法:
+    python benchmarks/bench_gray_matching.py [--templates 8 --template-size 48 --width 1920 --height 1080]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bench_matching_loop import make_templates
+from core.frame_sources import SyntheticFrameSource
+from core.image_matcher import ImageMatcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--templates', type=int, default=8)
+    parser.add_argument('--template-size', type=int, default=48)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = make_templates(workdir, args.templates, args.template_size)
+        source = SyntheticFrameSource({path: path for path in paths}, size=(args.width, args.height))
+        screenshot = source.grab()
+
+        image_matcher = ImageMatcher(None)
+        for template_id, path in enumerate(paths, 1):
+            image_matcher.set_template_image(template_id, path)
+            image_matcher.set_template_color_mode(template_id, 'gray')
+
+        start = time.perf_counter()
+        speedups = image_matcher.calibrate_gray_speedup(screenshot, repeat=args.repeat)
+        elapsed = time.perf_counter() - start
+
+    for template_id, speedup in speedups.items():
+        print(f"模板 {template_id}: 彩色/灰度耗时比 {speedup:.2f}")
+    if speedups:
+        print(f"平均耗时比: {sum(speedups.values()) / len(speedups):.2f}, 测量耗时: {elapsed:.2f}秒")
+
+
+if __name__ == '__main__':
+    main()
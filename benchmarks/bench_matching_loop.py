@@ -0,0 +1,149 @@
+"""匹配循环端到端基准测试 - 用合成或回放截图源运行完整的 Controller.matching_loop（不需要 Windows 窗口）
+
+合成截图源在已知位置绘制模板，统计循环帧率以及点击是否落在模板上。
+
+用法:
+    python benchmarks/bench_matching_loop.py [--templates 8 --template-size 48 --width 1280 --height 720 --seconds 5]
+    python benchmarks/bench_matching_loop.py --capture-thread --partial-capture   (启用可选的截图线程和局部截图)
+    python benchmarks/bench_matching_loop.py --replay 录像.mp4 --template-dir 模板文件夹 [--max-speed]
+    python benchmarks/bench_matching_loop.py --record 会话.frec   (录制合成画面的会话)
+    python benchmarks/bench_matching_loop.py --replay 会话.frec --template-dir 模板文件夹 --max-speed   (回放录制并对比点击)
+
+帧录制文件按文件头识别（扩展名不限）。--max-speed 回放录制时逐帧匹配、按录制的帧时间判断点击间隔，
+点击顺序与录制时一致；实时回放按墙上时间取帧，匹配到的帧取决于处理速度，不保证可复现。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from core.controller import Controller
+from core.frame_recorder import RecordingFrameSource, is_recording_file
+from core.frame_sources import ReplayFrameSource, SyntheticFrameSource
+from core.image_matcher import ImageMatcher
+from core.window_manager import WindowManager
+
+
+def make_templates(directory, count, size, seed=0):
+    """生成互不相似的纹理模板并保存为PNG"""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        coarse = rng.integers(0, 255, (4, 4, 3), dtype=np.uint8)
+        template = cv2.resize(coarse, (size, size), interpolation=cv2.INTER_CUBIC)
+        path = os.path.join(directory, f"template_{i:03d}.png")
+        Image.fromarray(template).save(path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--templates', type=int, default=8)
+    parser.add_argument('--template-size', type=int, default=48)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--drift', type=int, default=0, help='合成画面中模板每帧移动的最大像素')
+    parser.add_argument('--bgra', action='store_true', help='合成画面使用与窗口截图相同的BGRA布局')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--backend', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--fps', type=float, default=30.0, help='目标帧率')
+    parser.add_argument('--post-click', type=float, help='点击后的帧间隔（秒），默认使用控制器设置')
+    parser.add_argument('--replay', help='回放的视频文件、截图文件夹或帧录制文件（代替合成画面）')
+    parser.add_argument('--record', help='把运行过程录制到帧录制文件')
+    parser.add_argument('--template-dir', help='模板文件夹（回放时必须指定）')
+    parser.add_argument('--max-speed', action='store_true', help='回放时以最快速度读取帧')
+    parser.add_argument('--capture-thread', action='store_true', help='启用独立截图线程')
+    parser.add_argument('--partial-capture', action='store_true', help='启用局部截图（只截取搜索区域）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.replay:
+            if not args.template_dir:
+                parser.error('--replay 需要同时指定 --template-dir')
+            template_dir = args.template_dir
+            if is_recording_file(args.replay):
+                source = RecordingFrameSource(args.replay, realtime=not args.max_speed)
+            else:
+                source = ReplayFrameSource(args.replay, realtime=not args.max_speed)
+        else:
+            template_dir = workdir
+            paths = make_templates(workdir, args.templates, args.template_size)
+            source = SyntheticFrameSource({path: path for path in paths}, size=(args.width, args.height),
+                                          drift=args.drift, layout='BGRA' if args.bgra else 'RGB')
+
+        window_manager = WindowManager()
+        image_matcher = ImageMatcher(window_manager)
+        controller = Controller(window_manager, image_matcher)
+        controller.set_log_callback(lambda message: None)
+        controller.global_click_interval = 0.1
+
+        # 只匹配文件夹中的模板
+        for settings in controller.template_settings.values():
+            settings['enabled'] = False
+        controller.load_templates_from_directory(template_dir, 1, 'bench')
+        print(f"加载模板: {len(image_matcher.template_images)}")
+
+        if args.post_click is not None:
+            controller.set_frame_cadence('post_click', args.post_click)
+        controller.set_thread_count(args.threads)
+        controller.set_matching_backend(args.backend)
+        controller.set_target_fps(args.fps)
+        if args.capture_thread and not (isinstance(source, RecordingFrameSource) and args.max_speed):
+            # 最快速度回放录制时逐帧匹配录制的每一帧（不经过截图线程跳帧）
+            controller.set_capture_thread(True)
+        controller.set_partial_capture(args.partial_capture)
+        if args.record or isinstance(source, RecordingFrameSource):
+            # 每帧匹配所有模板：录制和回放的逐帧状态与线程调度时序无关，点击顺序可复现
+            controller.set_deterministic_scheduling(True)
+        if not controller.set_frame_source(source):
+            print("打开截图源失败")
+            return
+        if args.record:
+            controller.start_recording(args.record)
+
+        controller.start_matching()
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.seconds:
+            if isinstance(source, RecordingFrameSource) and source.is_finished():
+                break
+            time.sleep(0.05)
+        status = controller.get_status()
+        controller.pause_matching()
+        elapsed = time.perf_counter() - start
+
+        pacer = status['frame_pacer']
+        capture = status['capture_thread']
+        clicks = source.get_clicks()
+        print(f"循环帧数: {pacer['frames']}, 循环帧率: {pacer['frames'] / elapsed:.1f} FPS "
+              f"(目标 {args.fps:.0f}), 平均处理耗时: {pacer['avg_work_time'] * 1000:.1f}ms")
+        if capture is not None:
+            print(f"截图: {capture['captures']}, 平均截图耗时: {capture['avg_capture_time'] * 1000:.1f}ms, "
+                  f"丢弃旧帧: {capture['ring']['dropped']}")
+        if isinstance(source, SyntheticFrameSource):
+            hits = sum(1 for _, x, y, _ in clicks if source.hit_test(x, y) is not None)
+            print(f"点击: {len(clicks)}, 落在模板上: {hits}")
+        elif isinstance(source, RecordingFrameSource):
+            recorded = [(x, y, button) for _, x, y, button in source.get_recorded_clicks()]
+            replayed = [(x, y, button) for _, x, y, button in clicks]
+            same = sum(1 for a, b in zip(recorded, replayed) if a == b)
+            print(f"点击: {len(replayed)}, 录制时点击: {len(recorded)}, 顺序一致: {same}")
+        else:
+            print(f"点击: {len(clicks)}")
+        controller.stop()
+        if args.record:
+            recording_stats = status['frame_recorder'] or {}
+            print(f"录制: {recording_stats.get('frames', 0)} 帧, 丢弃 {recording_stats.get('dropped', 0)} 帧, "
+                  f"压缩比 {recording_stats.get('compression_ratio', 0):.2f} -> {args.record}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""峰值提取基准测试 - 对比旧版 np.where + Python循环 + O(n²)去重 与 向量化峰值提取引擎
+
+用法:
+    python benchmarks/bench_peak_extraction.py [--width 1920 --height 1080 --repeat 3]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from core.peak_extractor import extract_peaks
+
+
+def make_scene(width, height, template_size=48, copies=12, seed=0):
+    """生成带纹理背景和若干模板副本的合成截图"""
+    rng = np.random.default_rng(seed)
+    # 低频背景：使低阈值下出现大量候选点（类似真实界面截图）
+    background = rng.integers(0, 255, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    # 平滑模板（类似界面图标的渐变/色块），在低阈值下与背景大面积相关
+    coarse = rng.integers(0, 255, (3, 3, 3), dtype=np.uint8)
+    template = cv2.resize(coarse, (template_size, template_size), interpolation=cv2.INTER_CUBIC)
+    for _ in range(copies):
+        x = int(rng.integers(0, width - template_size))
+        y = int(rng.integers(0, height - template_size))
+        frame[y:y + template_size, x:x + template_size] = template
+    return frame, template
+
+
+def legacy_extract(result, threshold, template_width, template_height, max_matches):
+    """旧版实现（保留用于对比）"""
+    all_positions = []
+    locations = np.where(result >= threshold)
+    for pt in zip(*locations[::-1]):
+        confidence = result[pt[1], pt[0]]
+        center_x = pt[0] + template_width // 2
+        center_y = pt[1] + template_height // 2
+        if confidence >= threshold:
+            all_positions.append((center_x, center_y, confidence))
+
+    min_distance = template_width // 3
+    filtered = []
+    for current in sorted(all_positions, key=lambda x: x[2], reverse=True):
+        current_x, current_y, current_conf = current
+        is_far_enough = True
+        for selected_x, selected_y, selected_conf in filtered:
+            distance = math.sqrt((current_x - selected_x) ** 2 + (current_y - selected_y) ** 2)
+            if distance < min_distance and current_conf <= selected_conf * 1.2:
+                is_far_enough = False
+                break
+        if is_far_enough:
+            filtered.append(current)
+
+    filtered.sort(key=lambda x: x[2], reverse=True)
+    return filtered[:max_matches], len(all_positions)
+
+
+def vectorized_extract(result, threshold, template_width, template_height, max_matches):
+    xs, ys, scores = extract_peaks(result, threshold, template_width // 3, max_matches)
+    return [(int(x) + template_width // 2, int(y) + template_height // 2, float(s))
+            for x, y, s in zip(xs, ys, scores)]
+
+
+def time_call(func, repeat):
+    best = float('inf')
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-matches', type=int, default=10)
+    parser.add_argument('--legacy-limit', type=int, default=200000,
+                        help='候选点超过该数量时跳过旧版实现（避免运行数分钟）')
+    args = parser.parse_args()
+
+    frame, template = make_scene(args.width, args.height)
+    template_height, template_width = template.shape[:2]
+
+    start = time.perf_counter()
+    result = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED)
+    match_time = time.perf_counter() - start
+    print(f"帧尺寸: {args.width}x{args.height}, 模板: {template_width}x{template_height}, "
+          f"matchTemplate耗时: {match_time * 1000:.1f}ms")
+    print(f"{'阈值':>6} {'候选数':>10} {'旧版(ms)':>12} {'向量化(ms)':>12} {'加速比':>8} {'结果一致':>8}")
+
+    for threshold in (0.3, 0.4, 0.5, 0.7, 0.9):
+        candidates = int(np.count_nonzero(result >= threshold))
+        new_time, new_positions = time_call(
+            lambda: vectorized_extract(result, threshold, template_width, template_height, args.max_matches),
+            args.repeat)
+
+        if candidates <= args.legacy_limit:
+            old_time, (old_positions, _) = time_call(
+                lambda: legacy_extract(result, threshold, template_width, template_height, args.max_matches),
+                1)
+            same = [p[:2] for p in old_positions] == [p[:2] for p in new_positions]
+            print(f"{threshold:>6.2f} {candidates:>10} {old_time * 1000:>12.1f} {new_time * 1000:>12.2f} "
+                  f"{old_time / max(new_time, 1e-9):>7.0f}x {str(same):>8}")
+        else:
+            print(f"{threshold:>6.2f} {candidates:>10} {'(跳过)':>12} {new_time * 1000:>12.2f} {'-':>8} {'-':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import threading
+import time
+
+import numpy as np
+
+
+class CapturedFrame:
+    """环中的一帧：像素缓冲区（属于帧环，释放后可能被覆盖）及截图信息"""
+
+    __slots__ = ('slot', 'seq', 'image', 'capture_time', 'geometry', 'rects')
+
+    def __init__(self, slot, seq, image, capture_time, geometry, rects=None):
+        self.slot = slot
+        self.seq = seq
+        self.image = image
+        self.capture_time = capture_time  # time.perf_counter() 时间
+        self.geometry = geometry  # 截图时的 (窗口句柄, 客户区宽, 客户区高)
+        self.rects = rects  # 局部截图实际截取的矩形，None 表示整帧
+
+    def get_age(self):
+        """距截图完成的时间（秒）"""
+        return time.perf_counter() - self.capture_time
+
+
+class FrameRing:
+    """预分配的截图帧环 - 单个写入方（截图线程）、单个读取方（匹配循环）
+
+    写入方总是写入既不是最新帧、也没有被读取方占用的帧槽，所以至少需要3个槽。
+    读取方总是取最新的一帧，中间来不及处理的旧帧直接丢弃；内存占用固定为帧槽数 × 单帧大小。
+    """
+
+    def __init__(self, slots=3):
+        self.slots = max(3, int(slots))
+        self._buffers = [None] * self.slots
+        self._slot_seq = [0] * self.slots
+        self._slot_time = [0.0] * self.slots
+        self._slot_geometry = [None] * self.slots
+        self._slot_rects = [None] * self.slots
+
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._latest = None  # 最新帧所在的槽
+        self._held = None  # 读取方占用的槽
+        self._closed = False
+
+        self.stats = {'written': 0, 'read': 0, 'dropped': 0, 'allocations': 0}
+        self._last_read_seq = 0
+
+    def _get_write_slot(self):
+        """可写入的槽：排除最新帧和读取方占用的槽，覆盖其中最旧的一个"""
+        candidates = [index for index in range(self.slots) if index != self._latest and index != self._held]
+        return min(candidates, key=lambda index: self._slot_seq[index])
+
+    def write(self, image, geometry=None, rects=None):
+        """写入一帧截图（复制到预分配的缓冲区；局部截图时只复制 rects 内的像素）
+
+        Returns:
+            int: 帧序号
+        """
+        with self._cond:
+            index = self._get_write_slot()
+            buffer = self._buffers[index]
+            if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+                # 窗口尺寸变化时才重新分配
+                buffer = np.empty(image.shape, dtype=image.dtype)
+                self._buffers[index] = buffer
+                self.stats['allocations'] += 1
+            # 写入期间该槽不会被读取（不是最新帧也没有被占用），复制放在锁外
+            self._slot_seq[index] = -1
+
+        if rects is None:
+            np.copyto(buffer, image)
+        else:
+            # 局部截图只复制截取的矩形（其余像素不会被搜索）
+            for x0, y0, x1, y1 in rects:
+                buffer[y0:y1, x0:x1] = image[y0:y1, x0:x1]
+        capture_time = time.perf_counter()
+
+        with self._cond:
+            self._seq += 1
+            self._slot_seq[index] = self._seq
+            self._slot_time[index] = capture_time
+            self._slot_geometry[index] = geometry
+            self._slot_rects[index] = rects
+            self._latest = index
+            self.stats['written'] += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def get_latest(self, after_seq=0, timeout=None):
+        """获取最新的一帧（序号大于 after_seq），同时释放上次获取的帧
+
+        Args:
+            after_seq: 只接受序号更大的帧（传入上一帧的序号，避免重复匹配同一帧）
+            timeout: 等待新帧的最长时间（秒），None 表示一直等待
+        Returns:
+            CapturedFrame: 最新帧；超时或帧环已关闭时返回 None
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._cond:
+            self._held = None
+            while not self._closed and (self._latest is None or self._slot_seq[self._latest] <= after_seq):
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._closed:
+                return None
+
+            index = self._latest
+            seq = self._slot_seq[index]
+            self._held = index
+            self.stats['read'] += 1
+            if self._last_read_seq and seq > self._last_read_seq + 1:
+                self.stats['dropped'] += seq - self._last_read_seq - 1
+            self._last_read_seq = seq
+            return CapturedFrame(index, seq, self._buffers[index], self._slot_time[index],
+                                 self._slot_geometry[index], self._slot_rects[index])
+
+    def release(self):
+        """释放读取方占用的帧（之后该帧的缓冲区可能被覆盖）"""
+        with self._cond:
+            self._held = None
+
+    def close(self):
+        """关闭帧环，唤醒等待中的读取方"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reset(self):
+        with self._cond:
+            self._closed = False
+            self._latest = None
+            self._held = None
+            self._slot_seq = [0] * self.slots
+            self._last_read_seq = 0
+            self.stats = {'written': 0, 'read': 0, 'dropped': 0, 'allocations': 0}
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['slots'] = self.slots
+            stats['buffer_bytes'] = sum(buffer.nbytes for buffer in self._buffers if buffer is not None)
+            stats['latest_seq'] = self._seq
+        return stats
+
+
+class CaptureThread:
+    """截图线程 - 独立于匹配循环按固定帧率截图并写入帧环，截图与匹配流水线并行
+
+    capture_func() 返回截图（numpy数组）或 None；geometry_func() 返回截图对应的窗口几何信息；
+    rects_func() 返回截图实际截取的矩形（局部截图），None 表示整帧。
+    """
+
+    def __init__(self, capture_func, geometry_func=None, ring=None, fps=30.0, retry_interval=0.5, rects_func=None):
+        self.capture_func = capture_func
+        self.geometry_func = geometry_func
+        self.rects_func = rects_func
+        self.ring = ring if ring is not None else FrameRing()
+        self.fps = fps  # 最高截图帧率
+        self.retry_interval = retry_interval  # 截图失败后的重试间隔（秒）
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'captures': 0, 'failures': 0, 'capture_time': 0.0}
+        self.last_error = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.ring.reset()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='capture-thread', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.ring.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                image = self.capture_func()
+            except Exception as e:
+                print(f"[截图线程] 截图异常: {e}")
+                self.last_error = str(e)
+                image = None
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.stats['capture_time'] += elapsed
+                if image is None:
+                    self.stats['failures'] += 1
+                else:
+                    self.stats['captures'] += 1
+
+            if image is None:
+                self._stop_event.wait(self.retry_interval)
+                continue
+
+            geometry = self.geometry_func() if self.geometry_func is not None else None
+            rects = self.rects_func() if self.rects_func is not None else None
+            self.ring.write(image, geometry, rects)
+
+            # 按截止时间控制截图帧率
+            remaining = 1.0 / max(0.1, self.fps) - (time.perf_counter() - start)
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        captures = stats['captures'] + stats['failures']
+        stats['avg_capture_time'] = stats['capture_time'] / captures if captures else 0.0
+        stats['ring'] = self.ring.get_stats()
+        return stats
@@ -4,7 +4,13 @@ import os
 import math
 import queue
 from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
+
+from .folder_watcher import FolderWatcher
+from .frame_pacer import FramePacer
+from .frame_recorder import FrameRecorder
+from .capture_ring import CaptureThread, FrameRing
+from .process_backend import ProcessMatchingBackend
+from .template_scheduler import TemplateScheduler
 
 class Controller:
     """控制器类 - 支持多线程匹配、螺旋点击策略和优先级控制"""
@@ -17,8 +23,22 @@ class Controller:
         self.is_running = False
         self.target_window_id = None
         self.global_click_interval = 1.0
+        self.preempt_priority_max = 2  # 优先级不超过该值的模板命中且可点击时，本帧不再匹配更低优先级的模板
+        self.deterministic_scheduling = False  # 每帧匹配所有模板（不抢占、不取消），结果与线程调度时序无关（录制和回放复现时使用）
+        self.frame_clock = 0.0  # 当前帧的时间（time.perf_counter 时间轴，回放录制时为录制的帧时间），点击间隔按它判断
         self.multi_match_mode = "spiral"  # spiral, nearest, all
-        self.thread_count = 2  # 匹配线程数
+        self.thread_count = 2  # 匹配线程数（多进程后端时为进程数）
+        self.matching_backend = 'thread'  # thread: 线程池 / process: 进程池（不受GIL限制）
+        self.template_scheduler = TemplateScheduler()  # 共享队列调度，按历史耗时安排同优先级模板
+        self.frame_timeout = 5.0  # 单帧匹配超时（秒），超时后使用已完成的结果
+        self.frame_pacer = FramePacer()  # 按截止时间控制循环节奏（替代固定等待），默认每0.25秒一帧，更高帧率通过 set_target_fps 启用
+        self.capture_thread_enabled = False  # 独立截图线程，截图与匹配并行（需通过 set_capture_thread 启用）
+        self.capture_ring_slots = 3  # 截图帧环的槽数（固定内存占用）
+        self.capture_thread = None
+        self.partial_capture_enabled = False  # 局部截图：只截取模板搜索区域的并集（需通过 set_partial_capture 启用）
+        self.incremental_matching = False  # 增量匹配：只在帧间变化区域重新匹配
+        self.lazy_template_loading = False  # 延迟加载：文件夹模板首次匹配时才解码
+        self.frame_recorder = None  # 帧录制：截图及每帧的匹配、点击事件写入环形文件（用于回放复现）
         
         # 每个模板的独立设置 - 添加优先级支持
         self.template_settings = {
@@ -27,28 +47,36 @@ class Controller:
                 'enabled': True,
                 'priority': 1,  # 新增优先级字段
                 'last_click_time': 0,
-                'image_path': None
+                'image_path': None,
+                'search_region': None,  # 搜索区域 (x, y, width, height)，None 表示整帧
+                'auto_region': False  # 根据历史命中位置自动学习搜索区域
             },
             2: {
                 'click_button': 'right', 
                 'enabled': True,
                 'priority': 2,
                 'last_click_time': 0,
-                'image_path': None
+                'image_path': None,
+                'search_region': None,  # 搜索区域 (x, y, width, height)，None 表示整帧
+                'auto_region': False  # 根据历史命中位置自动学习搜索区域
             },
             3: {
                 'click_button': 'left', 
                 'enabled': True,
                 'priority': 3,
                 'last_click_time': 0,
-                'image_path': None
+                'image_path': None,
+                'search_region': None,  # 搜索区域 (x, y, width, height)，None 表示整帧
+                'auto_region': False  # 根据历史命中位置自动学习搜索区域
             },
             4: {
                 'click_button': 'right', 
                 'enabled': True,
                 'priority': 4,
                 'last_click_time': 0,
-                'image_path': None
+                'image_path': None,
+                'search_region': None,  # 搜索区域 (x, y, width, height)，None 表示整帧
+                'auto_region': False  # 根据历史命中位置自动学习搜索区域
             }
         }
         
@@ -63,11 +91,17 @@ class Controller:
         self.log_callback = None
         self.match_callback = None
         self.performance_callback = None
+        self.folder_change_callback = None
+        
+        # 模板文件夹热重载：定期扫描已加载的文件夹，只应用变化的文件
+        self.template_folders = {}  # 文件夹名称 -> folder_info
+        self.folder_watcher = FolderWatcher(self.on_template_folder_changed)
         
         # 线程控制
         self.matching_thread = None
         self.stop_event = threading.Event()
         self.executor = None
+        self.process_backend = None
         
         # 性能监控
         self.last_fps_time = time.time()
@@ -92,15 +126,222 @@ class Controller:
         """设置性能回调函数"""
         self.performance_callback = callback
         
+    def set_folder_change_callback(self, callback):
+        """设置模板文件夹变化回调函数 callback(folder_info, changes)，在监视线程中调用"""
+        self.folder_change_callback = callback
+        
     def set_multi_match_mode(self, mode):
         """设置多匹配模式"""
         self.multi_match_mode = mode
         self.emit_log(f"设置多匹配模式: {mode}")
 
+    def set_pyramid_mode(self, enabled, levels=None):
+        """设置金字塔（由粗到精）匹配模式"""
+        if self.image_matcher.set_pyramid_mode(enabled, levels):
+            status = "启用" if enabled else "禁用"
+            self.emit_log(f"金字塔匹配已{status}, 层数: {self.image_matcher.pyramid_levels}")
+            
+    def set_multiscale_mode(self, enabled):
+        """设置多尺度匹配模式 - 目标窗口缩放比例变化后自动适配模板尺寸"""
+        if self.image_matcher.set_multiscale_mode(enabled):
+            self.emit_log(f"多尺度匹配已{'启用' if enabled else '禁用'}")
+            
+    def set_cascade_mode(self, enabled):
+        """设置排除级联模式 - 先用廉价测试排除不在画面中的模板"""
+        self.image_matcher.set_cascade_mode(enabled)
+        self.emit_log(f"排除级联已{'启用' if enabled else '禁用'}")
+        
+    def set_tracking_mode(self, enabled):
+        """设置跟踪模式 - 模板命中后下一帧优先在原位置附近搜索"""
+        self.image_matcher.set_tracking_mode(enabled)
+        self.emit_log(f"跟踪模式已{'启用' if enabled else '禁用'}")
+        
+    def set_incremental_mode(self, enabled):
+        """设置增量匹配模式 - 只在相邻两帧有变化的区域重新匹配"""
+        self.incremental_matching = bool(enabled)
+        self.image_matcher.set_incremental_mode(enabled)
+        self.emit_log(f"增量匹配模式已{'启用' if enabled else '禁用'}")
+        
+    def set_lazy_template_loading(self, enabled):
+        """设置文件夹模板延迟加载 - 加载时只读取文件头，首次匹配时解码"""
+        self.lazy_template_loading = bool(enabled)
+        self.emit_log(f"模板延迟加载已{'启用' if self.lazy_template_loading else '禁用'}")
+        
+    def set_target_fps(self, fps):
+        """设置正常匹配时的目标帧率（截图线程使用相同的帧率）"""
+        self.frame_pacer.set_target_fps(fps)
+        if self.capture_thread is not None:
+            self.capture_thread.fps = self.frame_pacer.target_fps
+        self.emit_log(f"目标帧率: {self.frame_pacer.target_fps:.1f}")
+        
+    def set_capture_thread(self, enabled, slots=None):
+        """设置是否使用独立截图线程（下次开始匹配时生效）"""
+        self.capture_thread_enabled = bool(enabled)
+        if slots is not None:
+            self.capture_ring_slots = max(3, int(slots))
+        self.emit_log(f"独立截图线程: {'启用' if self.capture_thread_enabled else '禁用'}, 帧环槽数: {self.capture_ring_slots}")
+        
+    def start_capture_thread(self):
+        """启动截图线程，截图写入预分配的帧环"""
+        self.stop_capture_thread()
+        self.capture_thread = CaptureThread(self.window_manager.get_window_screenshot,
+                                            lambda: self.window_manager.last_capture_geometry,
+                                            ring=FrameRing(self.capture_ring_slots),
+                                            fps=self.frame_pacer.target_fps,
+                                            retry_interval=self.frame_pacer.get_interval('capture_retry'),
+                                            rects_func=lambda: self.window_manager.last_capture_rects)
+        self.capture_thread.start()
+        
+    def stop_capture_thread(self):
+        """停止截图线程"""
+        if self.capture_thread is not None:
+            try:
+                self.capture_thread.stop()
+                stats = self.capture_thread.get_stats()
+                ring_stats = stats['ring']
+                self.emit_log(f"截图线程已停止: 截图 {stats['captures']}, 失败 {stats['failures']}, "
+                              f"平均耗时 {stats['avg_capture_time']:.3f}秒, 丢弃旧帧 {ring_stats['dropped']}, "
+                              f"帧环内存 {ring_stats['buffer_bytes'] / 1024 / 1024:.1f}MB")
+            except Exception as e:
+                self.emit_log(f"停止截图线程失败: {e}")
+            self.capture_thread = None
+            
+    def get_next_screenshot(self, last_seq):
+        """获取下一帧截图
+        
+        Returns:
+            tuple: (截图, 帧序号, 截图几何, 局部截图矩形, 截图耗时或帧延迟)；没有截图时截图为 None
+        """
+        if self.capture_thread is None:
+            screenshot_start = time.time()
+            screenshot = self.window_manager.get_window_screenshot()
+            return (screenshot, last_seq + 1, None, self.window_manager.last_capture_rects,
+                    time.time() - screenshot_start)
+        
+        # 截图线程：取最新的一帧，等待时间不超过截图重试间隔
+        captured = self.capture_thread.ring.get_latest(after_seq=last_seq,
+                                                       timeout=self.frame_pacer.get_interval('capture_retry'))
+        if captured is None:
+            return None, last_seq, None, None, 0.0
+        return captured.image, captured.seq, captured.geometry, captured.rects, captured.get_age()
+        
+    def start_recording(self, path, max_bytes=512 * 1024 * 1024, compression='zlib', max_fps=None):
+        """开始录制匹配循环处理的截图帧和匹配、点击事件（可在匹配运行中开始）"""
+        self.stop_recording()
+        session_info = {
+            'source': getattr(self.window_manager.frame_source, 'name', None),
+            'target_window': str(self.target_window_id),
+            'templates': {tid: settings.get('image_path') for tid, settings in self.template_settings.items()
+                          if settings.get('enabled')},
+            'multi_match_mode': self.multi_match_mode,
+            'target_fps': self.frame_pacer.target_fps
+        }
+        try:
+            recorder = FrameRecorder(path, max_bytes=max_bytes, compression=compression, max_fps=max_fps,
+                                     session_info=session_info)
+            recorder.open()
+        except Exception as e:
+            self.emit_log(f"开始帧录制失败: {e}")
+            return False
+        self.frame_recorder = recorder
+        self.emit_log(f"开始帧录制: {path} (环形文件 {recorder.max_bytes / 1024 / 1024:.0f}MB, 压缩: {compression or '无'})")
+        return True
+        
+    def stop_recording(self):
+        """停止帧录制，写完剩余的记录"""
+        recorder = self.frame_recorder
+        if recorder is None:
+            return
+        self.frame_recorder = None
+        try:
+            recorder.close()
+            stats = recorder.get_stats()
+            self.emit_log(f"帧录制已停止: {stats['frames']} 帧, {stats['events']} 个事件, 丢弃 {stats['dropped']} 帧, "
+                          f"写入 {stats['written_bytes'] / 1024 / 1024:.1f}MB (压缩比 {stats['compression_ratio']:.2f})")
+        except Exception as e:
+            self.emit_log(f"停止帧录制失败: {e}")
+            
+    def record_event(self, event_type, **data):
+        """录制当前帧的事件（未录制时忽略）"""
+        recorder = self.frame_recorder
+        if recorder is not None:
+            recorder.record_event(event_type, **data)
+        
+    def set_partial_capture(self, enabled):
+        """设置局部截图：所有启用的模板都有搜索区域时只截取这些区域"""
+        self.partial_capture_enabled = bool(enabled)
+        if not self.partial_capture_enabled:
+            self.window_manager.set_capture_rects(None)
+        self.emit_log(f"局部截图: {'启用' if self.partial_capture_enabled else '禁用'}")
+        
+    def set_preselect_search_region(self, region):
+        """设置预选项搜索区域 (x, y, width, height)，None 表示整帧"""
+        success = self.image_matcher.set_preselect_search_region(region)
+        self.emit_log(f"预选项搜索区域: {self.image_matcher.preselect_search_region or '整帧'}")
+        return success
+        
+    def update_capture_rects(self, template_ids):
+        """根据本帧要匹配的模板规划之后的截图范围（搜索区域的并集，任一模板需要整帧时截取整帧）"""
+        rects = None
+        geometry = self.window_manager.last_capture_geometry
+        if self.partial_capture_enabled and geometry is not None:
+            rects = self.image_matcher.get_capture_rects(
+                template_ids, (geometry[1], geometry[2]),
+                include_preselect=self.preselect_enabled and bool(self.preselect_image_path))
+        if rects != self.window_manager.capture_rects:
+            self.window_manager.set_capture_rects(rects)
+            if rects:
+                area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+                self.emit_log(f"局部截图范围: {len(rects)} 个矩形, 占整帧 {area / max(1, geometry[1] * geometry[2]):.0%}")
+            else:
+                self.emit_log("局部截图范围: 整帧")
+        
+    def set_frame_budget(self, seconds):
+        """设置单帧匹配时间预算（秒），超出预算时取消尚未完成的匹配；None 表示只受 frame_timeout 限制"""
+        self.frame_pacer.frame_budget = None if seconds is None else max(0.01, float(seconds))
+        self.emit_log(f"单帧时间预算: {self.frame_pacer.frame_budget}")
+        
+    def set_deterministic_scheduling(self, enabled):
+        """设置确定性调度 - 命中不再跳过或取消其他模板，每帧所有模板都完成匹配
+
+        跟踪、学习区域等逐帧状态不再取决于哪些模板恰好在命中前完成，同一录制的多次回放点击顺序一致。
+        """
+        self.deterministic_scheduling = bool(enabled)
+        self.emit_log(f"确定性调度已{'启用' if self.deterministic_scheduling else '禁用'}")
+        
+    def set_frame_cadence(self, state, seconds):
+        """设置某个循环状态的帧间隔（idle/in_round/post_click/round_transition/capture_retry/error）"""
+        try:
+            self.frame_pacer.set_cadence(state, seconds)
+            self.emit_log(f"循环状态 {state} 帧间隔: {self.frame_pacer.get_interval(state):.3f}秒")
+            return True
+        except ValueError as e:
+            self.emit_log(f"设置帧间隔失败: {e}")
+            return False
+            
     def set_thread_count(self, count):
-        """设置线程数"""
-        self.thread_count = max(1, min(4, int(count)))
-        self.emit_log(f"设置匹配线程数: {self.thread_count}")
+        """设置线程数（多进程后端时可使用所有CPU核心）"""
+        max_count = (os.cpu_count() or 1) if self.matching_backend == 'process' else 4
+        self.thread_count = max(1, min(max_count, int(count)))
+        self.emit_log(f"设置匹配{'进程' if self.matching_backend == 'process' else '线程'}数: {self.thread_count}")
+        
+    def set_matching_backend(self, backend):
+        """设置匹配后端: thread(线程池) / process(进程池，共享内存传递截图)，下次开始匹配时生效
+
+        进程池后端不使用跟踪、学习搜索区域和增量匹配（见 ProcessMatchingBackend）。
+        """
+        if backend not in ('thread', 'process'):
+            self.emit_log(f"不支持的匹配后端: {backend}")
+            return False
+        self.matching_backend = backend
+        self.set_thread_count(self.thread_count)
+        if self.is_running:
+            self.emit_log(f"匹配后端将在重新开始匹配后切换为: {backend}")
+        else:
+            self.emit_log(f"匹配后端: {backend}")
+        if backend == 'process':
+            self.emit_log("多进程匹配后端不使用跟踪、学习搜索区域和增量匹配")
+        return True
 
     def set_template_priority(self, template_id, priority):
         """设置模板优先级"""
@@ -115,27 +356,30 @@ class Controller:
         else:
             self.emit_log(f"无效的模板ID: {template_id}")
         
-    def get_priority_sorted_templates(self):
-        """获取按优先级排序的模板列表"""
+    def get_priority_sorted_templates(self, verbose=True):
+        """获取按优先级排序的模板列表（匹配循环每帧调用时 verbose=False，不逐个输出日志）"""
         try:
             enabled_templates = []
-            for tid, settings in self.template_settings.items():
+            # 复制一份，文件夹热重载可能在其他线程中增删模板
+            for tid, settings in list(self.template_settings.items()):
                 # 检查模板是否启用
                 if settings['enabled']:
                     # 检查模板是否在image_matcher中
                     if tid in self.image_matcher.template_images:
                         enabled_templates.append((tid, settings['priority']))
-                        self.emit_log(f"添加启用的模板 {tid}: 优先级={settings['priority']}")
-                    else:
+                        if verbose:
+                            self.emit_log(f"添加启用的模板 {tid}: 优先级={settings['priority']}")
+                    elif verbose:
                         self.emit_log(f"警告: 模板 {tid} 不在image_matcher中，跳过")
-                else:
+                elif verbose:
                     self.emit_log(f"模板 {tid} 未启用，跳过")
             
             # 按优先级排序（数字越小优先级越高）
             enabled_templates.sort(key=lambda x: x[1])
             result = [tid for tid, _ in enabled_templates]
             
-            self.emit_log(f"返回 {len(result)} 个启用的模板: {result}")
+            if verbose:
+                self.emit_log(f"返回 {len(result)} 个启用的模板: {result}")
             return result
         except Exception as e:
             self.emit_log(f"获取启用模板列表失败: {e}")
@@ -178,6 +422,19 @@ class Controller:
             self.emit_log(f"设置目标窗口失败: {window_id}")
         return success
         
+    def set_frame_source(self, source):
+        """设置截图源（回放/合成截图源，None 恢复为目标窗口），截图源的标识作为目标窗口"""
+        if self.is_running:
+            self.emit_log("请先暂停匹配再切换截图源")
+            return False
+        if not self.window_manager.set_frame_source(source):
+            self.emit_log(f"打开截图源失败: {getattr(source, 'name', source)}")
+            return False
+        self.target_window_id = self.window_manager.target_window_id
+        self.image_matcher.reset_window_scales()
+        self.emit_log(f"截图源: {source.name if source is not None else '目标窗口'}")
+        return True
+        
     def set_template_image(self, template_id, image_path):
         """设置模板图像"""
         try:
@@ -226,6 +483,55 @@ class Controller:
             print(f"[调试] 错误详情: {traceback.format_exc()}")
             return False
         
+    def set_template_color_mode(self, template_id, mode):
+        """设置指定模板的颜色匹配模式（color/gray/auto）"""
+        if template_id not in self.template_settings:
+            self.emit_log(f"无效的模板ID: {template_id}")
+            return False
+            
+        if self.image_matcher.set_template_color_mode(template_id, mode):
+            self.template_settings[template_id]['color_mode'] = mode
+            self.emit_log(f"图片{template_id}颜色匹配模式: {mode}")
+            return True
+        return False
+        
+    def set_template_search_region(self, template_id, region):
+        """设置指定模板的搜索区域 (x, y, width, height)，None 表示整帧搜索"""
+        if template_id not in self.template_settings:
+            self.emit_log(f"无效的模板ID: {template_id}")
+            return False
+            
+        if self.image_matcher.set_template_search_region(template_id, region):
+            self.template_settings[template_id]['search_region'] = tuple(region) if region is not None else None
+            self.emit_log(f"图片{template_id}搜索区域: {region if region is not None else '整帧'}")
+            return True
+        return False
+        
+    def set_template_bank_engine(self, template_ids, engine):
+        """设置一组模板（模板库）使用的匹配引擎: opencv 或 fft"""
+        template_ids = [template_id for template_id in template_ids if template_id in self.template_settings]
+        if not template_ids:
+            self.emit_log("没有有效的模板ID")
+            return False
+            
+        if self.image_matcher.set_template_engine(template_ids, engine):
+            for template_id in template_ids:
+                self.template_settings[template_id]['engine'] = engine
+            self.emit_log(f"{len(template_ids)} 个模板使用匹配引擎: {engine}")
+            return True
+        return False
+        
+    def set_template_auto_region(self, template_id, enabled):
+        """启用/禁用指定模板的搜索区域自动学习"""
+        if template_id not in self.template_settings:
+            self.emit_log(f"无效的模板ID: {template_id}")
+            return False
+            
+        self.image_matcher.set_template_region_learning(template_id, enabled)
+        self.template_settings[template_id]['auto_region'] = bool(enabled)
+        self.emit_log(f"图片{template_id}搜索区域自动学习: {'启用' if enabled else '禁用'}")
+        return True
+        
     def set_global_click_interval(self, interval):
         """设置全局点击间隔"""
         try:
@@ -235,16 +541,13 @@ class Controller:
             self.emit_log(f"无效的间隔时间: {interval}")
     
     def get_window_center(self):
-        """获取窗口中心位置 - 基于客户区"""
+        """获取窗口中心位置 - 基于客户区（回放/合成截图源时为画面中心）"""
         try:
-            if self.window_manager.target_window_handle:
-                import win32gui
-                # 获取客户区矩形
-                client_rect = win32gui.GetClientRect(self.window_manager.target_window_handle)
-                left, top, right, bottom = client_rect
-                center_x = (left + right) // 2
-                center_y = (top + bottom) // 2
-                print(f"窗口客户区中心: ({center_x}, {center_y}), 客户区大小: {right}x{bottom}")
+            # 使用窗口几何缓存（每帧截图时刷新），不再每次查询窗口
+            geometry = self.window_manager.get_geometry()
+            if geometry is not None:
+                center_x, center_y = geometry.center
+                print(f"窗口客户区中心: ({center_x}, {center_y}), 客户区大小: {geometry.client_width}x{geometry.client_height}")
                 return (center_x, center_y)
             return None
         except Exception as e:
@@ -326,14 +629,36 @@ class Controller:
             return
         else:
             self.emit_log(f"截图测试成功，尺寸: {test_screenshot.shape}")
+        # 录制回放截图源从第一帧开始（测试截图不占用录制的帧）
+        rewind = getattr(self.window_manager.frame_source, 'rewind', None)
+        if rewind is not None:
+            rewind()
             
         self.is_running = True
         self.stop_event.clear()
         self.priority_interrupt.clear()
         
-        # 创建线程池
+        # 创建线程池（多进程后端时只用于提交任务）
         self.executor = ThreadPoolExecutor(max_workers=self.thread_count)
         
+        if self.matching_backend == 'process':
+            try:
+                self.process_backend = ProcessMatchingBackend(self.thread_count)
+                self.process_backend.start(self.image_matcher)
+            except Exception as e:
+                self.emit_log(f"启动多进程匹配后端失败，使用线程池: {e}")
+                self.stop_process_backend()
+        
+        # 第一帧整帧截图，之后按模板搜索区域规划局部截图
+        self.window_manager.set_capture_rects(None)
+        
+        if self.capture_thread_enabled:
+            try:
+                self.start_capture_thread()
+            except Exception as e:
+                self.emit_log(f"启动截图线程失败，在匹配循环中截图: {e}")
+                self.capture_thread = None
+        
         # 重置性能计数器
         self.last_fps_time = time.time()
         self.fps_counter = 0
@@ -364,46 +689,36 @@ class Controller:
             self.executor.shutdown(wait=False)
             self.executor = None
         
+        if self.capture_thread is not None:
+            # 唤醒等待截图的匹配循环
+            self.capture_thread.ring.close()
         if self.matching_thread and self.matching_thread.is_alive():
             self.matching_thread.join(timeout=2)
+            
+        self.stop_process_backend()
+        self.stop_capture_thread()
         
         self.emit_log("已暂停多线程优先级匹配")
         
-    def process_template_batch_by_priority(self, screenshot, template_ids):
-        """按优先级处理一批模板匹配（在线程池中执行）"""
-        results = {}
-        try:
-            # 按优先级排序处理
-            sorted_templates = []
-            for template_id in template_ids:
-                if template_id in self.template_settings:
-                    priority = self.template_settings[template_id]['priority']
-                    sorted_templates.append((template_id, priority))
-            
-            # 按优先级排序（数字越小优先级越高）
-            sorted_templates.sort(key=lambda x: x[1])
-            
-            for template_id, priority in sorted_templates:
-                if not self.is_running:
-                    break
-                    
-                if not self.template_settings[template_id]['enabled']:
-                    continue
-                    
-                result = self.image_matcher.find_template(screenshot, template_id)
-                if result and result.get('found', False):
-                    # 找到高优先级匹配，立即返回
-                    results[template_id] = result
-                    self.emit_log(f"高优先级匹配: 图片{template_id}(优先级{priority})")
-                    break  # 找到高优先级匹配后停止处理低优先级
-                elif result:
-                    results[template_id] = result
-                    
-        except Exception as e:
-            print(f"优先级批处理模板匹配失败: {e}")
-        
-        return results
+    def get_match_timeout(self):
+        """本帧调度的超时：帧时间预算的剩余部分（不超过 frame_timeout）"""
+        remaining = self.frame_pacer.get_remaining_budget()
+        if remaining is None:
+            return self.frame_timeout
+        return min(self.frame_timeout, remaining)
         
+    def stop_process_backend(self):
+        """停止多进程匹配后端"""
+        if self.process_backend is not None:
+            try:
+                stats = self.process_backend.get_stats()
+                self.process_backend.shutdown()
+                self.emit_log(f"多进程匹配后端已停止: 帧 {stats['frames']}, 批次 {stats['batches']}, "
+                              f"过期批次 {stats['stale_batches']}, 重启 {stats['restarts']}")
+            except Exception as e:
+                self.emit_log(f"停止多进程匹配后端失败: {e}")
+            self.process_backend = None
+            
     def set_preselect_image(self, image_path):
         """设置预选项图片 - 强化版本"""
         try:
@@ -531,32 +846,48 @@ class Controller:
         loop_count = 0
         last_preselect_check = 0  # 上次预选项检查时间
         preselect_check_interval = 0.15  # 预选项检查间隔（秒）
+        last_capture_seq = 0  # 上一帧的序号（截图线程模式下不重复匹配同一帧）
         
+        self.frame_pacer.reset_stats()
         while not self.stop_event.is_set() and self.is_running:
             try:
                 loop_count += 1
-                current_time = time.time()
+                self.frame_pacer.begin_frame()
                 
                 # 更新FPS计算
                 self.update_fps()
                 
-                # 获取窗口截图
-                screenshot_start = time.time()
-                screenshot = self.window_manager.get_window_screenshot()
-                screenshot_time = time.time() - screenshot_start
+                # 获取窗口截图（截图线程模式下取帧环中最新的一帧，中间的旧帧跳过）
+                screenshot, last_capture_seq, capture_geometry, capture_rects, screenshot_time = \
+                    self.get_next_screenshot(last_capture_seq)
                 
                 if screenshot is None:
+                    if self.stop_event.is_set():
+                        break
                     if loop_count % 10 == 1:
-                        self.emit_log("获取截图失败，等待0.5秒后重试")
-                    time.sleep(0.5)
+                        self.emit_log(f"获取截图失败，{self.frame_pacer.get_interval('capture_retry'):.1f}秒后重试")
+                    if self.capture_thread is None:
+                        self.frame_pacer.wait('capture_retry', self.stop_event)
                     continue
                 
+                # 帧时间：回放录制时使用录制的帧时间，点击间隔等判断与录制时一致
+                frame_time = self.window_manager.frame_source.get_frame_time()
+                self.frame_clock = frame_time if frame_time is not None else time.perf_counter()
+                current_time = self.frame_clock
+                
+                # 录制本帧（只复制像素，压缩写入在后台线程）
+                if self.frame_recorder is not None:
+                    self.frame_recorder.record_frame(screenshot, last_capture_seq, capture_rects, timestamp=self.frame_clock)
+                
+                # 创建帧上下文：金字塔等派生数据每帧只构建一次，所有线程共享
+                frame = self.image_matcher.begin_frame(screenshot, capture_geometry, capture_rects)
+                
                 # [预选项] 第一优先级：检查预选项条件（最高优先级！）
                 if self.preselect_enabled and self.preselect_image_path:
                     # 控制预选项检查频率
                     if current_time - last_preselect_check >= preselect_check_interval:
                         last_preselect_check = current_time
-                        preselect_result = self.image_matcher.find_preselect_image(screenshot)
+                        preselect_result = self.image_matcher.find_preselect_image(frame)
                         
                         if preselect_result and preselect_result.get('found', False):
                             # 检测到预选项图片（进入回合），立即暂停所有动作
@@ -564,34 +895,35 @@ class Controller:
                             confidence = preselect_result.get('confidence', 0)
                             
                             if not self.preselect_detected:
+                                self.record_event('preselect', detected=True, position=position, confidence=confidence)
                                 self.preselect_detected = True
                                 self.preselect_pause_mode = True
                                 self.emit_log(f"[预选项] [最高优先级] 检测到预选项图片! 位置: {position}, 置信度: {confidence:.3f} - 进入回合，立即暂停所有匹配")
                                 # 进入回合时，等待较长时间确保状态稳定
-                                time.sleep(0.5)
+                                self.frame_pacer.wait('round_transition', self.stop_event)
+                                continue
                             
                             # 每10次循环输出一次状态
                             if loop_count % 10 == 1:
                                 self.emit_log(f"[预选项] [最高优先级] 回合中 - 保持暂停状态 (置信度: {confidence:.3f})")
                             
                             # 在回合中，直接跳过所有其他处理
-                            time.sleep(0.2)  # 增加回合中的等待时间
+                            self.frame_pacer.wait('in_round', self.stop_event)
                             continue
                         else:
                             # 没有检测到预选项图片
                             if self.preselect_detected:
-                                # 回合结束，等待较长时间确保状态完全转换
-                                time.sleep(0.5)
+                                # 回合结束，等待状态完全转换后再开始新一轮匹配
+                                self.record_event('preselect', detected=False)
                                 self.preselect_detected = False
                                 self.preselect_pause_mode = False
                                 self.emit_log(f"[预选项] [最高优先级] 回合结束 - 恢复匹配和点击动作")
-                                # 回合结束后，等待较长时间再开始新一轮匹配
-                                time.sleep(0.3)
+                                self.frame_pacer.wait('round_transition', self.stop_event)
                                 continue
                 
                 # 如果预选项启用且检测到（回合中），直接跳过所有后续处理
                 if self.preselect_enabled and (self.preselect_detected or self.preselect_pause_mode):
-                    time.sleep(0.2)  # 增加回合中的等待时间
+                    self.frame_pacer.wait('in_round', self.stop_event)
                     continue
                 
                 # 只有在回合外（没有检测到预选项）时才处理普通模板
@@ -599,134 +931,111 @@ class Controller:
                     self.emit_log(f"回合外匹配运行中... 第{loop_count}次, FPS: {self.current_fps:.1f}")
                 
                 # 获取当前按优先级排序的启用模板
-                enabled_templates = self.get_priority_sorted_templates()
+                enabled_templates = self.get_priority_sorted_templates(verbose=False)
                 if not enabled_templates:
-                    time.sleep(0.5)
+                    self.frame_pacer.wait('idle', self.stop_event)
                     continue
+                    
+                # 本帧需要匹配的模板，FFT引擎只批量计算这些模板
+                frame.active_template_ids = set(enabled_templates)
                 
-                if loop_count % 50 == 1:  # 减少日志频率
-                    self.emit_log(f"获取截图成功，尺寸: {screenshot.shape}, 耗时: {screenshot_time:.3f}秒")
+                # 规划之后的截图范围（本帧已按上一次的规划截取）
+                self.update_capture_rects(enabled_templates)
                 
-                # 继续处理普通模板的匹配逻辑...
-                # 按优先级分组处理模板
-                high_priority_templates = [tid for tid in enabled_templates if self.template_settings[tid]['priority'] <= 2]
-                low_priority_templates = [tid for tid in enabled_templates if self.template_settings[tid]['priority'] > 2]
+                # 多进程后端：截图只写入一次共享内存，各进程直接读取
+                frame_handle = None
+                if self.process_backend is not None:
+                    frame_handle = self.process_backend.publish_frame(self.image_matcher, frame,
+                                                       capture_geometry or getattr(self.window_manager, 'last_capture_geometry', None))
                 
-                # 优先处理高优先级模板
-                match_start = time.time()
-                found_high_priority = False
+                if loop_count % 50 == 1:  # 减少日志频率
+                    if self.capture_thread is not None:
+                        self.emit_log(f"获取截图成功，尺寸: {screenshot.shape}, 帧序号: {last_capture_seq}, 帧延迟: {screenshot_time:.3f}秒")
+                    else:
+                        self.emit_log(f"获取截图成功，尺寸: {screenshot.shape}, 耗时: {screenshot_time:.3f}秒")
                 
-                if high_priority_templates:
-                    # 高优先级模板并行处理
-                    high_priority_batches = []
-                    batch_size = max(1, len(high_priority_templates) // self.thread_count)
-                    for i in range(0, len(high_priority_templates), batch_size):
-                        batch = high_priority_templates[i:i + batch_size]
-                        high_priority_batches.append(batch)
-                    
-                    high_priority_futures = []
-                    for batch in high_priority_batches:
-                        if not self.is_running:
-                            break
-                        future = self.executor.submit(self.process_template_batch_by_priority, screenshot, batch)
-                        high_priority_futures.append(future)
-                    
-                    # 收集高优先级结果
-                    for future in concurrent.futures.as_completed(high_priority_futures, timeout=0.8):
-                        try:
-                            batch_results = future.result(timeout=0.3)
-                            if batch_results:
-                                # 找到高优先级匹配，立即处理
-                                for template_id, result in batch_results.items():
-                                    if result and result.get('found', False):
-                                        # 再次检查是否进入回合
-                                        if self.preselect_enabled and self.preselect_detected:
-                                            self.emit_log(f"图片{template_id}匹配被跳过: 检测到回合状态")
-                                            continue
-                                        
-                                        if self.handle_multiple_matches(template_id, result):
-                                            self.emit_match(template_id, result)
-                                            found_high_priority = True
-                                            break
-                            if found_high_priority:
-                                break
-                        except concurrent.futures.TimeoutError:
-                            continue
-                        except Exception as e:
-                            if loop_count % 20 == 1:
-                                self.emit_log(f"高优先级匹配任务异常: {e}")
-                            continue
+                # 共享队列调度：工作线程按优先级领取模板，直到本帧全部完成或出现命中
+                match_start = time.time()
+                priorities = {tid: self.template_settings[tid]['priority'] for tid in enabled_templates}
+                preempt_ids = self.get_preempt_templates(enabled_templates)
+                if self.process_backend is not None:
+                    # 多进程后端：按优先级交错分批，每个进程每帧只接收一个任务
+                    # 优先级以模板设置为准（匹配器中只有文件夹模板登记了优先级）
+                    results = self.template_scheduler.run_batches(
+                        lambda batch: self.process_backend.submit(batch, priorities.__getitem__, frame, preempt_ids),
+                        self.thread_count, enabled_templates, priorities,
+                        timeout=self.get_match_timeout(), frame=frame)
+                    if frame.is_cancelled():
+                        # 超时：工作进程看不到本进程的取消令牌，通过帧槽通知剩余模板不再匹配
+                        self.process_backend.cancel_frame(frame_handle)
+                else:
+                    results = self.template_scheduler.run(
+                        self.executor, self.thread_count, enabled_templates, priorities,
+                        lambda tid: self.image_matcher.find_template(frame, tid),
+                        should_stop=lambda: not self.is_running or (self.preselect_enabled and self.preselect_detected),
+                        timeout=self.get_match_timeout(), frame=frame, preempt_ids=preempt_ids)
                 
-                # 如果没有高优先级匹配，处理低优先级模板
-                if not found_high_priority and low_priority_templates and self.is_running:
+                # 按优先级顺序处理结果，第一个成功点击的匹配生效
+                matched_priority = None
+                if self.frame_recorder is not None:
+                    for template_id in enabled_templates:
+                        result = results.get(template_id)
+                        if result and result.get('found', False):
+                            self.record_event('match', template_id=template_id, position=result.get('position'),
+                                              confidence=result.get('confidence'),
+                                              match_count=result.get('match_count', 1))
+                for template_id in enabled_templates:  # 已排序
+                    result = results.get(template_id)
+                    if not result or not result.get('found', False):
+                        continue
                     # 再次检查是否进入回合
                     if self.preselect_enabled and self.preselect_detected:
-                        time.sleep(0.2)  # 增加回合中的等待时间
-                        continue
-                        
-                    low_priority_batches = []
-                    batch_size = max(1, len(low_priority_templates) // max(1, self.thread_count - 1))
-                    for i in range(0, len(low_priority_templates), batch_size):
-                        batch = low_priority_templates[i:i + batch_size]
-                        low_priority_batches.append(batch)
-                    
-                    low_priority_futures = []
-                    for batch in low_priority_batches:
-                        if not self.is_running:
-                            break
-                        future = self.executor.submit(self.process_template_batch_by_priority, screenshot, batch)
-                        low_priority_futures.append(future)
-                    
-                    # 收集低优先级结果
-                    for future in concurrent.futures.as_completed(low_priority_futures, timeout=0.5):
-                        try:
-                            batch_results = future.result(timeout=0.2)
-                            if batch_results:
-                                # 按优先级顺序处理结果
-                                for template_id in enabled_templates:  # 已排序
-                                    if template_id in batch_results:
-                                        result = batch_results[template_id]
-                                        if result and result.get('found', False):
-                                            # 再次检查是否进入回合
-                                            if self.preselect_enabled and self.preselect_detected:
-                                                self.emit_log(f"图片{template_id}匹配被跳过: 检测到回合状态")
-                                                continue
-                                            
-                                            if self.handle_multiple_matches(template_id, result):
-                                                self.emit_match(template_id, result)
-                                                break  # 找到一个匹配后停止
-                        except concurrent.futures.TimeoutError:
-                            continue
-                        except Exception as e:
-                            if loop_count % 20 == 1:
-                                self.emit_log(f"低优先级匹配任务异常: {e}")
-                            continue
+                        self.emit_log(f"图片{template_id}匹配被跳过: 检测到回合状态")
+                        break
+                    if self.handle_multiple_matches(template_id, result):
+                        self.emit_match(template_id, result)
+                        matched_priority = priorities[template_id]
+                        break
                 
                 match_time = time.time() - match_start
                 
                 if loop_count % 50 == 1:
-                    priority_status = "高优先级匹配" if found_high_priority else "低优先级匹配" if low_priority_templates else "无匹配"
-                    self.emit_log(f"回合外匹配完成: {priority_status}, 耗时: {match_time:.3f}秒")
+                    priority_status = f"优先级{matched_priority}匹配" if matched_priority is not None else "无匹配"
+                    frame_stats = frame.get_stats()
+                    self.emit_log(f"回合外匹配完成: {priority_status}, 耗时: {match_time:.3f}秒, "
+                                  f"取消: {frame_stats.get('cancelled_templates', 0)}, 跳过: {frame_stats.get('skipped_templates', 0)}")
+                    pacer_stats = self.frame_pacer.get_stats()
+                    self.emit_log(f"帧节拍: 平均处理 {pacer_stats['avg_work_time']:.3f}秒, 超时帧比例 {pacer_stats['overrun_ratio']:.0%}")
                 
                 # 检查优先级中断信号
                 if self.priority_interrupt.is_set():
                     self.priority_interrupt.clear()
                     self.emit_log("优先级设置变更，重新排序模板")
                 
-                # 控制循环频率
-                if found_high_priority:
-                    time.sleep(0.3)  # 高优先级匹配成功后等待更长时间
-                else:
-                    time.sleep(0.25)  # 没有匹配时也增加等待时间
+                # 控制循环频率：只等待到下一帧截止时间的剩余部分
+                self.frame_pacer.wait('post_click' if matched_priority is not None else 'active', self.stop_event)
                     
             except Exception as e:
                 self.emit_log(f"优先级匹配过程出错: {e}")
                 import traceback
                 self.emit_log(f"错误详情: {traceback.format_exc()}")
-                time.sleep(1)
+                self.frame_pacer.wait('error', self.stop_event)
                 
         self.emit_log("多线程优先级匹配循环结束")
     
+    def get_preempt_templates(self, template_ids):
+        """本帧命中后可停止更低优先级模板的模板：高优先级（不超过 preempt_priority_max）且已过点击间隔
+
+        命中但无法点击的模板不影响其他模板（与原来只在高优先级模板点击成功后才跳过低优先级模板一致）。
+        确定性调度时没有可抢占的模板。
+        """
+        if self.deterministic_scheduling:
+            return set()
+        current_time = self.frame_clock
+        return {tid for tid in template_ids
+                if self.template_settings[tid]['priority'] <= self.preempt_priority_max and
+                current_time - self.template_settings[tid]['last_click_time'] >= self.global_click_interval}
+        
     def handle_multiple_matches(self, template_id, result):
         """处理多个匹配结果"""
         if not result['found'] or not result['all_positions']:
@@ -788,8 +1097,8 @@ class Controller:
                 self.emit_log(f"图片{template_id}点击被跳过: 当前在回合中")
                 return False
             
-            # 检查点击间隔
-            current_time = time.time()
+            # 检查点击间隔（按帧时间，回放时与录制一致）
+            current_time = self.frame_clock
             last_click_time = self.template_settings[template_id]['last_click_time']
             if current_time - last_click_time < self.global_click_interval:
                 self.emit_log(f"图片{template_id}点击被跳过: 未达到点击间隔 ({self.global_click_interval}秒)")
@@ -797,6 +1106,7 @@ class Controller:
             
             # 确保使用窗口相对坐标
             success = self.window_manager.click_at_position(x, y, button, window_relative=True)
+            self.record_event('click', template_id=template_id, x=x, y=y, button=button, success=success)
             
             if success:
                 self.emit_log(f"图片{template_id}(优先级{priority})点击成功: ({x}, {y}) {click_type}")
@@ -819,7 +1129,7 @@ class Controller:
         
     def get_status(self):
         """获取控制器状态 - 增加预选项信息"""
-        enabled_templates = self.get_priority_sorted_templates()
+        enabled_templates = self.get_priority_sorted_templates(verbose=False)
         enabled_count = len(enabled_templates)
         
         # 获取优先级分布
@@ -838,6 +1148,11 @@ class Controller:
             'multi_match_mode': self.multi_match_mode,
             'thread_count': self.thread_count,
             'current_fps': self.current_fps,
+            'target_fps': self.frame_pacer.target_fps,
+            'frame_pacer': self.frame_pacer.get_stats(),
+            'capture_thread': self.capture_thread.get_stats() if self.capture_thread is not None else None,
+            'frame_recorder': self.frame_recorder.get_stats() if self.frame_recorder is not None else None,
+            'window_geometry': self.window_manager.get_geometry_stats(),
             'template_settings': self.template_settings,
             'priority_distribution': priority_distribution,
             'priority_sorted_templates': enabled_templates,
@@ -851,12 +1166,91 @@ class Controller:
     def stop(self):
         """停止控制器"""
         self.pause_matching()
+        self.stop_recording()
+        self.folder_watcher.stop()
+        
+    def watch_template_folder(self, folder_info):
+        """开始监视已加载的模板文件夹，文件新增/修改/删除时自动应用（匹配无需停止）"""
+        try:
+            self.template_folders[folder_info['name']] = folder_info
+            self.folder_watcher.watch(folder_info['name'], folder_info['path'], folder_info.get('file_index'))
+            self.emit_log(f"开始监视模板文件夹: {folder_info['name']}")
+        except Exception as e:
+            self.emit_log(f"监视模板文件夹失败 {folder_info.get('name')}: {e}")
+            
+    def unwatch_template_folder(self, folder_name):
+        """停止监视模板文件夹"""
+        self.folder_watcher.unwatch(folder_name)
+        self.template_folders.pop(folder_name, None)
+        
+    def on_template_folder_changed(self, folder_name, added, changed, removed):
+        """文件夹监视回调：只更新变化的模板及其设置
+        
+        Returns:
+            list: 处理失败的文件路径（不写入监视索引，之后重试）
+        """
+        folder_info = self.template_folders.get(folder_name)
+        if folder_info is None:
+            return []
+        try:
+            changes = self.image_matcher.apply_folder_changes(folder_info, added, changed, removed)
+            
+            for template_id in changes['removed']:
+                self.template_settings.pop(template_id, None)
+            for template_id in changes['added']:
+                self.add_folder_template_settings(template_id, folder_info)
+            for template_id in changes['changed']:
+                if template_id in self.template_settings:
+                    self.template_settings[template_id]['image_path'] = self.image_matcher.template_images[template_id]['path']
+                    
+            self.emit_log(f"模板文件夹 {folder_name} 已更新: 新增 {len(changes['added'])}, 修改 {len(changes['changed'])}, "
+                          f"删除 {len(changes['removed'])}, 失败 {len(changes['failed'])}")
+            if self.folder_change_callback:
+                self.folder_change_callback(folder_info, changes)
+            return changes['failed']
+        except Exception as e:
+            self.emit_log(f"应用模板文件夹变化失败 {folder_name}: {e}")
+            import traceback
+            self.emit_log(f"错误详情: {traceback.format_exc()}")
+            # 整体失败时全部重试
+            return list(added) + list(changed)
+            
+    def add_folder_template_settings(self, template_id, folder_info):
+        """为文件夹中新加载的模板创建设置"""
+        image_path = self.image_matcher.template_images[template_id]['path']
+        self.template_settings[template_id] = {
+            'click_button': 'left', 
+            'enabled': folder_info.get('enabled', True),  # 默认启用
+            'priority': folder_info['priority'],
+            'last_click_time': 0,
+            'image_path': image_path,  # 确保设置正确的路径
+            'folder_info': folder_info['name'],  # 记录所属文件夹
+            'search_region': None,
+            'auto_region': False
+        }
 
-    def load_templates_from_directory(self, directory_path, priority, folder_name=None):
-        """从文件夹加载模板图像"""
+    def load_templates_from_directory(self, directory_path, priority, folder_name=None, engine=None,
+                                      progress_callback=None, lazy=None):
+        """从文件夹加载模板图像（engine 为该模板库的匹配引擎: opencv/fft）
+        
+        progress_callback(已处理数, 总数, 文件名) 在调用线程中调用；lazy 为 None 时使用 lazy_template_loading。
+        """
+        if lazy is None:
+            lazy = self.lazy_template_loading
+        progress_step = [0]
+        
+        def on_progress(done, total, filename):
+            # 每处理约10%输出一次进度日志
+            step = done * 10 // total
+            if step > progress_step[0] or done == total:
+                progress_step[0] = step
+                self.emit_log(f"加载模板进度: {done}/{total}")
+            if progress_callback:
+                progress_callback(done, total, filename)
+                
         try:
             success_count, failed_count, folder_info = self.image_matcher.load_templates_from_directory(
-                directory_path, priority, folder_name)
+                directory_path, priority, folder_name, engine, progress_callback=on_progress, lazy=lazy)
             
             if success_count > 0 and folder_info:
                 self.emit_log(f"从文件夹成功加载 {success_count} 个模板图像: {folder_info['name']} (优先级: {priority})")
@@ -876,14 +1270,7 @@ class Controller:
                     
                     if template_id not in self.template_settings:
                         # 为新加载的模板创建设置
-                        self.template_settings[template_id] = {
-                            'click_button': 'left', 
-                            'enabled': True,  # 默认启用
-                            'priority': priority,
-                            'last_click_time': 0,
-                            'image_path': image_path,  # 确保设置正确的路径
-                            'folder_info': folder_info['name']  # 记录所属文件夹
-                        }
+                        self.add_folder_template_settings(template_id, folder_info)
                         self.emit_log(f"添加模板设置 {template_id}: 优先级={priority}, 按键=left, 路径={os.path.basename(image_path)}")
                     else:
                         # 更新现有设置
@@ -893,6 +1280,11 @@ class Controller:
                         self.template_settings[template_id]['folder_info'] = folder_info['name']
                         self.emit_log(f"更新模板设置 {template_id}: 优先级={priority}, 路径={os.path.basename(image_path)}")
             
+                duplicates = folder_info.get('duplicates')
+                if duplicates and (duplicates['merged_templates'] or duplicates['near_duplicates']):
+                    self.emit_log(f"重复模板: {duplicates['merged_templates']} 个完全相同（已合并匹配）, "
+                                  f"{len(duplicates['near_duplicates'])} 对近似重复")
+            
             if failed_count > 0:
                 self.emit_log(f"从文件夹加载失败 {failed_count} 个模板图像")
             
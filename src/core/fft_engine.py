@@ -0,0 +1,170 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class FFTCorrelationEngine:
+    """FFT相关匹配引擎 - 每帧计算一次帧频谱和积分图，模板频谱按帧尺寸缓存，同尺寸模板批量计算
+
+    计算结果与 cv2.matchTemplate 的 TM_CCOEFF_NORMED / TM_CCORR_NORMED / TM_SQDIFF_NORMED 一致（浮点误差内）。
+    """
+
+    def __init__(self, batch_size=4, max_cached_spectra=512):
+        self.batch_size = batch_size  # 每次批量逆变换的模板数（限制峰值内存）
+        self.max_cached_spectra = max_cached_spectra
+
+        self._spectra = {}  # (template_key, plane, 模板形状, dft_shape, 是否去均值) -> (频谱, 模板统计)
+        self._lock = threading.Lock()
+
+    def clear(self, template_key=None):
+        """清除模板频谱缓存（None 表示全部）"""
+        with self._lock:
+            if template_key is None:
+                self._spectra.clear()
+            else:
+                for key in [key for key in self._spectra if key[0] == template_key]:
+                    del self._spectra[key]
+
+    def get_cached_spectra_count(self):
+        """已缓存的模板频谱数量"""
+        return len(self._spectra)
+
+    def get_frame_data(self, frame, plane):
+        """获取帧频谱、通道均值和积分图（每帧每个平面只计算一次）"""
+        return frame.get_derived(('fft_frame', plane), lambda: self._build_frame_data(frame.get_plane(plane)))
+
+    def _build_frame_data(self, plane_image):
+        image = self._as_channels(plane_image)
+        height, width, channels = image.shape
+        dft_shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+
+        # 先减去通道均值，降低直流分量带来的单精度误差
+        means = image.reshape(-1, channels).mean(axis=0, dtype=np.float64)
+        centered = image.astype(np.float32) - means.astype(np.float32)
+        spectrum = np.fft.rfft2(np.moveaxis(centered, 2, 0), s=dft_shape)
+
+        # 积分图：窗口内像素和与平方和
+        sums, square_sums = cv2.integral2(plane_image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        return {
+            'shape': (height, width),
+            'channels': channels,
+            'dft_shape': dft_shape,
+            'means': means,
+            'spectrum': spectrum,
+            'sums': sums.reshape(height + 1, width + 1, channels),
+            'square_sums': square_sums.reshape(height + 1, width + 1, channels),
+            'window_stats': {}
+        }
+
+    def _window_stats(self, frame_data, template_height, template_width, method):
+        """同尺寸模板共享的窗口统计量（与模板无关，每帧每种尺寸只计算一次）
+
+        CCOEFF: 窗口去均值后的平方和开方；其他方法: 窗口平方和开方（SQDIFF另需平方和本身）。
+        """
+        centered = method == cv2.TM_CCOEFF_NORMED
+        key = (template_height, template_width, centered)
+        stats = frame_data['window_stats'].get(key)
+        if stats is None:
+            sums = frame_data['sums']
+            square_sums = frame_data['square_sums']
+            h, w = template_height, template_width
+            window_square = (square_sums[h:, w:] - square_sums[:-h, w:]
+                             - square_sums[h:, :-w] + square_sums[:-h, :-w]).sum(axis=2)
+            if centered:
+                window_sum = sums[h:, w:] - sums[:-h, w:] - sums[h:, :-w] + sums[:-h, :-w]
+                energy = window_square - (window_sum ** 2).sum(axis=2) / (h * w)
+            else:
+                energy = window_square
+            stats = {
+                'window_norm': np.sqrt(np.maximum(energy, 0)).astype(np.float32),
+                'window_square': window_square.astype(np.float32)
+            }
+            frame_data['window_stats'][key] = stats
+        return stats
+
+    def _template_spectrum(self, template_key, plane, template, dft_shape, method):
+        """获取模板的补零共轭频谱和统计量（按帧尺寸缓存）"""
+        # 模板尺寸也参与缓存键：同一模板的不同缩放版本分别缓存
+        cache_key = (template_key, plane, template.shape, dft_shape, method == cv2.TM_CCOEFF_NORMED)
+        with self._lock:
+            cached = self._spectra.get(cache_key)
+        if cached is not None:
+            return cached
+
+        template = self._as_channels(template).astype(np.float64)
+        channel_sums = template.reshape(-1, template.shape[2]).sum(axis=0)
+        if method == cv2.TM_CCOEFF_NORMED:
+            # 零均值模板：分子 = sum((I - 窗口均值) * T') = sum(I * T')
+            template = template - template.mean(axis=(0, 1))
+        norm = float((template ** 2).sum())
+
+        planes = np.moveaxis(template.astype(np.float32), 2, 0)
+        spectrum = np.conj(np.fft.rfft2(planes, s=dft_shape))
+        cached = (spectrum, channel_sums, norm)
+
+        with self._lock:
+            if len(self._spectra) >= self.max_cached_spectra:
+                self._spectra.pop(next(iter(self._spectra)))
+            self._spectra[cache_key] = cached
+        return cached
+
+    def match_batch(self, frame, plane, templates, method):
+        """批量计算同尺寸模板的匹配结果图
+
+        Args:
+            templates: [(template_key, template_image), ...]，所有模板尺寸相同
+        Returns:
+            生成器，依次产出 (template_key, 结果图)，结果图与 cv2.matchTemplate 输出同尺寸
+        """
+        if not templates:
+            return
+
+        frame_data = self.get_frame_data(frame, plane)
+        height, width = frame_data['shape']
+        template_height, template_width = templates[0][1].shape[:2]
+        if template_height > height or template_width > width:
+            return
+        window_stats = self._window_stats(frame_data, template_height, template_width, method)
+        dft_shape = frame_data['dft_shape']
+        result_height = height - template_height + 1
+        result_width = width - template_width + 1
+
+        for start in range(0, len(templates), self.batch_size):
+            batch = templates[start:start + self.batch_size]
+            spectra = [self._template_spectrum(key, plane, image, dft_shape, method) for key, image in batch]
+
+            # 频域内对通道求和后只做一次逆变换
+            products = np.stack([(frame_data['spectrum'] * spectrum).sum(axis=0) for spectrum, _, _ in spectra])
+            correlations = np.fft.irfft2(products, s=dft_shape)[:, :result_height, :result_width]
+
+            for (key, _), (_, channel_sums, norm), correlation in zip(batch, spectra, correlations):
+                yield key, self._normalize(correlation, frame_data, window_stats, channel_sums, norm, method)
+
+    def _normalize(self, correlation, frame_data, window_stats, channel_sums, norm, method):
+        """由相关值和窗口统计量计算归一化匹配结果"""
+        numerator = np.asarray(correlation, dtype=np.float32)
+        if method != cv2.TM_CCOEFF_NORMED:
+            # 还原帧均值部分：sum(I * T) = sum((I - m) * T) + m * sum(T)
+            numerator = numerator + np.float32(np.dot(frame_data['means'], channel_sums))
+
+        template_norm = np.float32(np.sqrt(norm))
+        denominator = window_stats['window_norm'] * template_norm
+        valid = denominator > 1e-6 * max(norm, 1.0)
+
+        if method == cv2.TM_SQDIFF_NORMED:
+            square_diff = window_stats['window_square'] - 2 * numerator + np.float32(norm)
+            result = np.ones(numerator.shape, dtype=np.float32)
+            np.divide(square_diff, denominator, out=result, where=valid)
+            return np.clip(result, 0.0, 1.0, out=result)
+
+        result = np.zeros(numerator.shape, dtype=np.float32)
+        np.divide(numerator, denominator, out=result, where=valid)
+        return np.clip(result, -1.0, 1.0, out=result)
+
+    @staticmethod
+    def _as_channels(image):
+        """统一为 (H, W, C) 形状"""
+        if image.ndim == 2:
+            return image[:, :, np.newaxis]
+        return image
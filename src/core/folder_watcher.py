@@ -0,0 +1,142 @@
+import os
+import threading
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+
+def scan_image_files(directory):
+    """扫描文件夹中的图片文件（不递归）
+
+    Returns:
+        dict: {文件路径: (修改时间ns, 文件大小)}
+    """
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                # 扫描过程中被删除
+                continue
+            files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def diff_file_index(old_index, new_index):
+    """比较两次扫描结果
+
+    Returns:
+        tuple: (新增路径列表, 变化路径列表, 删除路径列表)，均按路径排序
+    """
+    added = sorted(path for path in new_index if path not in old_index)
+    changed = sorted(path for path in new_index if path in old_index and new_index[path] != old_index[path])
+    removed = sorted(path for path in old_index if path not in new_index)
+    return added, changed, removed
+
+
+class FolderWatcher:
+    """模板文件夹变化监视器 - 定期扫描文件的修改时间和大小，检测新增、修改和删除的图片
+
+    文件需在连续两次扫描中保持不变才会上报（避免读取到正在写入的文件）。
+    回调在监视线程中调用: callback(key, added, changed, removed)，返回处理失败的文件路径（可为 None）；
+    返回后该文件夹的索引更新为本次扫描结果中已上报且处理成功的部分，失败的文件在之后的扫描中重试。
+    """
+
+    def __init__(self, callback, interval=2.0):
+        self.callback = callback
+        self.interval = interval  # 扫描间隔（秒）
+
+        self._lock = threading.Lock()
+        self._folders = {}  # key -> {'directory', 'index', 'pending'}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def watch(self, key, directory, index=None):
+        """开始监视文件夹（index 为加载时的文件索引，None 时以当前扫描结果为准）"""
+        if index is None:
+            index = scan_image_files(directory)
+        with self._lock:
+            self._folders[key] = {'directory': directory, 'index': dict(index), 'pending': {}}
+        self.start()
+
+    def unwatch(self, key):
+        """停止监视文件夹"""
+        with self._lock:
+            self._folders.pop(key, None)
+
+    def is_watching(self, key):
+        with self._lock:
+            return key in self._folders
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='folder-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """扫描所有监视中的文件夹一次，有稳定的变化时调用回调"""
+        with self._lock:
+            keys = list(self._folders.keys())
+        for key in keys:
+            try:
+                self._poll_folder(key)
+            except Exception as e:
+                print(f"扫描模板文件夹失败 {key}: {e}")
+
+    def _poll_folder(self, key):
+        with self._lock:
+            folder = self._folders.get(key)
+        if folder is None:
+            return
+        if not os.path.isdir(folder['directory']):
+            # 文件夹暂时不可用（如网络盘断开）时不视为全部删除
+            return
+
+        current = scan_image_files(folder['directory'])
+        added, changed, removed = diff_file_index(folder['index'], current)
+
+        # 只上报与上次扫描相同的变化（文件已写完）
+        stable = {}
+        pending = {}
+        for path in added + changed:
+            if folder['pending'].get(path) == current[path]:
+                stable[path] = current[path]
+            else:
+                pending[path] = current[path]
+        folder['pending'] = pending
+
+        added = [path for path in added if path in stable]
+        changed = [path for path in changed if path in stable]
+        if not (added or changed or removed):
+            return
+
+        failed = self.callback(key, added, changed, removed) or ()
+
+        with self._lock:
+            if self._folders.get(key) is not folder:
+                # 回调期间被取消监视或重新监视
+                return
+            # 失败的文件（如尚未写完导致解码失败）不写入索引，下次扫描仍视为变化
+            for path in failed:
+                stable.pop(path, None)
+                folder['index'].pop(path, None)
+            folder['index'].update(stable)
+            for path in removed:
+                folder['index'].pop(path, None)
@@ -0,0 +1,260 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .match_cache import compute_frame_hash
+
+
+class MatchCancelled(Exception):
+    """匹配任务已被取消（本帧已有更高优先级的命中、匹配暂停或超时）"""
+
+
+class CancelToken:
+    """取消令牌 - 由调度方设置，匹配任务在各阶段之间检查"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason=None):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise MatchCancelled(self.reason)
+
+
+class FramePlanePool:
+    """帧平面缓冲区池 - 颜色/灰度平面和金字塔层级复用之前帧的缓冲区，不再每帧重新分配
+
+    缓冲区由帧上下文在帧结束且所有读取该帧的匹配任务完成后交还（见 FrameContext.release_buffers），
+    超时后仍在运行的匹配任务读取的缓冲区不会被新帧覆盖。
+    """
+
+    def __init__(self, max_free_per_shape=4):
+        self.max_free_per_shape = max_free_per_shape  # 每种尺寸最多保留的空闲缓冲区数量
+        self._lock = threading.Lock()
+        self._free = {}  # (形状, 类型) -> [ndarray]
+        self.stats = {'allocations': 0, 'reuses': 0, 'allocated_bytes': 0}
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                self.stats['reuses'] += 1
+                return buffers.pop()
+            self.stats['allocations'] += 1
+            buffer = np.empty(shape, dtype=dtype)
+            self.stats['allocated_bytes'] += buffer.nbytes
+            return buffer
+
+    def release(self, buffers):
+        """回收一帧的缓冲区（调用方保证已没有任务读取）"""
+        with self._lock:
+            for buffer in buffers:
+                key = (buffer.shape, buffer.dtype.str)
+                free = self._free.setdefault(key, [])
+                # 窗口尺寸变化后旧尺寸的缓冲区不再使用，每种尺寸只保留少量
+                if len(free) < self.max_free_per_shape:
+                    free.append(buffer)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pooled_bytes'] = sum(buffer.nbytes for buffers in self._free.values() for buffer in buffers)
+        return stats
+
+
+class FrameContext:
+    """单帧匹配上下文 - 缓存每帧只需计算一次的派生数据（图像金字塔等），供所有模板和线程共享
+
+    截图可以是RGB，也可以是窗口截图的原始BGRA布局（不复制），彩色/灰度平面在首次访问时直接从原始布局转换。
+    """
+
+    def __init__(self, image, seq=0, plane_pool=None):
+        self.image = image
+        self.seq = seq
+        self.timestamp = time.time()
+        self.height, self.width = image.shape[:2]
+        self.active_template_ids = None  # 本帧需要匹配的模板ID集合，None 表示全部
+        self.capture_geometry = None  # 截图时的窗口几何 (窗口句柄, 客户区宽, 客户区高)，None 时使用窗口管理器的最近一次截图
+        self.capture_rects = None  # 局部截图时实际截取的矩形 [(x0, y0, x1, y1), ...]，None 表示整帧
+        self.cancel_token = CancelToken()  # 整帧取消
+        self._cancelled_templates = set()  # 单独取消的模板（如优先级更低的模板）
+
+        self._lock = threading.RLock()
+        self._planes = {}  # (plane, level) -> ndarray
+        self._stats = {}
+        self._content_hashes = {}  # sample_step -> 内容哈希
+        self._derived = {}  # 其他按帧缓存的派生数据（如FFT频谱、批量匹配结果）
+        self._derived_locks = {}
+        self._plane_pool = plane_pool  # 平面缓冲区池，None 时每帧新分配
+        self._pooled_buffers = []
+        self._tasks = 0  # 正在读取本帧的匹配任务数
+        self._finished = False
+
+    def get_plane(self, plane='color', level=0):
+        """获取指定平面和金字塔层级的图像（首次访问时计算并缓存）"""
+        key = (plane, level)
+        cached = self._planes.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            cached = self._planes.get(key)
+            if cached is not None:
+                return cached
+
+            if level == 0:
+                cached = self._build_base_plane(plane)
+            else:
+                source = self.get_plane(plane, level - 1)
+                height, width = source.shape[:2]
+                cached = cv2.pyrDown(source, dst=self._allocate(((height + 1) // 2, (width + 1) // 2) + source.shape[2:]))
+
+            self._planes[key] = cached
+            return cached
+
+    def _build_base_plane(self, plane):
+        """构建第0层平面"""
+        image = self.image
+        if plane == 'color':
+            # 确保截图是RGB格式（原始BGRA截图在这里转换，每帧一次）
+            if len(image.shape) == 3 and image.shape[2] == 3:
+                return image
+            dst = self._allocate((self.height, self.width, 3))
+            if len(image.shape) == 3 and image.shape[2] == 4:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB, dst=dst)
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB, dst=dst)
+
+        if plane == 'gray':
+            # 单通道亮度平面（BGRA截图直接转换，不经过彩色平面）
+            if len(image.shape) == 2:
+                return image
+            dst = self._allocate((self.height, self.width))
+            if image.shape[2] == 4:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY, dst=dst)
+            return cv2.cvtColor(self.get_plane('color'), cv2.COLOR_RGB2GRAY, dst=dst)
+
+        raise ValueError(f"不支持的图像平面: {plane}")
+
+    def _allocate(self, shape):
+        """分配平面缓冲区（调用方需持有 _lock）"""
+        if self._plane_pool is None:
+            return np.empty(shape, dtype=np.uint8)
+        buffer = self._plane_pool.acquire(shape)
+        self._pooled_buffers.append(buffer)
+        return buffer
+
+    def enter_task(self):
+        """开始一个读取本帧的匹配任务（与 exit_task 成对调用）"""
+        with self._lock:
+            self._tasks += 1
+
+    def exit_task(self):
+        """匹配任务结束；帧已结束且这是最后一个任务时交还缓冲区"""
+        with self._lock:
+            self._tasks -= 1
+            if not self._finished or self._tasks > 0:
+                return
+            buffers = self._take_buffers()
+        self._return_buffers(buffers)
+
+    def release_buffers(self):
+        """帧结束：把平面缓冲区交还缓冲区池（仍有匹配任务在读取时，由最后一个任务交还）"""
+        with self._lock:
+            self._finished = True
+            if self._tasks > 0:
+                return
+            buffers = self._take_buffers()
+        self._return_buffers(buffers)
+
+    def _take_buffers(self):
+        """取出本帧的池缓冲区（调用方需持有 _lock）"""
+        buffers = self._pooled_buffers
+        self._pooled_buffers = []
+        self._planes.clear()
+        return buffers
+
+    def _return_buffers(self, buffers):
+        if buffers and self._plane_pool is not None:
+            self._plane_pool.release(buffers)
+
+    def get_content_hash(self, sample_step=4):
+        """获取帧内容哈希（每帧只计算一次）"""
+        content_hash = self._content_hashes.get(sample_step)
+        if content_hash is None:
+            with self._lock:
+                content_hash = self._content_hashes.get(sample_step)
+                if content_hash is None:
+                    content_hash = compute_frame_hash(self.image, sample_step)
+                    self._content_hashes[sample_step] = content_hash
+        return content_hash
+
+    def get_derived(self, key, factory):
+        """获取按帧缓存的派生数据，首次访问时调用 factory() 计算
+
+        每个键单独加锁：同一数据只计算一次，不同数据可在多个线程中并行计算。
+        """
+        if key in self._derived:
+            return self._derived[key]
+
+        with self._lock:
+            key_lock = self._derived_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._derived:
+                self._derived[key] = factory()
+            return self._derived[key]
+
+    def covers(self, rect):
+        """搜索矩形（None 表示整帧）是否完全在本帧截取的范围内"""
+        if self.capture_rects is None:
+            return True
+        if rect is None:
+            return False
+        x0, y0, x1, y1 = rect
+        return any(cx0 <= x0 and cy0 <= y0 and x1 <= cx1 and y1 <= cy1 for cx0, cy0, cx1, cy1 in self.capture_rects)
+
+    def cancel(self, reason=None):
+        """取消本帧所有尚未完成的匹配"""
+        self.cancel_token.cancel(reason)
+
+    def cancel_templates(self, template_ids):
+        """取消本帧中指定模板的匹配"""
+        with self._lock:
+            self._cancelled_templates.update(template_ids)
+
+    def is_cancelled(self, template_id=None):
+        """本帧（或本帧中的指定模板）是否已取消"""
+        if self.cancel_token.is_cancelled():
+            return True
+        return template_id is not None and template_id in self._cancelled_templates
+
+    def check_cancelled(self, template_id=None):
+        """已取消时抛出 MatchCancelled"""
+        self.cancel_token.raise_if_cancelled()
+        if template_id is not None and template_id in self._cancelled_templates:
+            raise MatchCancelled('template')
+
+    def add_stat(self, name, value):
+        """累加本帧统计值（线程安全）"""
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + value
+
+    def get_stats(self):
+        """获取本帧统计信息副本"""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+class FramePacer:
+    """帧节拍器 - 按截止时间控制匹配循环的节奏
+
+    每帧开始时记录时间，帧结束后只等待到下一个截止时间的剩余部分（处理耗时越长，等待越短）。
+    不同状态使用不同的帧间隔：正常匹配按目标帧率，空闲、回合中、点击后等状态使用各自的间隔。
+    """
+
+    # 状态 -> 默认帧间隔（秒）；active 由目标帧率决定（默认 4 FPS，即每 0.25 秒一帧）
+    DEFAULT_CADENCES = {
+        'active': None,  # 正常匹配（无命中）
+        'post_click': 0.3,  # 点击后等待画面响应
+        'in_round': 0.2,  # 回合中（预选项暂停）
+        'round_transition': 0.5,  # 进入/退出回合，等待状态稳定
+        'idle': 0.5,  # 没有启用的模板
+        'capture_retry': 0.5,  # 截图失败后重试
+        'error': 1.0  # 循环异常后重试
+    }
+
+    def __init__(self, target_fps=4.0, frame_budget=None):
+        self.target_fps = target_fps
+        self.frame_budget = frame_budget  # 单帧匹配时间预算（秒），None 表示不限制
+        self.cadences = dict(self.DEFAULT_CADENCES)
+
+        self._lock = threading.Lock()
+        self._frame_start = time.perf_counter()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'frames': 0, 'overruns': 0, 'sleep_time': 0.0, 'work_time': 0.0}
+
+    def set_target_fps(self, fps):
+        """设置正常匹配时的目标帧率（清除 active 状态的帧间隔覆盖）"""
+        self.target_fps = max(0.1, float(fps))
+        self.cadences['active'] = None
+
+    def set_cadence(self, state, seconds):
+        """设置某个状态的帧间隔（秒）；active 状态的间隔由目标帧率决定，设置后覆盖目标帧率"""
+        if state not in self.cadences:
+            raise ValueError(f"未知的节拍状态: {state}")
+        self.cadences[state] = None if seconds is None else max(0.0, float(seconds))
+
+    def get_interval(self, state='active'):
+        """状态对应的帧间隔（秒）"""
+        interval = self.cadences.get(state)
+        if interval is None:
+            return 1.0 / self.target_fps
+        return interval
+
+    def begin_frame(self):
+        """标记一帧开始（截止时间从此刻起算）"""
+        self._frame_start = time.perf_counter()
+        return self._frame_start
+
+    def get_frame_elapsed(self):
+        return time.perf_counter() - self._frame_start
+
+    def get_remaining_budget(self):
+        """本帧剩余的匹配时间预算（秒），没有预算时返回 None"""
+        if self.frame_budget is None:
+            return None
+        return max(0.0, self.frame_budget - self.get_frame_elapsed())
+
+    def wait(self, state='active', stop_event=None):
+        """等待到本帧的截止时间；stop_event 被设置时立即返回
+
+        Returns:
+            float: 实际等待时间（秒）
+        """
+        elapsed = self.get_frame_elapsed()
+        remaining = self.get_interval(state) - elapsed
+        with self._lock:
+            self.stats['frames'] += 1
+            self.stats['work_time'] += elapsed
+            if remaining <= 0:
+                # 处理耗时超过帧间隔，直接开始下一帧
+                self.stats['overruns'] += 1
+                return 0.0
+
+        if stop_event is not None:
+            stop_event.wait(remaining)
+        else:
+            time.sleep(remaining)
+        with self._lock:
+            self.stats['sleep_time'] += remaining
+        return remaining
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        frames = stats['frames']
+        stats['avg_work_time'] = stats['work_time'] / frames if frames else 0.0
+        stats['overrun_ratio'] = stats['overruns'] / frames if frames else 0.0
+        stats['target_fps'] = self.target_fps
+        return stats
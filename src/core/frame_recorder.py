@@ -0,0 +1,564 @@
+import bisect
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from .frame_sources import FrameSource
+
+
+RECORDING_EXTENSION = '.frec'
+
+# 文件头：魔数、版本、文件头大小、数据区大小、最旧记录偏移、写入位置、记录数、已录制帧数、开始时间
+FILE_HEADER = struct.Struct('<8sIIQQQQQd')
+FILE_MAGIC = b'FRAMEREC'
+FILE_HEADER_SIZE = 4096  # 文件头之后是会话信息（JSON），数据区从这里开始
+SESSION_INFO = struct.Struct('<I')
+
+# 记录头：魔数、记录总长度、帧号、时间戳、宽、高、通道数、压缩方式、记录类型、保留、元数据长度、像素数据长度
+RECORD_HEADER = struct.Struct('<4sIQdIIBBBBII')
+RECORD_MAGIC = b'FREC'
+WRAP_MAGIC = b'WRAP'  # 数据区末尾放不下下一条记录时写入，读取方跳回数据区开头
+RECORD_ALIGNMENT = 8
+
+KIND_FRAME = 0
+KIND_EVENT = 1
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+
+def is_recording_file(path):
+    """按文件头的标识判断是否为帧录制文件（不依赖扩展名）；无法读取文件时按扩展名判断"""
+    try:
+        if os.path.isdir(path):
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return path.lower().endswith(RECORDING_EXTENSION)
+
+
+def _json_default(value):
+    """numpy 标量/数组转换为 JSON 可序列化的类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+class FrameRecorder:
+    """帧录制器 - 把截图帧（时间戳、局部截图矩形）和每帧的匹配、点击事件写入固定大小的内存映射环形文件
+
+    文件大小固定为 文件头 + max_bytes：写满后覆盖最旧的记录，只保留最近一段会话。
+    像素数据可选 zlib 无损压缩；局部截图的帧只保存截取的矩形。
+    复制像素之后的压缩和写入在后台线程完成，写入跟不上时丢弃新帧（不阻塞匹配循环）。
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, compression='zlib', compression_level=1,
+                 max_fps=None, queue_frames=8, session_info=None):
+        self.path = path
+        self.max_bytes = max(1024 * 1024, int(max_bytes))  # 数据区大小（字节）
+        self.compression = compression  # 'zlib' 或 None
+        self.compression_level = compression_level
+        self.max_fps = max_fps  # 最高录制帧率，None 表示录制每一帧
+        self.session_info = dict(session_info or {})
+
+        self.queue_frames = max(1, int(queue_frames))  # 等待写入的帧数上限（事件不受限制）
+        self._queue = queue.Queue()
+        self._pending_frames = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+        self._records = []  # 仍在环中的记录 [(偏移, 长度), ...]，按写入顺序
+        self._first_record = 0  # _records 中最旧记录的下标（避免频繁从列表头部删除）
+        self._tail = 0
+        self._frame_index = 0
+        self._current_frame = None  # 当前帧的帧号（之后的事件属于这一帧），帧被丢弃时为 None
+        self._start_time = None
+        self._last_frame_time = 0.0
+
+        self.stats = {'frames': 0, 'events': 0, 'dropped': 0, 'skipped': 0, 'oversized': 0,
+                      'overwritten': 0, 'raw_bytes': 0, 'written_bytes': 0, 'write_time': 0.0}
+
+    def is_open(self):
+        return self._mm is not None
+
+    def open(self):
+        """创建（覆盖）录制文件并启动写入线程"""
+        self.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(FILE_HEADER_SIZE + self.max_bytes)
+        self._mm = mmap.mmap(self._file.fileno(), FILE_HEADER_SIZE + self.max_bytes)
+
+        self._records = []
+        self._first_record = 0
+        self._tail = 0
+        self._frame_index = 0
+        self._pending_frames = 0
+        self._current_frame = None
+        self._start_time = time.perf_counter()
+        self._last_frame_time = 0.0
+
+        info = dict(self.session_info)
+        info.update({'created': time.time(), 'compression': self.compression, 'version': self.FORMAT_VERSION})
+        info_bytes = json.dumps(info, ensure_ascii=False, default=_json_default).encode('utf-8')
+        if FILE_HEADER.size + SESSION_INFO.size + len(info_bytes) > FILE_HEADER_SIZE:
+            print("[帧录制] 会话信息过长，不写入")
+            info_bytes = b'{}'
+        offset = FILE_HEADER.size
+        SESSION_INFO.pack_into(self._mm, offset, len(info_bytes))
+        self._mm[offset + SESSION_INFO.size:offset + SESSION_INFO.size + len(info_bytes)] = info_bytes
+        self._write_file_header()
+
+        self._thread = threading.Thread(target=self._run, name='frame-recorder', daemon=True)
+        self._thread.start()
+        print(f"[帧录制] 开始录制: {self.path}, 环形文件 {self.max_bytes / 1024 / 1024:.0f}MB, "
+              f"压缩: {self.compression or '无'}")
+        return True
+
+    def close(self):
+        """写完队列中的记录后关闭文件"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._mm is not None:
+            with self._lock:
+                self._write_file_header()
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
+            self._file.close()
+            self._file = None
+            print(f"[帧录制] 录制结束: {self.stats['frames']} 帧, {self.stats['events']} 个事件, "
+                  f"丢弃 {self.stats['dropped']} 帧, 覆盖 {self.stats['overwritten']} 条旧记录")
+
+    def record_frame(self, image, seq=None, rects=None, timestamp=None):
+        """录制一帧截图（只复制像素，压缩和写入在后台线程完成）
+
+        Args:
+            image: 截图 (高, 宽, 3或4)
+            seq: 截图帧序号
+            rects: 局部截图实际截取的矩形，None 表示整帧
+            timestamp: 帧时间（time.perf_counter 时间轴），None 表示当前时间；
+                传入匹配循环使用的帧时间时，回放得到的帧时间间隔与录制时完全一致
+        Returns:
+            int: 录制的帧号；未录制（超过最高帧率或写入队列已满）时返回 None
+        """
+        if self._mm is None or image is None:
+            return None
+        now = time.perf_counter() if timestamp is None else timestamp
+        if self.max_fps and now - self._last_frame_time < 1.0 / self.max_fps:
+            self.stats['skipped'] += 1
+            self._current_frame = None
+            return None
+
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        if rects:
+            # 局部截图：各矩形的像素依次拼接
+            sizes = [(y1 - y0) * (x1 - x0) * channels for x0, y0, x1, y1 in rects]
+            pixels = np.empty(sum(sizes), dtype=np.uint8)
+            position = 0
+            for (x0, y0, x1, y1), size in zip(rects, sizes):
+                pixels[position:position + size].reshape(y1 - y0, x1 - x0, channels)[...] = \
+                    image[y0:y1, x0:x1].reshape(y1 - y0, x1 - x0, channels)
+                position += size
+            rects = [list(map(int, rect)) for rect in rects]
+        else:
+            pixels = np.array(image, dtype=np.uint8, copy=True).reshape(-1)
+            rects = None
+
+        with self._lock:
+            if self._pending_frames >= self.queue_frames:
+                self.stats['dropped'] += 1
+                self._current_frame = None
+                return None
+            index = self._frame_index
+            meta = {'seq': seq, 'rects': rects}
+            self._queue.put((KIND_FRAME, index, now - self._start_time, (width, height, channels), meta, pixels))
+            self._pending_frames += 1
+            self._frame_index += 1
+            self._current_frame = index
+            self._last_frame_time = now
+        return index
+
+    def record_event(self, event_type, **data):
+        """录制当前帧的事件（match/click 等），事件按发生顺序写在所属帧之后"""
+        if self._mm is None:
+            return
+        with self._lock:
+            meta = dict(data)
+            meta['type'] = event_type
+            meta['frame'] = self._current_frame
+            timestamp = time.perf_counter() - self._start_time
+            frame = self._current_frame if self._current_frame is not None else 0
+            self._queue.put((KIND_EVENT, frame, timestamp, (0, 0, 0), meta, None))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            start = time.perf_counter()
+            try:
+                self._write_record(*item)
+            except Exception as e:
+                print(f"[帧录制] 写入记录失败: {e}")
+            self.stats['write_time'] += time.perf_counter() - start
+            if item[0] == KIND_FRAME:
+                with self._lock:
+                    self._pending_frames -= 1
+
+    def _write_record(self, kind, index, timestamp, shape, meta, pixels):
+        meta_bytes = json.dumps(meta, ensure_ascii=False, default=_json_default).encode('utf-8')
+        codec = CODEC_RAW
+        payload = b''
+        if pixels is not None:
+            payload = memoryview(pixels).cast('B')
+            if self.compression == 'zlib':
+                compressed = zlib.compress(payload, self.compression_level)
+                if len(compressed) < len(payload):
+                    payload = compressed
+                    codec = CODEC_ZLIB
+
+        size = RECORD_HEADER.size + len(meta_bytes) + len(payload)
+        size += -size % RECORD_ALIGNMENT
+        if size > self.max_bytes:
+            self.stats['oversized'] += 1
+            print(f"[帧录制] 记录大小 {size} 超过环形文件数据区，跳过")
+            return
+
+        with self._lock:
+            offset = self._reserve(size)
+            position = FILE_HEADER_SIZE + offset
+            width, height, channels = shape
+            RECORD_HEADER.pack_into(self._mm, position, RECORD_MAGIC, size, index, timestamp, width, height,
+                                    channels, codec, kind, 0, len(meta_bytes), len(payload))
+            position += RECORD_HEADER.size
+            self._mm[position:position + len(meta_bytes)] = meta_bytes
+            position += len(meta_bytes)
+            self._mm[position:position + len(payload)] = payload
+
+            self._records.append((offset, size))
+            self._tail = offset + size
+            # 记录写完后再更新文件头（中途退出时文件头仍指向完整的记录）
+            self._write_file_header()
+
+            if kind == KIND_FRAME:
+                self.stats['frames'] += 1
+                self.stats['raw_bytes'] += pixels.nbytes
+            else:
+                self.stats['events'] += 1
+            self.stats['written_bytes'] += size
+
+    def _reserve(self, size):
+        """在环中分配 size 字节，覆盖与之重叠的最旧记录，返回数据区偏移"""
+        offset = self._tail
+        wrap_at = None
+        if offset + size > self.max_bytes:
+            # 数据区末尾放不下：写入回绕标记，从开头继续
+            if offset + len(WRAP_MAGIC) <= self.max_bytes:
+                self._mm[FILE_HEADER_SIZE + offset:FILE_HEADER_SIZE + offset + len(WRAP_MAGIC)] = WRAP_MAGIC
+            wrap_at = offset
+            offset = 0
+        end = offset + size
+
+        while self._first_record < len(self._records):
+            record_offset, record_size = self._records[self._first_record]
+            if (wrap_at is not None and record_offset >= wrap_at) or \
+                    (record_offset < end and offset < record_offset + record_size):
+                self._first_record += 1
+                self.stats['overwritten'] += 1
+            else:
+                break
+        if self._first_record > 1024:
+            del self._records[:self._first_record]
+            self._first_record = 0
+        return offset
+
+    def _write_file_header(self):
+        count = len(self._records) - self._first_record
+        head = self._records[self._first_record][0] if count else 0
+        FILE_HEADER.pack_into(self._mm, 0, FILE_MAGIC, self.FORMAT_VERSION, FILE_HEADER_SIZE, self.max_bytes,
+                              head, self._tail, count, self._frame_index, time.time())
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['records'] = len(self._records) - self._first_record
+        stats['queued'] = self._queue.qsize()
+        stats['compression_ratio'] = stats['written_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 0.0
+        return stats
+
+
+class FrameRecording:
+    """读取帧录制文件 - 按写入顺序列出环中仍保留的帧和事件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.session_info = {}
+        self.frames = []  # 帧记录（按帧号排序）
+        self.events = {}  # 帧号 -> 事件列表
+        self._file = None
+        self._mm = None
+        self.data_size = 0
+
+    def open(self):
+        self.close()
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size, data_size, head, tail, count, _, _ = FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != FILE_MAGIC or version != FrameRecorder.FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"不是帧录制文件或版本不符: {self.path}")
+        self.header_size = header_size
+        self.data_size = data_size
+
+        (info_size,) = SESSION_INFO.unpack_from(self._mm, FILE_HEADER.size)
+        info_start = FILE_HEADER.size + SESSION_INFO.size
+        try:
+            self.session_info = json.loads(bytes(self._mm[info_start:info_start + info_size]).decode('utf-8'))
+        except ValueError:
+            self.session_info = {}
+
+        self.frames = []
+        self.events = {}
+        offset = head
+        for _ in range(count):
+            if offset + len(WRAP_MAGIC) > data_size or \
+                    self._mm[header_size + offset:header_size + offset + len(WRAP_MAGIC)] == WRAP_MAGIC:
+                offset = 0
+            record = self._read_record_header(offset)
+            if record is None:
+                print(f"[帧录制] 偏移 {offset} 处的记录损坏，停止读取")
+                break
+            if record['kind'] == KIND_FRAME:
+                self.frames.append(record)
+            else:
+                self.events.setdefault(record['meta'].get('frame'), []).append(record['meta'])
+            offset += record['size']
+        self.frames.sort(key=lambda record: record['index'])
+        return self
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_record_header(self, offset):
+        position = self.header_size + offset
+        if offset + RECORD_HEADER.size > self.data_size:
+            return None
+        (magic, size, index, timestamp, width, height, channels, codec, kind, _,
+         meta_size, payload_size) = RECORD_HEADER.unpack_from(self._mm, position)
+        if magic != RECORD_MAGIC or offset + size > self.data_size:
+            return None
+        meta_start = position + RECORD_HEADER.size
+        try:
+            meta = json.loads(bytes(self._mm[meta_start:meta_start + meta_size]).decode('utf-8'))
+        except ValueError:
+            return None
+        return {'offset': offset, 'size': size, 'index': index, 'timestamp': timestamp, 'kind': kind,
+                'shape': (height, width, channels), 'codec': codec, 'meta': meta,
+                'payload_offset': meta_start + meta_size, 'payload_size': payload_size}
+
+    def read_pixels(self, record):
+        """帧记录的像素数据（一维 uint8，局部截图时为各矩形依次拼接）"""
+        start = record['payload_offset']
+        payload = self._mm[start:start + record['payload_size']]
+        if record['codec'] == CODEC_ZLIB:
+            payload = zlib.decompress(payload)
+        return np.frombuffer(payload, dtype=np.uint8)
+
+    def read_frame(self, record, canvas=None):
+        """还原帧图像；局部截图的帧把截取的矩形写入 canvas（其余像素保持之前帧的内容）
+
+        Returns:
+            numpy.ndarray: 图像 (高, 宽, 通道)
+        """
+        height, width, channels = record['shape']
+        pixels = self.read_pixels(record)
+        rects = record['meta'].get('rects')
+        if not rects:
+            return pixels.reshape(height, width, channels)
+
+        if canvas is None or canvas.shape != (height, width, channels):
+            canvas = np.zeros((height, width, channels), dtype=np.uint8)
+        position = 0
+        for x0, y0, x1, y1 in rects:
+            size = (y1 - y0) * (x1 - x0) * channels
+            canvas[y0:y1, x0:x1] = pixels[position:position + size].reshape(y1 - y0, x1 - x0, channels)
+            position += size
+        return canvas
+
+    def get_events(self, event_type=None):
+        """按帧号顺序列出事件"""
+        events = []
+        for frame in sorted(self.events, key=lambda key: -1 if key is None else key):
+            events.extend(event for event in self.events[frame]
+                          if event_type is None or event.get('type') == event_type)
+        return events
+
+
+class RecordingFrameSource(FrameSource):
+    """帧录制回放截图源 - 把录制的截图按原始时间间隔（realtime=True）或最快速度送回匹配流程
+
+    局部截图的帧按录制时的矩形还原（忽略本次请求的截图矩形），匹配看到的像素和截取范围与录制时一致。
+    最快速度回放时每次截图返回下一帧；关闭截图线程后匹配循环逐帧处理，可重复运行用于性能和回归测试。
+    """
+
+    name = 'recording'
+
+    def __init__(self, path, realtime=True, loop=False, speed=1.0):
+        super().__init__()
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop  # 默认只回放一遍（回归测试）
+        self.speed = speed  # 实时回放的速度倍数
+
+        self._lock = threading.Lock()
+        self.recording = None
+        self._timestamps = []
+        self._position = -1
+        self._exhausted = False
+        self._frame = None
+        self._start_time = None
+        self.stats = {'frames': 0, 'decoded': 0, 'skipped': 0, 'loops': 0}
+
+    @property
+    def handle(self):
+        return f"{self.name}:{self.path}"
+
+    def open(self):
+        with self._lock:
+            return self._open()
+
+    def _open(self):
+        self._close()
+        try:
+            self.recording = FrameRecording(self.path).open()
+        except Exception as e:
+            print(f"[录制回放] 无法打开录制文件 {self.path}: {e}")
+            self.recording = None
+            return False
+        if not self.recording.frames:
+            print(f"[录制回放] 录制文件中没有帧: {self.path}")
+            self._close()
+            return False
+        first = self.recording.frames[0]['timestamp']
+        self._timestamps = [record['timestamp'] - first for record in self.recording.frames]
+        self._position = -1
+        self._exhausted = False
+        self._frame = None
+        self._canvas = None
+        self._start_time = time.perf_counter()
+        duration = self._timestamps[-1]
+        print(f"[录制回放] 打开 {self.path}: {len(self._timestamps)} 帧, 时长 {duration:.1f}秒, "
+              f"{'实时' if self.realtime else '最快速度'}回放")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    def get_frame_time(self):
+        """最快速度回放时返回录制的帧时间（回放开始时刻 + 录制时相对第一帧的时间），实时回放时使用当前时间"""
+        with self._lock:
+            if self.realtime or self._position < 0:
+                return None
+            return self._start_time + self._timestamps[self._position]
+
+    def is_finished(self):
+        """不循环时是否已回放完所有帧（最后一帧之后又请求过截图：逐帧回放时说明最后一帧已处理完）"""
+        with self._lock:
+            return not self.loop and self._exhausted
+
+    def rewind(self):
+        """从第一帧重新开始回放（开始匹配前的测试截图不占用录制的帧）"""
+        with self._lock:
+            self._position = -1
+            self._exhausted = False
+            self._frame = None
+            self._canvas = None
+            self._start_time = time.perf_counter()
+
+    def _target_index(self):
+        if self.realtime:
+            elapsed = (time.perf_counter() - self._start_time) * self.speed
+            return max(0, bisect.bisect_right(self._timestamps, elapsed) - 1)
+        return self._position + 1
+
+    def grab(self, rects=None):
+        with self._lock:
+            if self.recording is None and not self._open():
+                return None
+
+            index = self._target_index()
+            if index >= len(self._timestamps):
+                if not self.loop:
+                    # 回放结束后没有新画面（不重复匹配最后一帧）
+                    self._exhausted = True
+                    return None
+                self.stats['loops'] += 1
+                self._start_time = time.perf_counter()
+                self._position = -1
+                index = self._target_index()
+            if index == self._position and self._frame is not None:
+                self.stats['frames'] += 1
+                return self._frame
+
+            self.stats['skipped'] += max(0, index - self._position - 1)
+            record = self.recording.frames[index]
+            try:
+                image = self.recording.read_frame(record, self._canvas)
+            except Exception as e:
+                print(f"[录制回放] 读取第 {index} 帧失败: {e}")
+                return None
+            if record['meta'].get('rects'):
+                self._canvas = image
+                self.last_rects = [tuple(rect) for rect in record['meta']['rects']]
+            else:
+                self.last_rects = None
+
+            self._position = index
+            self._frame = image
+            self._set_geometry(image)
+            self.stats['frames'] += 1
+            self.stats['decoded'] += 1
+            return image
+
+    def get_recorded_clicks(self):
+        """录制时的点击事件 [(帧号, x, y, 按键), ...]（与回放时 get_clicks() 对比做回归测试）"""
+        if self.recording is None:
+            return []
+        return [(event.get('frame'), event.get('x'), event.get('y'), event.get('button'))
+                for event in self.recording.get_events('click')]
+
+    def get_state(self):
+        if self.recording is None:
+            return "未打开"
+        return "回放结束" if self.is_finished() else "回放中"
@@ -0,0 +1,385 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .folder_watcher import IMAGE_EXTENSIONS
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.wmv', '.webm')
+
+
+def merge_capture_rects(rects, width, height, max_rects=4, padding=0):
+    """整理截图矩形：裁剪到画面范围、合并重叠的矩形；数量超过 max_rects 时合并为外接矩形
+
+    Args:
+        rects: [(x0, y0, x1, y1), ...]
+    Returns:
+        list: 合并后的矩形；覆盖整个画面时返回 None（整帧截图）
+    """
+    clipped = []
+    for x0, y0, x1, y1 in rects:
+        x0, y0 = max(0, int(x0) - padding), max(0, int(y0) - padding)
+        x1, y1 = min(width, int(x1) + padding), min(height, int(y1) + padding)
+        if x1 > x0 and y1 > y0:
+            clipped.append((x0, y0, x1, y1))
+    if not clipped:
+        return None
+
+    # 反复合并相交的矩形，直到互不相交
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for rect in clipped:
+            for i, other in enumerate(result):
+                if rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]:
+                    result[i] = (min(rect[0], other[0]), min(rect[1], other[1]),
+                                 max(rect[2], other[2]), max(rect[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(rect)
+        clipped = result
+
+    if len(clipped) > max_rects:
+        clipped = [(min(r[0] for r in clipped), min(r[1] for r in clipped),
+                    max(r[2] for r in clipped), max(r[3] for r in clipped))]
+    if clipped == [(0, 0, width, height)]:
+        return None
+    return sorted(clipped)
+
+
+def load_rgb_image(path):
+    """读取图片为RGB数组（使用PIL，支持中文路径）"""
+    from PIL import Image
+    with Image.open(path) as pil_image:
+        return np.ascontiguousarray(np.array(pil_image.convert('RGB')))
+
+
+class FrameSource:
+    """截图源接口 - 窗口管理器通过它获取截图，匹配流程不关心截图来自窗口、录像还是合成画面
+
+    子类实现 grab()；没有真实窗口的截图源只记录点击，不执行。
+    """
+
+    name = 'base'
+    is_window = False  # 是否为真实窗口（点击、窗口状态等操作需要窗口句柄）
+    layout = 'RGB'  # grab() 返回的像素布局：RGB 或窗口截图原始的 BGRA
+
+    def __init__(self):
+        self.last_geometry = None  # 最近一次截图的 (截图源句柄, 宽, 高)
+        self.last_rects = None  # 最近一次截图实际截取的矩形，None 表示整帧
+        self._canvas = None  # 局部截图的画布（客户区大小，只更新截取的矩形）
+        self.clicks = []  # 没有真实窗口时记录的点击 [(时间, x, y, 按键), ...]
+        self.max_recorded_clicks = 1000
+        self._click_lock = threading.Lock()
+
+    @property
+    def handle(self):
+        """截图源标识（代替窗口句柄）"""
+        return f"{self.name}:{id(self)}"
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def get_frame_time(self):
+        """最近一次截图对应的时间（秒，与 time.perf_counter 同一时间轴）；None 表示使用当前时间
+
+        回放录制时返回录制时的帧时间，点击间隔等按时间的判断与录制时一致。
+        """
+        return None
+
+    def grab(self, rects=None):
+        """获取一帧截图
+
+        Args:
+            rects: 只截取这些矩形 [(x0, y0, x1, y1), ...]（客户区坐标），None 表示整帧
+        Returns:
+            numpy.ndarray: layout 布局的客户区大小图像 (高, 宽, 3或4)，可能是只读视图或复用的画布；
+                局部截图时矩形以外的像素是之前截图的内容。没有可用画面时返回 None
+        """
+        raise NotImplementedError
+
+    def _get_canvas(self, shape, dtype=np.uint8):
+        if self._canvas is None or self._canvas.shape != tuple(shape) or self._canvas.dtype != dtype:
+            self._canvas = np.zeros(shape, dtype=dtype)
+        return self._canvas
+
+    def _compose(self, image, rects):
+        """局部截图：只把 rects 内的像素复制到画布（回放/合成截图源模拟窗口的局部截图）"""
+        rects = merge_capture_rects(rects, image.shape[1], image.shape[0]) if rects else None
+        self.last_rects = rects
+        if rects is None:
+            return image
+        canvas = self._get_canvas(image.shape, image.dtype)
+        for x0, y0, x1, y1 in rects:
+            canvas[y0:y1, x0:x1] = image[y0:y1, x0:x1]
+        return canvas
+
+    def get_geometry(self):
+        return self.last_geometry
+
+    def get_client_size(self):
+        """画面尺寸 (宽, 高)，未截图时为 None"""
+        if self.last_geometry is None:
+            return None
+        return self.last_geometry[1], self.last_geometry[2]
+
+    def get_state(self):
+        return "正常显示" if self.last_geometry is not None else "未截图"
+
+    def click(self, x, y, button="left"):
+        """记录点击（没有真实窗口）"""
+        with self._click_lock:
+            self.clicks.append((time.time(), int(x), int(y), button))
+            if len(self.clicks) > self.max_recorded_clicks:
+                del self.clicks[:len(self.clicks) - self.max_recorded_clicks]
+        return True
+
+    def get_clicks(self):
+        with self._click_lock:
+            return list(self.clicks)
+
+    def _set_geometry(self, image):
+        self.last_geometry = (self.handle, image.shape[1], image.shape[0])
+
+
+class ReplayFrameSource(FrameSource):
+    """回放截图源 - 从图片文件夹（按文件名排序）或视频文件读取画面
+
+    realtime=True 时按帧率随时间推进（取画面时跳过已过期的帧，与真实窗口截图行为一致）；
+    realtime=False 时每次截图返回下一帧（以最快速度回放）。
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, realtime=True, fps=None, loop=True):
+        super().__init__()
+        self.path = path
+        self.realtime = realtime
+        self.fps = fps  # None: 视频使用文件帧率，图片文件夹默认30
+        self.loop = loop  # 播放到结尾后从头开始
+
+        self._lock = threading.Lock()
+        self._files = None
+        self._capture = None
+        self._frame_count = 0
+        self._position = -1  # 当前画面的帧号
+        self._frame = None
+        self._start_time = None
+        self.stats = {'frames': 0, 'decoded': 0, 'skipped': 0, 'loops': 0}
+
+    @property
+    def handle(self):
+        return f"{self.name}:{self.path}"
+
+    def open(self):
+        with self._lock:
+            return self._open()
+
+    def _open(self):
+        self._close()
+        if os.path.isdir(self.path):
+            self._files = sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                                 if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+            self._frame_count = len(self._files)
+            if self.fps is None:
+                self.fps = 30.0
+        else:
+            capture = cv2.VideoCapture(self.path)
+            if not capture.isOpened():
+                print(f"[回放截图源] 无法打开视频: {self.path}")
+                return False
+            self._capture = capture
+            self._frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            if self.fps is None:
+                self.fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        if self._files is not None and not self._files:
+            print(f"[回放截图源] 文件夹中没有图片: {self.path}")
+            return False
+        self._position = -1
+        self._frame = None
+        self._start_time = time.perf_counter()
+        print(f"[回放截图源] 打开 {self.path}: {self._frame_count or '未知'} 帧, {self.fps:.1f} FPS, "
+              f"{'实时' if self.realtime else '最快速度'}回放")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        self._files = None
+
+    def is_finished(self):
+        """不循环时是否已播放到结尾"""
+        with self._lock:
+            return not self.loop and self._frame_count > 0 and self._position >= self._frame_count - 1
+
+    def _target_index(self):
+        if self.realtime:
+            return int((time.perf_counter() - self._start_time) * self.fps)
+        return self._position + 1
+
+    def _rewind(self):
+        self.stats['loops'] += 1
+        self._start_time = time.perf_counter()
+        self._position = -1
+        if self._capture is not None:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def _read_video(self, index):
+        # 顺序解码：跳过的帧只 grab 不解码
+        while self._position < index - 1:
+            if not self._capture.grab():
+                return None
+            self._position += 1
+            self.stats['skipped'] += 1
+        ok, bgr = self._capture.read()
+        if not ok:
+            return None
+        self._position = index
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+    def _read_file(self, index):
+        self.stats['skipped'] += max(0, index - self._position - 1)
+        self._position = index
+        return load_rgb_image(self._files[index])
+
+    def grab(self, rects=None):
+        image = self._grab_full()
+        if image is None:
+            return None
+        return self._compose(image, rects)
+
+    def _grab_full(self):
+        with self._lock:
+            if self._files is None and self._capture is None and not self._open():
+                return None
+
+            index = self._target_index()
+            if self._frame_count and index >= self._frame_count:
+                if not self.loop:
+                    # 停在最后一帧
+                    return self._frame
+                self._rewind()
+                index = self._target_index()
+            if index == self._position and self._frame is not None:
+                # 实时回放时截图快于帧率：返回同一画面
+                self.stats['frames'] += 1
+                return self._frame
+
+            try:
+                image = self._read_video(index) if self._capture is not None else self._read_file(index)
+            except Exception as e:
+                print(f"[回放截图源] 读取第 {index} 帧失败: {e}")
+                return None
+            if image is None:
+                # 视频帧数未知或不准确时以实际读到的结尾为准
+                if self.loop and self._position >= 0:
+                    self._frame_count = self._position + 1
+                    self._rewind()
+                return self._frame if not self.loop else None
+
+            self._frame = image
+            self._set_geometry(image)
+            self.stats['frames'] += 1
+            self.stats['decoded'] += 1
+            return image
+
+    def get_state(self):
+        if self._files is None and self._capture is None:
+            return "未打开"
+        return "回放结束" if self.is_finished() else "回放中"
+
+
+class SyntheticFrameSource(FrameSource):
+    """合成截图源 - 在纹理背景上的已知位置绘制模板，用于测试和基准测试匹配流程
+
+    templates 为 {键: RGB图像或图片路径}；每帧绘制位置记录在 last_positions（模板中心点，与匹配结果格式一致）。
+    drift 大于0时每帧按随机方向移动模板（测试跟踪和增量匹配）。
+    layout='BGRA' 时输出与窗口截图相同的原始BGRA布局（背景和模板在创建时转换一次）。
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, templates, size=(1280, 720), positions=None, drift=0, seed=0, layout='RGB'):
+        super().__init__()
+        self.layout = layout
+        self.width, self.height = size
+        self.drift = drift
+        self.rng = np.random.default_rng(seed)
+
+        self.templates = {}
+        for key, template in templates.items():
+            image = load_rgb_image(template) if isinstance(template, str) else np.ascontiguousarray(template[:, :, :3])
+            self.templates[key] = image
+
+        # 低频纹理背景（类似界面截图，避免模板在纯色背景上过于容易匹配）
+        coarse = self.rng.integers(0, 255, (self.height // 16 + 1, self.width // 16 + 1, 3), dtype=np.uint8)
+        self.background = cv2.resize(coarse, (self.width, self.height), interpolation=cv2.INTER_CUBIC)
+
+        if layout == 'BGRA':
+            self.background = cv2.cvtColor(self.background, cv2.COLOR_RGB2BGRA)
+            self.templates = {key: cv2.cvtColor(template, cv2.COLOR_RGB2BGRA) for key, template in self.templates.items()}
+
+        self.positions = dict(positions) if positions else self._place_templates()  # 键 -> 左上角 (x, y)
+        self.last_positions = {}  # 键 -> 中心点 (x, y)
+        self.frame_index = 0
+
+    def _place_templates(self):
+        """按网格分散放置模板，互不重叠"""
+        positions = {}
+        x, y, row_height = 8, 8, 0
+        for key, template in self.templates.items():
+            height, width = template.shape[:2]
+            if x + width + 8 > self.width:
+                x, y, row_height = 8, y + row_height + 16, 0
+            if y + height > self.height:
+                print(f"[合成截图源] 画面放不下模板 {key}，跳过")
+                continue
+            positions[key] = (x, y)
+            x += width + 16
+            row_height = max(row_height, height)
+        return positions
+
+    def set_visible(self, key, position):
+        """设置模板位置（左上角），None 表示不绘制"""
+        if position is None:
+            self.positions.pop(key, None)
+        else:
+            self.positions[key] = tuple(position)
+
+    def grab(self, rects=None):
+        image = self.background.copy()
+        centers = {}
+        for key, (x, y) in list(self.positions.items()):
+            template = self.templates[key]
+            height, width = template.shape[:2]
+            if self.drift:
+                x = int(np.clip(x + self.rng.integers(-self.drift, self.drift + 1), 0, self.width - width))
+                y = int(np.clip(y + self.rng.integers(-self.drift, self.drift + 1), 0, self.height - height))
+                self.positions[key] = (x, y)
+            image[y:y + height, x:x + width] = template
+            centers[key] = (x + width // 2, y + height // 2)
+        self.last_positions = centers
+        self.frame_index += 1
+        self._set_geometry(image)
+        return self._compose(image, rects)
+
+    def hit_test(self, x, y):
+        """点击位置落在哪个模板上（按最近一帧的位置），没有时返回 None"""
+        for key, (center_x, center_y) in self.last_positions.items():
+            height, width = self.templates[key].shape[:2]
+            if abs(x - center_x) <= width // 2 and abs(y - center_y) <= height // 2:
+                return key
+        return None
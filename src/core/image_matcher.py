@@ -1,9 +1,21 @@
 import cv2
 import numpy as np
 import os
-import math  # 添加缺失的导入
 from PIL import Image
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .fft_engine import FFTCorrelationEngine
+from .folder_watcher import scan_image_files
+from .frame_context import FrameContext, FramePlanePool, MatchCancelled
+from .masked_matcher import build_mask_info, match_masked
+from .match_cache import MatchResultCache, compute_frame_hash
+from .peak_extractor import extract_peaks, find_local_maxima, get_local_max_radius, suppress_nearby
+from .rejection_cascade import RejectionCascade
+from .template_fingerprint import compute_dhash, compute_exact_fingerprint, find_near_duplicates
+from .template_store import TemplateStore
 
 class ImageMatcher:
     """图像匹配器类 - 支持多位置匹配、螺旋点击和优先级处理"""
@@ -19,6 +31,7 @@ class ImageMatcher:
         # 🚦 预选项相关 - 确保初始化
         self.preselect_image = None
         self.preselect_threshold = 0.8
+        self.preselect_search_region = None  # 预选项搜索区域 (x, y, width, height)，None 表示整帧
     
         self.match_methods = {
             'TM_CCOEFF_NORMED': cv2.TM_CCOEFF_NORMED,
@@ -27,9 +40,99 @@ class ImageMatcher:
         }
         self.current_method = cv2.TM_CCOEFF_NORMED
         
-        # 性能优化
-        self.last_screenshot_hash = None
-        self.cached_results = {}
+        # 性能优化 - 结果缓存（键包含帧内容哈希、匹配方法和阈值）
+        self.result_cache = MatchResultCache(max_entries=256, ttl=2.0)
+        self.result_cache_enabled = True
+        self.cache_hash_sample_step = 4  # 隔行采样SHA-1（1/4的行）+ 整帧CRC32，任意像素变化都使缓存失效；1=全像素SHA-1
+        self._template_revision = 0  # 模板加载版本号，重新加载同一ID时缓存自动失效
+        self.config_revision = 0  # 匹配设置和模板库的版本号，多进程后端据此判断是否需要重启工作进程
+        
+        # 帧上下文 - 每帧的派生数据只计算一次
+        self._frame_lock = threading.Lock()
+        self._current_frame = None
+        self._frame_seq = 0
+        self.plane_pool = FramePlanePool()  # 平面缓冲区跨帧复用，每帧不再分配新的整帧数组
+        
+        # 金字塔匹配（由粗到精）
+        self.pyramid_enabled = False
+        self.pyramid_levels = 2  # 降采样层数，每层缩小一半
+        self.pyramid_min_template_size = 8  # 最粗层模板的最小边长
+        self.pyramid_coarse_margin = 0.15  # 粗匹配阈值放宽量
+        self.pyramid_candidate_factor = 2  # 粗匹配候选数 = 最大匹配数 * 该系数
+        self.pyramid_refine_padding = 2  # 精修窗口额外边距（像素）
+        
+        # 单通道（灰度）匹配
+        self.template_color_modes = {}  # template_id -> 'color' / 'gray' / 'auto'
+        self.default_color_mode = 'color'
+        self.gray_auto_max_variance = 12.0  # auto模式下色彩差异度不超过该值时使用灰度匹配
+        
+        # 模板搜索区域（ROI）
+        self.template_search_regions = {}  # template_id -> (x, y, width, height)，客户区坐标
+        self.learned_regions = {}  # template_id -> {'bounds', 'misses', 'frame_size'}
+        self.region_learn_margin = 16  # 学习区域向外扩展的边距（像素）
+        self.region_miss_limit = 5  # 连续未命中次数达到该值后做一次整帧扫描
+        
+        # 跟踪模式：优先在上次命中位置附近搜索
+        self.tracking_enabled = False
+        self.template_tracks = {}  # template_id -> {'positions', 'confidence', 'frame_size', 'tracked_frames'}
+        self.tracking_radius = 24  # 局部搜索向外扩展的半径（像素）
+        self.tracking_confidence_drop = 0.1  # 置信度下降超过该值时扩大搜索
+        self.tracking_full_search_interval = 10  # 连续跟踪命中该帧数后做一次完整搜索，发现窗口外新出现的实例（0 表示不做）
+        
+        # 增量匹配：只在与上一帧相比有变化的区域重新匹配
+        self.incremental_enabled = False
+        self.dirty_tile_size = 32  # 帧差比较的块大小（像素）
+        self.dirty_history_frames = 8  # 保留最近几帧的变化块，模板隔帧匹配时合并使用
+        self._previous_frame_image = None
+        self._changed_mask = None  # 帧差比较的缓冲区（复用）
+        self._dirty_history = deque(maxlen=self.dirty_history_frames)
+        self.incremental_results = {}  # template_id -> {'positions', 'seq', 'signature'}
+        
+        # 匹配引擎：opencv(逐模板 cv2.matchTemplate) / fft(整帧频谱共享，同尺寸模板批量计算)
+        self.fft_engine = FFTCorrelationEngine()
+        self.template_engines = {}  # template_id -> 'opencv' / 'fft'
+        self.default_engine = 'opencv'
+        
+        # 廉价排除级联：直方图检查 + 小图匹配，通过的模板才做完整匹配
+        self.cascade_enabled = False
+        self.cascade = RejectionCascade()
+        
+        # 透明模板（带Alpha通道）：透明像素不参与匹配
+        self.alpha_mask_threshold = 128  # 不透明度不低于该值的像素参与匹配
+        self.masked_sparse_max_cost = 200000000  # 不透明像素数×通道数×结果面积不超过该值时走稀疏路径
+        
+        # 多尺度匹配：每个目标窗口（句柄+客户区尺寸）只搜索一次最佳缩放比例，之后复用
+        self.multiscale_enabled = False
+        self.multiscale_scales = (0.5, 0.67, 0.75, 0.8, 0.9, 1.0, 1.1, 1.25, 1.5, 1.75, 2.0)
+        self.window_scales = {}  # (窗口句柄, 宽, 高) -> {'scale', 'confidence', 'template_id'}
+        self.scale_calibrations_per_frame = 2  # 每帧最多用几个模板搜索缩放比例
+        self.scale_calibration_failures = {}  # (窗口几何键, template_id) -> {'failures', 'retry_time'}
+        self.scale_retry_interval = 1.0  # 搜索失败（模板不在画面中）后的首次重试间隔（秒），之后每次失败翻倍
+        self.scale_retry_max_interval = 30.0
+        
+        # 窗口几何版本：变化（窗口尺寸/切换窗口）时清除依赖窗口坐标的状态
+        self.geometry_version = None
+        self.geometry_changes = 0
+        
+        # 编译后的模板存储（解码结果和派生数据落盘，下次启动直接内存映射）
+        self.template_store = None
+        
+        # 文件夹加载：工作线程并行解码；延迟模式只读取文件头，首次匹配时才解码像素
+        self.load_workers = min(8, os.cpu_count() or 1)
+        # 延迟解码使用分段锁：不同模板的首次解码可在多个匹配线程中并行，同一模板只解码一次
+        self._lazy_locks = [threading.Lock() for _ in range(16)]
+        self._register_lock = threading.Lock()  # 注册模板时修改共享索引（指纹、缓存等）
+        
+        # 重复模板检测：完全相同的模板共享图像数据，每帧只匹配一次
+        self.fingerprint_index = {}  # 精确指纹 -> {template_id, ...}
+        self.near_duplicate_max_distance = 6  # dHash 汉明距离不超过该值视为近似重复
+        
+        self.frame_stats = {'frames': 0, 'gray_time_saved': 0.0, 'last_frame': {}}
+        # 灰度模板的彩色/灰度耗时比：首次灰度匹配时在后台线程中测量一次（不在匹配路径中做彩色匹配）
+        self.gray_speedups = {}  # template_id -> 耗时比
+        self._gray_calibration_pending = set()
+        self._gray_calibration_lock = threading.Lock()
+        self._gray_calibration_thread = None
         
         self.template_cache = {}  # 模板缓存
         self.last_match_time = 0  # 上次匹配时间
@@ -64,140 +167,953 @@ class ImageMatcher:
                 print(f"图像文件不存在: {image_path}")
                 return False
                 
-            # 使用PIL库加载图像，解决中文路径问题
-            try:
-                from PIL import Image
-                pil_image = Image.open(image_path)
-                # 转换为numpy数组
-                import numpy as np
-                template = np.array(pil_image)
-                # 如果是RGBA格式，转换为RGB
-                if template.shape[2] == 4:
-                    template = template[:, :, :3]
-            except Exception as e:
-                print(f"使用PIL加载图像失败，尝试使用OpenCV: {e}")
-                # 备用方案：使用OpenCV加载图像
-                template = cv2.imread(image_path, cv2.IMREAD_COLOR)
-                
-            if template is None:
-                print(f"无法加载图像: {image_path}")
+            compiled = self.prepare_template(image_path)
+            if compiled is None:
                 return False
-                
-            # 转换为RGB格式（OpenCV默认是BGR）
-            if len(template.shape) == 3 and template.shape[2] == 3:
-                if 'PIL' not in str(type(pil_image)):  # 如果不是通过PIL加载的，需要转换颜色空间
-                    template_rgb = cv2.cvtColor(template, cv2.COLOR_BGR2RGB)
-                else:
-                    template_rgb = template  # PIL已经是RGB格式
+            self._bump_config_revision()
+            return self.register_template(template_id, image_path, compiled)
+            
+        except Exception as e:
+            print(f"加载模板图像失败 {template_id}: {e}")
+            import traceback
+            print(f"错误详情: {traceback.format_exc()}")
+            return False
+            
+    def prepare_template(self, image_path):
+        """解码并编译模板（不修改匹配器状态，可在工作线程中并行执行）
+
+        优先从编译后的模板存储映射（无需解码），文件变化时才重新解码。
+        """
+        compiled = self.template_store.load(image_path) if self.template_store is not None else None
+        if compiled is None:
+            template_rgb, alpha = self.decode_template_file(image_path)
+            if template_rgb is None:
+                return None
+            compiled = self.compile_template(template_rgb, alpha)
+            if self.template_store is not None:
+                try:
+                    self.template_store.save(image_path, compiled)
+                except Exception as e:
+                    print(f"保存编译模板失败 {image_path}: {e}")
+        return compiled
+        
+    def register_template(self, template_id, image_path, compiled, verbose=True):
+        """用编译结果注册模板（需在同一线程中依次调用）"""
+        try:
+            template_rgb = compiled['image']
+            alpha = compiled.get('alpha')
+            fingerprint = compiled['fingerprint']
+            duplicate_of = self.get_duplicate_source(fingerprint, template_id)
+            
+            if duplicate_of is not None:
+                source = self.template_images[duplicate_of]
+                template_rgb = source['image']
+                planes = source['planes']
+                color_variance = source['color_variance']
+                dhash = source['dhash']
+                mask_info = source['mask']
+                print(f"模板 {template_id} 与模板 {duplicate_of} 完全相同，合并为同一匹配任务")
             else:
-                print(f"图像格式不支持: {image_path}, 形状: {template.shape}")
-                return False
+                # 单通道（亮度）平面已预计算，灰度匹配时无需每帧转换
+                planes = {
+                    'color': template_rgb,
+                    'gray': compiled['gray']
+                }
+                color_variance = compiled['color_variance']
+                dhash = compiled['dhash']
+                # 透明通道作为掩码，掩码统计量只在加载时计算一次
+                mask_info = build_mask_info(alpha, planes, self.alpha_mask_threshold) if alpha is not None else None
             
             # 存储模板图像
-            self.template_images[template_id] = {
+            template_data = {
+                'template_id': template_id,
                 'image': template_rgb,
                 'path': image_path,
                 'filename': os.path.basename(image_path),
-                'size': template_rgb.shape[:2]  # (height, width)
+                'size': template_rgb.shape[:2],  # (height, width)
+                'planes': planes,
+                'color_variance': color_variance,
+                'fingerprint': fingerprint,
+                'dhash': dhash,
+                'mask': mask_info,
+                'revision': self._next_template_revision()
             }
             
-            # 清除相关缓存
-            if template_id in self.cached_results:
-                del self.cached_results[template_id]
+            # 预构建金字塔各层，匹配时无需重复降采样（编译结果中已有时直接使用）
+            if self.pyramid_enabled:
+                if duplicate_of is not None or not self.use_compiled_pyramid(template_data, compiled):
+                    self.build_template_pyramid(template_data)
+                
+            self.unregister_fingerprint(template_id)
+            self.template_images[template_id] = template_data
+            self.fingerprint_index.setdefault(fingerprint, set()).add(template_id)
             
-            print(f"成功加载模板图像 {template_id}: {os.path.basename(image_path)}, 尺寸: {template_rgb.shape}")
+            # 清除相关缓存
+            self.clear_template_cache(template_id)
+            self.reset_tracking(template_id)
+            self.incremental_results.pop(template_id, None)
+            self.fft_engine.clear(template_id)
+            
+            if verbose:
+                mask_text = f", 不透明像素: {mask_info['opaque_ratio']:.0%}" if mask_info is not None else ""
+                print(f"成功加载模板图像 {template_id}: {os.path.basename(image_path)}, 尺寸: {template_rgb.shape}{mask_text}")
             return True
             
         except Exception as e:
-            print(f"加载模板图像失败 {template_id}: {e}")
+            print(f"注册模板图像失败 {template_id}: {e}")
             import traceback
             print(f"错误详情: {traceback.format_exc()}")
             return False
             
+    def read_template_size(self, image_path):
+        """只读取图片文件头获取尺寸 (height, width)，失败时返回 None"""
+        try:
+            with Image.open(image_path) as pil_image:
+                width, height = pil_image.size
+            return (height, width)
+        except Exception as e:
+            print(f"读取图像尺寸失败 {image_path}: {e}")
+            return None
+            
+    def register_lazy_template(self, template_id, image_path, size):
+        """注册延迟加载的模板：只保存元数据，像素在首次匹配时解码（见 ensure_template_loaded）"""
+        self.unregister_fingerprint(template_id)
+        self.template_images[template_id] = {
+            'template_id': template_id,
+            'path': image_path,
+            'filename': os.path.basename(image_path),
+            'size': size,  # 文件头中的尺寸，解码后以实际图像为准
+            'fingerprint': None,
+            'mask': None,
+            'lazy': True,
+            'revision': self._next_template_revision()
+        }
+        self.clear_template_cache(template_id)
+        self.reset_tracking(template_id)
+        self.incremental_results.pop(template_id, None)
+        self.fft_engine.clear(template_id)
+        return True
+        
+    def ensure_template_loaded(self, template_id):
+        """确保模板像素已解码（延迟模板在首次匹配时加载），返回模板数据，失败时返回 None"""
+        template_data = self.template_images.get(template_id)
+        if template_data is None or not template_data.get('lazy'):
+            return template_data
+            
+        with self._lazy_locks[hash(template_id) % len(self._lazy_locks)]:
+            # 其他线程可能已完成加载
+            template_data = self.template_images.get(template_id)
+            if template_data is None or not template_data.get('lazy'):
+                return template_data
+            if template_data.get('load_failed'):
+                return None
+                
+            # 解码在分段锁内进行（不阻塞其他模板），只有注册需要全局互斥
+            compiled = self.prepare_template(template_data['path'])
+            with self._register_lock:
+                registered = compiled is not None and self.register_template(
+                    template_id, template_data['path'], compiled, verbose=False)
+            if not registered:
+                template_data['load_failed'] = True
+                print(f"延迟加载模板失败 {template_id}: {template_data['filename']}")
+                return None
+            # 记录为延迟模板：多进程后端的工作进程中同样延迟解码（解码不改变模板库，不更新设置版本号）
+            self.template_images[template_id]['lazy_loaded'] = True
+            return self.template_images[template_id]
+            
+    def decode_template_file(self, image_path):
+        """解码模板图片文件
+
+        Returns:
+            tuple: (RGB图像, 透明通道或None)；失败时返回 (None, None)
+        """
+        # 使用PIL库加载图像，解决中文路径问题
+        alpha = None
+        pil_image = None
+        try:
+            from PIL import Image
+            pil_image = Image.open(image_path)
+            # 调色板/灰度+透明的图像统一转换为RGBA，保留透明信息
+            if pil_image.mode in ('P', 'LA', 'PA') or 'transparency' in pil_image.info:
+                pil_image = pil_image.convert('RGBA')
+            # 转换为numpy数组
+            template = np.array(pil_image)
+            # 如果是RGBA格式，Alpha通道作为匹配掩码
+            if template.shape[2] == 4:
+                alpha = template[:, :, 3].copy()
+                template = template[:, :, :3]
+        except Exception as e:
+            print(f"使用PIL加载图像失败，尝试使用OpenCV: {e}")
+            # 备用方案：使用OpenCV加载图像
+            template = cv2.imread(image_path, cv2.IMREAD_COLOR)
+            
+        if template is None:
+            print(f"无法加载图像: {image_path}")
+            return None, None
+            
+        # 转换为RGB格式（OpenCV默认是BGR）
+        if len(template.shape) == 3 and template.shape[2] == 3:
+            if 'PIL' not in str(type(pil_image)):  # 如果不是通过PIL加载的，需要转换颜色空间
+                template_rgb = cv2.cvtColor(template, cv2.COLOR_BGR2RGB)
+            else:
+                template_rgb = np.ascontiguousarray(template)  # PIL已经是RGB格式
+        else:
+            print(f"图像格式不支持: {image_path}, 形状: {template.shape}")
+            return None, None
+            
+        return template_rgb, alpha
+        
+    def compile_template(self, template_rgb, alpha):
+        """计算模板的派生数据（灰度平面、统计量、指纹、金字塔），结果可保存到模板存储"""
+        gray = cv2.cvtColor(template_rgb, cv2.COLOR_RGB2GRAY)
+        compiled = {
+            'image': template_rgb,
+            'gray': gray,
+            # 色彩差异度：各像素通道间标准差的均值，越小越接近灰度图
+            'color_variance': float(np.std(template_rgb.astype(np.float32), axis=2).mean())
+        }
+        
+        # 指纹：完全相同的模板共享图像数据和每帧的匹配任务（透明通道也参与比较）
+        if alpha is not None:
+            compiled['alpha'] = alpha
+            compiled['fingerprint'] = compute_exact_fingerprint(np.dstack([template_rgb, alpha]))
+            # 透明像素置0后再计算感知指纹，避免只有透明区域不同的模板被判为近似重复
+            compiled['dhash'] = compute_dhash(np.where(alpha >= self.alpha_mask_threshold, gray, 0).astype(np.uint8))
+        else:
+            compiled['fingerprint'] = compute_exact_fingerprint(template_rgb)
+            compiled['dhash'] = compute_dhash(gray)
+            
+        # 金字塔各层（第0层即原图，不重复保存）
+        levels = self.get_pyramid_levels({'size': template_rgb.shape[:2]})
+        compiled['pyramid_levels'] = levels
+        for plane, image in (('color', template_rgb), ('gray', gray)):
+            for level in range(1, levels + 1):
+                image = cv2.pyrDown(image)
+                compiled[f'pyramid_{plane}_{level}'] = image
+        return compiled
+        
+    def use_compiled_pyramid(self, template_data, compiled):
+        """使用编译结果中的金字塔；层数与当前设置不符时返回 False"""
+        levels = self.get_pyramid_levels(template_data)
+        if compiled.get('pyramid_levels', 0) < levels:
+            return False
+        template_data['pyramid'] = {
+            plane: [template_data['planes'][plane]] + [compiled[f'pyramid_{plane}_{level}'] for level in range(1, levels + 1)]
+            for plane in ('color', 'gray')
+        }
+        return True
+        
+    def set_template_store(self, directory):
+        """启用编译后的模板存储（directory 为 None 时禁用）"""
+        try:
+            if directory is None:
+                self.template_store = None
+                self._bump_config_revision()
+                print("模板存储已禁用")
+                return True
+            self.template_store = TemplateStore(directory)
+            self._bump_config_revision()
+            stats = self.template_store.get_stats()
+            print(f"模板存储: {directory}, 已编译模板: {stats['entries']}, 数据大小: {stats['data_size'] / 1048576:.1f}MB")
+            return True
+        except Exception as e:
+            print(f"启用模板存储失败 {directory}: {e}")
+            self.template_store = None
+            return False
+            
+    def _next_template_revision(self):
+        """分配新的模板版本号"""
+        self._template_revision += 1
+        return self._template_revision
+        
+    def _bump_config_revision(self):
+        """匹配设置或模板库已变化"""
+        self.config_revision += 1
+        
+    def set_template_color_mode(self, template_id, mode):
+        """设置模板的颜色匹配模式: color(三通道), gray(单通道亮度), auto(按色彩差异自动选择)"""
+        if mode not in ('color', 'gray', 'auto'):
+            print(f"不支持的颜色模式: {mode}")
+            return False
+            
+        self.template_color_modes[template_id] = mode
+        self.clear_template_cache(template_id)
+        self._bump_config_revision()
+        print(f"模板 {template_id} 颜色模式: {mode}")
+        return True
+        
+    def get_template_plane(self, template_id):
+        """获取模板实际使用的匹配平面: 'color' 或 'gray'"""
+        mode = self.template_color_modes.get(template_id, self.default_color_mode)
+        if mode == 'auto':
+            template_data = self.template_images.get(template_id)
+            # 延迟模板尚未解码时没有色彩差异度
+            if template_data and template_data.get('color_variance', float('inf')) <= self.gray_auto_max_variance:
+                return 'gray'
+            return 'color'
+        return mode
+        
+    def get_duplicate_source(self, fingerprint, template_id):
+        """查找与指纹完全相同的已加载模板（排除自身），没有时返回 None"""
+        for other_id in sorted(self.fingerprint_index.get(fingerprint, ()), key=str):
+            if other_id != template_id and other_id in self.template_images:
+                return other_id
+        return None
+        
+    def unregister_fingerprint(self, template_id):
+        """从指纹索引中移除模板（重新加载或删除时调用）"""
+        template_data = self.template_images.get(template_id)
+        if template_data is None:
+            return
+        ids = self.fingerprint_index.get(template_data['fingerprint'])
+        if ids is not None:
+            ids.discard(template_id)
+            if not ids:
+                del self.fingerprint_index[template_data['fingerprint']]
+                
+    def get_duplicate_groups(self):
+        """完全相同的模板分组 [[template_id, ...], ...]（只包含多于一个模板的组）"""
+        return [sorted(ids, key=str) for ids in self.fingerprint_index.values() if len(ids) > 1]
+        
+    def get_duplicate_report(self, template_ids=None):
+        """重复模板报告：完全相同的分组（已合并为同一匹配任务）和近似重复的模板对（需人工确认）"""
+        if template_ids is None:
+            template_ids = list(self.template_images.keys())
+        # 延迟模板尚未解码，没有指纹，不参与比较
+        template_ids = [tid for tid in template_ids
+                        if tid in self.template_images and not self.template_images[tid].get('lazy')]
+        selected = set(template_ids)
+        
+        exact_groups = [[tid for tid in group if tid in selected] for group in self.get_duplicate_groups()]
+        exact_groups = [group for group in exact_groups if len(group) > 1]
+        
+        # 每组完全相同的模板只取一个参与近似比较
+        representatives = {}
+        for template_id in template_ids:
+            representatives.setdefault(self.template_images[template_id]['fingerprint'], template_id)
+        entries = [(tid, self.template_images[tid]['dhash'], self.template_images[tid]['size'])
+                   for tid in representatives.values()]
+        near_duplicates = find_near_duplicates(entries, self.near_duplicate_max_distance)
+        
+        return {
+            'exact_groups': exact_groups,
+            'near_duplicates': near_duplicates,
+            'merged_templates': sum(len(group) - 1 for group in exact_groups)
+        }
+        
+    def print_duplicate_report(self, report):
+        """输出重复模板报告"""
+        for group in report['exact_groups']:
+            names = [self.template_images[tid]['filename'] for tid in group]
+            print(f"完全相同的模板（共享匹配任务）: {group} {names}")
+        for id_a, id_b, distance in report['near_duplicates']:
+            print(f"近似重复的模板: {id_a}({self.template_images[id_a]['filename']}) ~ "
+                  f"{id_b}({self.template_images[id_b]['filename']}), 差异: {distance}")
+        
+    def set_cascade_mode(self, enabled):
+        """设置排除级联模式 - 完整匹配前先用颜色直方图和小图匹配排除不在画面中的模板"""
+        self.cascade_enabled = bool(enabled)
+        self.cascade.reset_stats()
+        self._bump_config_revision()
+        print(f"设置排除级联: {'启用' if self.cascade_enabled else '禁用'}")
+        
+    def run_cascade(self, template_data, frame, plane, rect):
+        """执行排除级联（同一帧同一模板同一区域只执行一次）
+
+        Returns:
+            tuple: (是否通过, 候选区域列表或None)
+        """
+        full_rect = rect if rect is not None else (0, 0, frame.width, frame.height)
+        key = ('cascade', template_data['fingerprint'], template_data['size'], plane, full_rect,
+               self.current_method, self.match_threshold, self.pyramid_enabled)
+        # 金字塔模式本身就是由粗到精，只做直方图检查
+        return frame.get_derived(key, lambda: self.cascade.run(
+            frame, template_data, plane, full_rect, self.current_method, self.match_threshold,
+            use_coarse=not self.pyramid_enabled))
+        
+    def set_multiscale_mode(self, enabled, scales=None):
+        """设置多尺度匹配模式 - 窗口DPI缩放或尺寸变化后自动寻找模板的最佳缩放比例"""
+        try:
+            self.multiscale_enabled = bool(enabled)
+            if scales is not None:
+                scales = sorted({round(float(scale), 3) for scale in scales if float(scale) > 0})
+                if not scales:
+                    print(f"无效的缩放比例列表: {scales}")
+                    return False
+                self.multiscale_scales = tuple(scales)
+            self.window_scales.clear()
+            self.scale_calibration_failures.clear()
+            self._bump_config_revision()
+            print(f"设置多尺度匹配: {'启用' if self.multiscale_enabled else '禁用'}, 候选比例: {self.multiscale_scales}")
+            return True
+        except (ValueError, TypeError) as e:
+            print(f"设置多尺度匹配失败: {e}")
+            return False
+            
+    def reset_window_scales(self):
+        """清除已缓存的窗口缩放比例，下一帧重新搜索"""
+        self.window_scales.clear()
+        self.scale_calibration_failures.clear()
+        
+    def get_window_geometry_key(self, frame):
+        """当前帧对应的窗口几何键 (窗口句柄, 客户区宽, 客户区高)"""
+        geometry = frame.capture_geometry
+        if geometry is None and self.window_manager is not None:
+            geometry = self.window_manager.last_capture_geometry
+        if geometry is None or tuple(geometry[1:]) != (frame.width, frame.height):
+            # 截图不是来自窗口管理器（或尺寸不符）时只按帧尺寸区分
+            return (None, frame.width, frame.height)
+        return tuple(geometry)
+        
+    def get_window_scale(self, frame):
+        """当前窗口已确定的缩放比例，未确定时为 None"""
+        entry = self.window_scales.get(self.get_window_geometry_key(frame))
+        return entry['scale'] if entry is not None else None
+        
+    def get_scaled_template_data(self, template_data, scale):
+        """获取按比例缩放后的模板数据（按缩放后的尺寸缓存，与原模板共享其他属性）"""
+        template_height, template_width = template_data['size']
+        size = (max(1, int(round(template_height * scale))), max(1, int(round(template_width * scale))))
+        if size == template_data['size']:
+            return template_data
+            
+        scaled_cache = template_data.setdefault('scaled', {})
+        scaled = scaled_cache.get(size)
+        if scaled is None:
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            image = cv2.resize(template_data['image'], (size[1], size[0]), interpolation=interpolation)
+            scaled = {key: value for key, value in template_data.items()
+                      if key not in ('scaled', 'pyramid')}
+            scaled.update({
+                'image': image,
+                'size': size,
+                'planes': {
+                    'color': image,
+                    'gray': cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+                },
+                'scale': scale
+            })
+            if template_data['mask'] is not None:
+                alpha = cv2.resize(template_data['mask']['alpha'], (size[1], size[0]), interpolation=interpolation)
+                scaled['mask'] = build_mask_info(alpha, scaled['planes'], self.alpha_mask_threshold)
+            if self.pyramid_enabled:
+                self.build_template_pyramid(scaled)
+            scaled_cache[size] = scaled
+        return scaled
+        
+    def get_window_template_data(self, template_id, template_data, frame, plane):
+        """多尺度模式下获取当前窗口缩放比例对应的模板数据"""
+        scale = self.get_window_scale(frame)
+        if scale is None:
+            # 该模板在当前窗口上搜索失败过：退避期内不再重复全比例搜索
+            failure_key = (self.get_window_geometry_key(frame), template_id)
+            failure = self.scale_calibration_failures.get(failure_key)
+            if failure is not None and time.monotonic() < failure['retry_time']:
+                return template_data
+            # 每帧限制搜索次数，避免模板都不在画面中时每个模板都做全比例搜索
+            if frame.get_stats().get('scale_calibrations', 0) >= self.scale_calibrations_per_frame:
+                return template_data
+            frame.add_stat('scale_calibrations', 1)
+            scale = self.calibrate_window_scale(template_id, template_data, frame, plane)
+            if scale is None:
+                failures = failure['failures'] + 1 if failure is not None else 1
+                interval = min(self.scale_retry_max_interval, self.scale_retry_interval * 2 ** (failures - 1))
+                self.scale_calibration_failures[failure_key] = {'failures': failures,
+                                                                'retry_time': time.monotonic() + interval}
+                return template_data
+            self.scale_calibration_failures = {key: value for key, value in self.scale_calibration_failures.items()
+                                               if key[0] != failure_key[0]}
+        return self.get_scaled_template_data(template_data, scale)
+        
+    def calibrate_window_scale(self, template_id, template_data, frame, plane):
+        """在所有候选比例下匹配模板，置信度最高且达到阈值的比例缓存为当前窗口的缩放比例"""
+        image = frame.get_plane(plane)
+        best_scale = None
+        best_confidence = -1.0
+        
+        for scale in self.multiscale_scales:
+            # 全比例搜索耗时较长，每个比例之前检查本帧是否已取消
+            frame.check_cancelled(template_id)
+            scaled = self.get_scaled_template_data(template_data, scale)
+            template_height, template_width = scaled['size']
+            if template_height > frame.height or template_width > frame.width:
+                continue
+            _, confidence, _, _ = cv2.minMaxLoc(self.to_score_map(
+                self.match_template_image(image, scaled, plane)))
+            if confidence > best_confidence:
+                best_scale, best_confidence = scale, confidence
+                
+        if best_scale is None or best_confidence < self.match_threshold:
+            return None
+            
+        geometry_key = self.get_window_geometry_key(frame)
+        self.window_scales[geometry_key] = {
+            'scale': best_scale,
+            'confidence': float(best_confidence),
+            'template_id': template_id
+        }
+        print(f"窗口 {geometry_key} 缩放比例: {best_scale} (模板 {template_id}, 置信度: {best_confidence:.3f})")
+        return best_scale
+        
+    def set_template_engine(self, template_ids, engine):
+        """设置一组模板（如同一文件夹的模板库）使用的匹配引擎: opencv 或 fft"""
+        if engine not in ('opencv', 'fft'):
+            print(f"不支持的匹配引擎: {engine}")
+            return False
+            
+        for template_id in template_ids:
+            self.template_engines[template_id] = engine
+            self.clear_template_cache(template_id)
+            self.incremental_results.pop(template_id, None)
+            if engine != 'fft':
+                self.fft_engine.clear(template_id)
+        self._bump_config_revision()
+        print(f"{len(template_ids)} 个模板使用匹配引擎: {engine}")
+        return True
+        
+    def get_template_engine(self, template_id):
+        """获取模板使用的匹配引擎"""
+        return self.template_engines.get(template_id, self.default_engine)
+        
+    def set_template_search_region(self, template_id, region):
+        """设置模板的搜索区域 (x, y, width, height)，客户区坐标；None 表示整帧搜索"""
+        try:
+            if region is None:
+                self.template_search_regions.pop(template_id, None)
+                print(f"模板 {template_id} 搜索区域: 整帧")
+            else:
+                x, y, width, height = [int(v) for v in region]
+                if width <= 0 or height <= 0:
+                    print(f"无效的搜索区域: {region}")
+                    return False
+                self.template_search_regions[template_id] = (x, y, width, height)
+                print(f"模板 {template_id} 搜索区域: ({x}, {y}, {width}, {height})")
+                
+            self.clear_template_cache(template_id)
+            self._bump_config_revision()
+            return True
+        except (ValueError, TypeError) as e:
+            print(f"设置搜索区域失败 {template_id}: {e}")
+            return False
+            
+    def set_template_region_learning(self, template_id, enabled):
+        """启用/禁用搜索区域自动学习 - 根据历史命中位置自动扩展搜索区域"""
+        if enabled:
+            self.learned_regions[template_id] = {'bounds': None, 'misses': 0, 'frame_size': None}
+        else:
+            self.learned_regions.pop(template_id, None)
+        self._bump_config_revision()
+        print(f"模板 {template_id} 搜索区域自动学习: {'启用' if enabled else '禁用'}")
+        
+    def reset_learned_region(self, template_id=None):
+        """清除学习到的搜索区域（None 表示全部模板）"""
+        template_ids = list(self.learned_regions.keys()) if template_id is None else [template_id]
+        for tid in template_ids:
+            if tid in self.learned_regions:
+                self.learned_regions[tid] = {'bounds': None, 'misses': 0, 'frame_size': None}
+                
+    def get_search_rect(self, template_id, frame):
+        """计算本帧的搜索矩形 (x0, y0, x1, y1)，None 表示整帧"""
+        return self.get_search_rect_for_size(template_id, frame.width, frame.height)
+        
+    def get_search_rect_for_size(self, template_id, width, height):
+        """按帧尺寸计算搜索矩形（截图前规划局部截图时使用上一帧的尺寸）"""
+        region = self.template_search_regions.get(template_id)
+        if region is not None:
+            x, y, region_width, region_height = region
+            return self.clip_rect_to_size(width, height, (x, y, x + region_width, y + region_height))
+            
+        learned = self.learned_regions.get(template_id)
+        if learned is None or learned['bounds'] is None:
+            return None
+            
+        # 窗口尺寸变化后学习到的区域失效
+        if learned['frame_size'] != (width, height):
+            learned.update({'bounds': None, 'misses': 0, 'frame_size': None})
+            return None
+            
+        # 连续未命中达到上限时回退为一次整帧扫描
+        if learned['misses'] >= self.region_miss_limit:
+            return None
+            
+        x0, y0, x1, y1 = learned['bounds']
+        margin = self.region_learn_margin
+        return self.clip_rect_to_size(width, height, (x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+        
+    def clip_rect(self, frame, rect):
+        """将矩形裁剪到帧范围内"""
+        return self.clip_rect_to_size(frame.width, frame.height, rect)
+        
+    def clip_rect_to_size(self, width, height, rect):
+        x0, y0, x1, y1 = rect
+        return (max(0, x0), max(0, y0), min(width, x1), min(height, y1))
+        
+    def get_preselect_rect(self, width, height):
+        """预选项的搜索矩形，None 表示整帧"""
+        if self.preselect_search_region is None:
+            return None
+        x, y, region_width, region_height = self.preselect_search_region
+        return self.clip_rect_to_size(width, height, (x, y, x + region_width, y + region_height))
+        
+    def get_capture_rects(self, template_ids, frame_size, include_preselect=False):
+        """局部截图需要截取的矩形：所有模板（及预选项）的搜索区域
+
+        Args:
+            template_ids: 本帧需要匹配的模板
+            frame_size: (宽, 高)，通常为上一帧的尺寸
+            include_preselect: 是否包含预选项的搜索区域
+        Returns:
+            list: [(x0, y0, x1, y1), ...]；任一模板需要整帧搜索时返回 None
+        """
+        width, height = frame_size
+        rects = []
+        for template_id in template_ids:
+            if template_id not in self.template_images:
+                continue
+            rect = self.get_search_rect_for_size(template_id, width, height)
+            if rect is None:
+                return None
+            rects.append(rect)
+        if include_preselect and self.preselect_image:
+            rect = self.get_preselect_rect(width, height)
+            if rect is None:
+                return None
+            rects.append(rect)
+        return rects or None
+        
+    def update_learned_region(self, template_id, template_data, frame, rect, positions):
+        """根据本次匹配结果更新学习区域"""
+        learned = self.learned_regions.get(template_id)
+        if learned is None or template_id in self.template_search_regions:
+            return
+            
+        if positions:
+            # 命中：用命中位置的模板外框扩展区域
+            template_height, template_width = template_data['size']
+            for x, y, _ in positions:
+                hit = (x - template_width // 2, y - template_height // 2,
+                       x - template_width // 2 + template_width, y - template_height // 2 + template_height)
+                bounds = learned['bounds']
+                if bounds is None:
+                    learned['bounds'] = hit
+                else:
+                    learned['bounds'] = (min(bounds[0], hit[0]), min(bounds[1], hit[1]),
+                                         max(bounds[2], hit[2]), max(bounds[3], hit[3]))
+            learned['frame_size'] = (frame.width, frame.height)
+            learned['misses'] = 0
+        elif rect is None:
+            # 整帧扫描仍未命中：重新开始计数，避免模板缺席时每帧都整帧扫描
+            learned['misses'] = 0
+        else:
+            learned['misses'] += 1
+            
+    def record_search_area(self, frame, rect):
+        """记录本帧实际搜索面积"""
+        if rect is None:
+            area = frame.width * frame.height
+        else:
+            area = max(0, rect[2] - rect[0]) * max(0, rect[3] - rect[1])
+        frame.add_stat('searched_area', area)
+        frame.add_stat('full_area', frame.width * frame.height)
+        
+    def record_gray_saving(self, frame, template_data, gray_time):
+        """记录灰度匹配相对彩色匹配节省的时间（按该模板的彩色/灰度耗时比估算）
+
+        耗时比尚未测量时请求后台测量，本帧只计数，不在匹配路径中额外做彩色匹配。
+        """
+        speedup = self.gray_speedups.get(template_data['template_id'])
+        if speedup is not None:
+            frame.add_stat('gray_time_saved', max(0.0, gray_time * (speedup - 1.0)))
+        else:
+            self.request_gray_calibration(frame, template_data['template_id'])
+        frame.add_stat('gray_templates', 1)
+        
+    def request_gray_calibration(self, frame, template_id):
+        """在后台线程中测量模板的彩色/灰度耗时比（每个模板只测量一次，使用请求时的截图副本）"""
+        with self._gray_calibration_lock:
+            if template_id in self._gray_calibration_pending:
+                return
+            self._gray_calibration_pending.add(template_id)
+            if self._gray_calibration_thread is not None and self._gray_calibration_thread.is_alive():
+                # 正在运行的测量线程会继续处理新请求
+                return
+            screenshot = np.array(frame.image)
+            self._gray_calibration_thread = threading.Thread(
+                target=self._run_gray_calibration, args=(screenshot,), name='gray-calibration', daemon=True)
+            self._gray_calibration_thread.start()
+            
+    def _run_gray_calibration(self, screenshot):
+        """测量线程：处理所有等待测量的模板"""
+        while True:
+            with self._gray_calibration_lock:
+                template_ids = [tid for tid in self._gray_calibration_pending if tid not in self.gray_speedups]
+                if not template_ids:
+                    self._gray_calibration_thread = None
+                    return
+            try:
+                speedups = self.calibrate_gray_speedup(screenshot, template_ids, repeat=2)
+            except Exception as e:
+                print(f"测量灰度匹配耗时比失败: {e}")
+                speedups = {}
+            with self._gray_calibration_lock:
+                # 测量失败的模板不再重复测量
+                for template_id in template_ids:
+                    self.gray_speedups.setdefault(template_id, speedups.get(template_id, 1.0))
+        
+    def calibrate_gray_speedup(self, screenshot, template_ids=None, repeat=3):
+        """测量灰度模板的彩色/灰度匹配耗时比（用于统计灰度匹配节省的时间，应用中由 request_gray_calibration 在后台调用）
+
+        Args:
+            screenshot: 用于测量的截图
+            template_ids: 要测量的模板，None 表示所有使用灰度平面的模板
+            repeat: 每个平面重复匹配的次数（取最短耗时）
+        Returns:
+            dict: template_id -> 耗时比
+        """
+        frame = FrameContext(screenshot)
+        frame.get_plane('color')
+        frame.get_plane('gray')
+        if template_ids is None:
+            template_ids = [tid for tid in self.template_images if self.get_template_plane(tid) == 'gray']
+            
+        speedups = {}
+        for template_id in template_ids:
+            template_data = self.ensure_template_loaded(template_id)
+            if template_data is None:
+                continue
+            timings = {}
+            for plane in ('color', 'gray'):
+                best = float('inf')
+                for _ in range(max(1, int(repeat))):
+                    start = time.perf_counter()
+                    self.match_positions(frame, template_data, plane)
+                    best = min(best, time.perf_counter() - start)
+                timings[plane] = best
+            speedup = timings['color'] / max(timings['gray'], 1e-6)
+            self.gray_speedups[template_id] = speedup
+            speedups[template_id] = speedup
+        return speedups
+        
+    def clear_template_cache(self, template_id):
+        """清除指定模板的缓存结果（模板或匹配参数变化后也重新允许缩放比例搜索和测量灰度耗时比）"""
+        self.result_cache.remove_where(lambda key: key[0] == template_id)
+        with self._gray_calibration_lock:
+            self.gray_speedups.pop(template_id, None)
+            self._gray_calibration_pending.discard(template_id)
+        self.scale_calibration_failures = {key: value for key, value in self.scale_calibration_failures.items()
+                                           if key[1] != template_id}
+        
+    def get_cache_key(self, template_id, template_data, frame):
+        """结果缓存键：模板、帧内容哈希以及所有影响匹配结果的参数"""
+        return (
+            template_id,
+            frame.get_content_hash(self.cache_hash_sample_step),
+            template_data['revision'],
+            self.current_method,
+            self.match_threshold,
+            self.max_matches_per_template,
+            self.get_template_plane(template_id),
+            self.template_search_regions.get(template_id),
+            self.pyramid_enabled,
+            self.pyramid_levels,
+            self.get_template_engine(template_id),
+            ('multiscale', self.get_window_scale(frame)) if self.multiscale_enabled else None
+        )
+        
+    def set_result_cache(self, enabled=True, max_entries=None, ttl=None):
+        """配置结果缓存：是否启用、最大条目数、条目过期时间（秒）"""
+        self.result_cache_enabled = bool(enabled)
+        if max_entries is not None:
+            self.result_cache.max_entries = max(1, int(max_entries))
+        if ttl is not None:
+            self.result_cache.ttl = max(0.0, float(ttl))
+        self.result_cache.clear()
+        self._bump_config_revision()
+        print(f"结果缓存: {'启用' if self.result_cache_enabled else '禁用'}, "
+              f"容量: {self.result_cache.max_entries}, TTL: {self.result_cache.ttl}秒")
+            
     def set_match_threshold(self, threshold):
         """设置匹配阈值"""
         try:
             self.match_threshold = max(0.0, min(1.0, float(threshold)))
             self.multi_match_threshold = max(self.match_threshold, 0.8)  # 多匹配阈值稍高
+            self._bump_config_revision()
             print(f"设置匹配阈值: {self.match_threshold}")
             
-            # 清除缓存
-            self.cached_results.clear()
-            
         except (ValueError, TypeError) as e:
             print(f"设置匹配阈值失败: {e}")
             
     def calculate_screenshot_hash(self, screenshot):
-        """计算截图的简单哈希值（用于缓存）"""
+        """计算截图的内容哈希值（用于缓存）"""
         try:
-            # 缩小图像并计算均值作为简单哈希
-            small = cv2.resize(screenshot, (32, 32))
-            return hash(small.tobytes())
-        except:
+            return compute_frame_hash(screenshot, self.cache_hash_sample_step)
+        except Exception as e:
+            print(f"计算截图哈希失败: {e}")
             return None
             
+    def get_frame_context(self, screenshot):
+        """获取截图对应的帧上下文 - 同一截图在多个线程/模板间共享同一个上下文"""
+        if isinstance(screenshot, FrameContext):
+            return screenshot
+            
+        with self._frame_lock:
+            frame = self._current_frame
+            if frame is None or frame.image is not screenshot:
+                self._finish_frame(frame)
+                self._frame_seq += 1
+                frame = FrameContext(screenshot, seq=self._frame_seq, plane_pool=self.plane_pool)
+                self._attach_dirty_tiles(frame)
+                self._current_frame = frame
+            return frame
+            
+    def begin_frame(self, screenshot, geometry=None, capture_rects=None):
+        """开始新的一帧 - 创建帧上下文，派生数据（金字塔、灰度平面等）每帧只构建一次
+
+        geometry 为截图时的窗口几何信息（截图线程与匹配不同步时，窗口管理器记录的可能已是更新的截图）；
+        capture_rects 为局部截图实际截取的矩形，None 表示整帧
+        """
+        with self._frame_lock:
+            self._finish_frame(self._current_frame)
+            self._frame_seq += 1
+            frame = FrameContext(screenshot, seq=self._frame_seq, plane_pool=self.plane_pool)
+            frame.capture_geometry = geometry
+            frame.capture_rects = capture_rects
+            self._check_geometry_version()
+            self._attach_dirty_tiles(frame)
+            self._current_frame = frame
+            return frame
+            
+    def _check_geometry_version(self):
+        """窗口几何版本变化时清除跟踪位置、学习到的搜索区域、增量匹配的上一帧、其他窗口的缩放比例
+        和缩放比例搜索的退避记录（调用方需持有 _frame_lock）"""
+        window_manager = self.window_manager
+        version = getattr(window_manager, 'geometry_version', None)
+        if version is None or version == self.geometry_version:
+            return
+        changed = self.geometry_version is not None
+        self.geometry_version = version
+        if not changed:
+            return
+        
+        self.geometry_changes += 1
+        self.reset_tracking()
+        self.reset_learned_region()
+        self._previous_frame_image = None
+        self._dirty_history.clear()
+        self.incremental_results.clear()
+        # 缩放比例按 (窗口句柄, 宽, 高) 缓存，同一窗口的其他尺寸仍保留（窗口尺寸来回切换时不用重新搜索）
+        geometry = window_manager.geometry
+        if geometry is not None:
+            for key in [key for key in self.window_scales if key[0] != geometry.handle]:
+                del self.window_scales[key]
+        # 缩放比例搜索失败的退避记录只对原来的几何有效
+        self.scale_calibration_failures.clear()
+        print(f"窗口几何变化(版本 {version})，已清除跟踪位置、学习区域和增量匹配状态")
+            
+    def _finish_frame(self, frame):
+        """汇总上一帧的统计信息"""
+        if frame is None:
+            return
+        frame.release_buffers()
+        stats = frame.get_stats()
+        self.frame_stats['frames'] += 1
+        self.frame_stats['gray_time_saved'] += stats.get('gray_time_saved', 0.0)
+        self.frame_stats['last_frame'] = stats
+            
     def find_template(self, screenshot, template_id):
         """查找单个模板"""
         if template_id not in self.template_images:
             return None
             
+        frame = None
         try:
-            template_data = self.template_images[template_id]
-            template = template_data['image']
-            
-            # 确保截图是RGB格式
-            if len(screenshot.shape) == 3 and screenshot.shape[2] == 3:
-                search_image = screenshot
-            else:
-                search_image = cv2.cvtColor(screenshot, cv2.COLOR_BGR2RGB)
+            # 延迟模板在首次匹配时解码
+            template_data = self.ensure_template_loaded(template_id)
+            if template_data is None:
+                return None
+            frame = self.get_frame_context(screenshot)
+            # 帧结束后平面缓冲区等本任务完成才回收
+            frame.enter_task()
+            
+            # 检查结果缓存（相同内容的帧 + 相同匹配参数）
+            cache_key = None
+            if self.result_cache_enabled:
+                cache_key = self.get_cache_key(template_id, template_data, frame)
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    frame.add_stat('cache_hits', 1)
+                    cached_result, cached_positions, cached_rect, cached_template_data = cached
+                    # 命中缓存时跟踪和学习区域照常更新
+                    self.update_learned_region(template_id, cached_template_data, frame, cached_rect, cached_positions)
+                    self.update_track(template_id, frame, cached_positions)
+                    # 返回副本，调用方修改结果不影响缓存
+                    result = dict(cached_result)
+                    result['all_positions'] = list(cached_result['all_positions'])
+                    return result
+                    
+            # 本帧已取消（更高优先级已命中等）时不再匹配
+            frame.check_cancelled(template_id)
             
-            # 执行模板匹配
-            result = cv2.matchTemplate(search_image, template, self.current_method)
+            # 彩色或单通道（灰度）匹配
+            plane = self.get_template_plane(template_id)
             
-            # 根据匹配方法处理结果
-            if self.current_method == cv2.TM_SQDIFF_NORMED:
-                # 对于SQDIFF，值越小越好
-                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-                best_confidence = 1.0 - min_val
-                best_location = min_loc
-                threshold = 1.0 - self.match_threshold
-            else:
-                # 对于其他方法，值越大越好
-                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-                best_confidence = max_val
-                best_location = max_loc
-                threshold = self.match_threshold
+            # 多尺度：使用当前窗口的缩放比例（未知时先搜索一次）
+            if self.multiscale_enabled:
+                template_data = self.get_window_template_data(template_id, template_data, frame, plane)
             
             # 获取模板尺寸
-            template_height, template_width = template.shape[:2]
+            template_height, template_width = template_data['size']
             
-            # 查找所有匹配位置
-            all_positions = []
-            if self.current_method == cv2.TM_SQDIFF_NORMED:
-                locations = np.where(result <= threshold)
-            else:
-                locations = np.where(result >= threshold)
+            # 搜索区域：固定区域 / 学习区域 / 整帧
+            rect = self.get_search_rect(template_id, frame)
+            if not frame.covers(rect):
+                # 局部截图没有截取到搜索区域（区域刚变化），本帧跳过，下一帧的截图会包含该区域
+                frame.add_stat('uncaptured_templates', 1)
+                return None
             
-            # 处理所有匹配位置
-            for pt in zip(*locations[::-1]):  # 切换x,y坐标
-                confidence = result[pt[1], pt[0]]
-                if self.current_method == cv2.TM_SQDIFF_NORMED:
-                    confidence = 1.0 - confidence
-                
-                # 修改中心点计算方式，使用整数计算避免浮点误差
-                center_x = pt[0] + template_width // 2
-                center_y = pt[1] + template_height // 2
+            # 跟踪优先：先在上次命中位置附近搜索，失败或置信度下降时再扩大搜索
+            filtered_positions = None
+            tracked = False
+            track_rects = self.get_track_rects(template_id, template_data, frame, rect)
+            if track_rects:
+                local_positions = self.run_match_rects(frame, template_data, plane, track_rects)
+                if self.is_track_confirmed(template_id, local_positions):
+                    filtered_positions = local_positions
+                    rect = track_rects[0]
+                    tracked = True
+                    frame.add_stat('track_hits', 1)
+                else:
+                    frame.add_stat('track_escalations', 1)
+                    
+            frame.check_cancelled(template_id)
+            
+            # 排除级联：不可能出现在搜索区域中的模板直接跳过完整匹配
+            cascade_regions = None
+            if filtered_positions is None and self.cascade_enabled:
+                passed, cascade_regions = self.run_cascade(template_data, frame, plane, rect)
+                if not passed:
+                    filtered_positions = []
+                    self.incremental_results.pop(template_id, None)
+                    
+            if filtered_positions is None:
+                frame.check_cancelled(template_id)
+                if cascade_regions is not None and self.get_template_engine(template_id) != 'fft':
+                    # 只在小图匹配给出的候选区域内做完整匹配
+                    filtered_positions = self.run_match_rects(frame, template_data, plane, cascade_regions)
+                    self.incremental_results.pop(template_id, None)
+                elif self.incremental_enabled:
+                    # 增量匹配：只在与上一帧相比有变化的区域重新匹配
+                    filtered_positions = self.run_incremental_match(template_id, frame, template_data, plane, rect)
+                else:
+                    filtered_positions = self.run_match(frame, template_data, plane, rect)
+            else:
+                # 跟踪结果只覆盖局部窗口，不能作为增量匹配的基准
+                self.incremental_results.pop(template_id, None)
                 
-                # 只添加置信度足够高的匹配
-                if confidence >= self.match_threshold:
-                    all_positions.append((center_x, center_y, confidence))
-            
-            # 去除重复的匹配（距离太近的视为同一个）
-            filtered_positions = self.filter_nearby_matches(all_positions, min_distance=template_width//3)
-            
-            # 按置信度排序并限制数量
-            filtered_positions.sort(key=lambda x: x[2], reverse=True)
-            filtered_positions = filtered_positions[:self.max_matches_per_template]
+            # 匹配期间本帧被取消（超时、更高优先级命中）时结果作废，不更新学习区域、跟踪和缓存
+            frame.check_cancelled(template_id)
+            self.update_learned_region(template_id, template_data, frame, rect, filtered_positions)
+            self.update_track(template_id, frame, filtered_positions, tracked)
             
             # 准备返回结果
             if filtered_positions:
@@ -211,7 +1127,7 @@ class ImageMatcher:
                 
                 priority = self.get_template_priority(template_id)
                 
-                return {
+                result = {
                     'found': True,
                     'template_id': template_id,
                     'priority': priority,
@@ -223,7 +1139,7 @@ class ImageMatcher:
                 }
             else:
                 priority = self.get_template_priority(template_id)
-                return {
+                result = {
                     'found': False,
                     'template_id': template_id,
                     'priority': priority,
@@ -234,6 +1150,16 @@ class ImageMatcher:
                     'template_size': (template_width, template_height)
                 }
                 
+            # 缓存结果（多尺度模式下缩放比例确定之前不缓存，保证下一帧继续搜索比例；
+            # 跟踪结果只覆盖局部窗口，缓存后相同内容的帧会一直看不到窗口外的实例，也不缓存）
+            if cache_key is not None and not tracked and not (self.multiscale_enabled and cache_key[-1][1] is None):
+                self.result_cache.put(cache_key, (dict(result), list(filtered_positions or []), rect, template_data))
+            return result
+            
+        except MatchCancelled:
+            # 取消的匹配不返回结果，也不写入缓存
+            frame.add_stat('cancelled_templates', 1)
+            return None
         except Exception as e:
             print(f"模板匹配异常 {template_id}: {e}")
             import traceback
@@ -248,37 +1174,494 @@ class ImageMatcher:
                 'match_count': 0,
                 'error': str(e)
             }
+        finally:
+            if frame is not None:
+                frame.exit_task()
+            
+    def run_match(self, frame, template_data, plane, rect):
+        """执行一次匹配并记录搜索面积和灰度节省时间
+
+        完全相同的模板在同一帧、同一搜索区域内只匹配一次，结果共享给所有模板ID。
+        """
+        engine = self.get_template_engine(template_data['template_id'])
+        job_key = ('match_job', template_data['fingerprint'], template_data['size'], plane, rect, engine, self.current_method,
+                   self.match_threshold, self.max_matches_per_template, self.pyramid_enabled, self.pyramid_levels)
+        computed = []
+        
+        def compute():
+            computed.append(True)
+            self.record_search_area(frame, rect)
+            match_start = time.perf_counter()
+            positions = self.match_positions(frame, template_data, plane, rect)
+            # FFT引擎按模板组批量计算，单个模板的耗时不可比，不统计灰度节省
+            if plane == 'gray' and engine != 'fft':
+                self.record_gray_saving(frame, template_data, time.perf_counter() - match_start)
+            return positions
+            
+        positions = frame.get_derived(job_key, compute)
+        if not computed:
+            frame.add_stat('shared_jobs', 1)
+        return list(positions)
+        
+    def set_tracking_mode(self, enabled):
+        """设置跟踪模式 - 优先在模板上次命中位置附近搜索"""
+        self.tracking_enabled = bool(enabled)
+        self.reset_tracking()
+        self._bump_config_revision()
+        print(f"跟踪模式: {'启用' if self.tracking_enabled else '禁用'}")
+        
+    def reset_tracking(self, template_id=None):
+        """清除跟踪状态（None 表示全部模板）"""
+        if template_id is None:
+            self.template_tracks.clear()
+        else:
+            self.template_tracks.pop(template_id, None)
+            
+    def get_track_rects(self, template_id, template_data, frame, search_rect):
+        """根据上次命中位置计算局部搜索矩形列表，没有可用跟踪状态时返回空列表"""
+        if not self.tracking_enabled:
+            return []
+            
+        track = self.template_tracks.get(template_id)
+        if track is None:
+            return []
+            
+        if track['frame_size'] != (frame.width, frame.height):
+            self.template_tracks.pop(template_id, None)
+            return []
+            
+        # 局部搜索看不到窗口外的新实例，连续跟踪一定帧数后本帧改做完整搜索
+        interval = self.tracking_full_search_interval
+        if interval and track['tracked_frames'] >= interval:
+            frame.add_stat('track_full_searches', 1)
+            return []
+            
+        # 每个上次命中位置的模板外框向外扩展跟踪半径
+        template_height, template_width = template_data['size']
+        radius = self.tracking_radius
+        rects = []
+        for x, y, _ in track['positions']:
+            x0 = x - template_width // 2 - radius
+            y0 = y - template_height // 2 - radius
+            x1 = x0 + template_width + 2 * radius
+            y1 = y0 + template_height + 2 * radius
+            
+            # 不超出模板自身的搜索区域
+            if search_rect is not None:
+                x0, y0 = max(x0, search_rect[0]), max(y0, search_rect[1])
+                x1, y1 = min(x1, search_rect[2]), min(y1, search_rect[3])
+            rects.append(self.clip_rect(frame, (x0, y0, x1, y1)))
+        return rects
+        
+    def set_incremental_mode(self, enabled, tile_size=None):
+        """设置增量匹配模式 - 按块比较相邻两帧，只在变化区域附近重新匹配"""
+        with self._frame_lock:
+            self.incremental_enabled = bool(enabled)
+            if tile_size is not None:
+                self.dirty_tile_size = max(4, int(tile_size))
+            self._previous_frame_image = None
+            self._dirty_history.clear()
+            self.incremental_results.clear()
+        self._bump_config_revision()
+        print(f"增量匹配: {'启用' if self.incremental_enabled else '禁用'}, 块大小: {self.dirty_tile_size}")
+        
+    def _attach_dirty_tiles(self, frame):
+        """与上一帧逐块比较，记录本帧的变化块（调用方需持有 _frame_lock）"""
+        if not self.incremental_enabled:
+            return
+            
+        image = frame.image
+        previous = self._previous_frame_image
+        if previous is None or previous.shape != image.shape or previous.dtype != image.dtype:
+            # 第一帧或尺寸变化：没有可比较的基准
+            self._dirty_history.clear()
+            self._previous_frame_image = image.copy()
+            return
+            
+        # 逐元素比较写入复用的缓冲区（原始BGRA截图同样适用）
+        if self._changed_mask is None or self._changed_mask.shape != image.shape:
+            self._changed_mask = np.empty(image.shape, dtype=bool)
+        changed = np.not_equal(image, previous, out=self._changed_mask)
+        if changed.ndim == 3:
+            changed = changed.any(axis=2)
+            
+        # 按块归约：块内任一像素变化即视为该块变化
+        tile = self.dirty_tile_size
+        height, width = changed.shape
+        tiles_y = -(-height // tile)
+        tiles_x = -(-width // tile)
+        padded = np.zeros((tiles_y * tile, tiles_x * tile), dtype=bool)
+        padded[:height, :width] = changed
+        dirty_tiles = padded.reshape(tiles_y, tile, tiles_x, tile).any(axis=(1, 3))
+        
+        self._dirty_history.append((frame.seq, dirty_tiles))
+        np.copyto(self._previous_frame_image, image)
+        
+    def get_dirty_tiles_since(self, seq, current_seq):
+        """合并 seq 之后到 current_seq 为止所有帧的变化块；历史不足时返回 None"""
+        masks = [mask for mask_seq, mask in list(self._dirty_history) if seq < mask_seq <= current_seq]
+        if not masks or len(masks) != current_seq - seq:
+            return None
+        dirty = masks[0].copy()
+        for mask in masks[1:]:
+            dirty |= mask
+        return dirty
+        
+    def run_incremental_match(self, template_id, frame, template_data, plane, rect):
+        """增量匹配：保存整区NMS之前的候选峰值，只在变化块附近重新计算候选，合并后重新做NMS
+
+        未变化区域的候选得分和局部极大值判断都不变，合并后的NMS与整区匹配一致，
+        被变化区域中的峰值抑制的旧峰值在该峰值消失后可以重新出现。
+        """
+        full_rect = rect if rect is not None else (0, 0, frame.width, frame.height)
+        rect_area = max(0, full_rect[2] - full_rect[0]) * max(0, full_rect[3] - full_rect[1])
+        frame.add_stat('incremental_area', rect_area)
+        
+        # 金字塔匹配的候选依赖搜索区域（粗匹配 + 局部精修），无法按块合并，直接整区匹配
+        if self.pyramid_enabled and template_data['mask'] is None and self.get_pyramid_levels(template_data) > 0:
+            self.incremental_results.pop(template_id, None)
+            frame.add_stat('incremental_searched_area', rect_area)
+            return self.run_match(frame, template_data, plane, rect)
+            
+        signature = (
+            plane, full_rect, template_data['revision'], template_data['size'], self.current_method, self.match_threshold,
+            self.dirty_tile_size
+        )
+        
+        match_start = time.perf_counter()
+        candidates = None
+        state = self.incremental_results.get(template_id)
+        if state is not None and state['signature'] == signature:
+            dirty = self.get_dirty_tiles_since(state['seq'], frame.seq)
+            if dirty is not None:
+                candidates = self.match_dirty_candidates(frame, template_data, plane, full_rect, dirty, state['candidates'])
+                
+        if candidates is None:
+            candidates = self.match_candidates(frame, template_data, plane, full_rect)
+            frame.add_stat('incremental_searched_area', rect_area)
+        if plane == 'gray':
+            self.record_gray_saving(frame, template_data, time.perf_counter() - match_start)
+            
+        self.incremental_results[template_id] = {'candidates': candidates, 'seq': frame.seq, 'signature': signature}
+        return self.select_candidate_peaks(template_data, candidates)
+        
+    def match_candidates(self, frame, template_data, plane, rect):
+        """在搜索区域内计算NMS之前的候选峰值，返回 (xs, ys, scores)，坐标为模板左上角在帧内的位置"""
+        template_height, template_width = template_data['size']
+        x0, y0, x1, y1 = rect
+        if x1 - x0 < template_width or y1 - y0 < template_height:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            
+        self.record_search_area(frame, rect)
+        search_image = frame.get_plane(plane)[y0:y1, x0:x1]
+        score_map = self.to_score_map(self.match_template_image(search_image, template_data, plane))
+        flat_indices, scores = find_local_maxima(score_map, self.match_threshold, template_width // 3)
+        map_width = score_map.shape[1]
+        return flat_indices % map_width + x0, flat_indices // map_width + y0, scores
+        
+    def match_dirty_candidates(self, frame, template_data, plane, rect, dirty, previous_candidates):
+        """重新计算受变化块影响的候选，与未受影响的旧候选合并"""
+        tile = self.dirty_tile_size
+        template_height, template_width = template_data['size']
+        radius = get_local_max_radius(template_width // 3)
+        
+        # 受影响的放置位置：模板外框接触变化块（得分改变），或局部极大值窗口内有这样的位置（极大值判断改变）
+        radius_x = -(-(template_width - 1 + radius) // tile)
+        radius_y = -(-(template_height - 1 + radius) // tile)
+        kernel = np.ones((2 * radius_y + 1, 2 * radius_x + 1), dtype=np.uint8)
+        stale = cv2.dilate(dirty.astype(np.uint8), kernel)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(stale, connectivity=8)
+        
+        # 左上角不在受影响块内的旧候选保持不变
+        xs, ys, scores = previous_candidates
+        kept = labels[ys // tile, xs // tile] == 0
+        parts = [(xs[kept], ys[kept], scores[kept])]
+        
+        searched_area = 0
+        for i in range(1, count):
+            tile_x, tile_y, tiles_w, tiles_h = [int(v) for v in stats[i][:4]]
+            # 需要重新计算的放置位置范围（左上角），向外扩展局部极大值半径和模板尺寸后匹配，
+            # 范围边缘的极大值判断与整区匹配看到的邻域相同
+            x0 = max(rect[0], tile_x * tile - radius)
+            y0 = max(rect[1], tile_y * tile - radius)
+            x1 = min(rect[2], (tile_x + tiles_w) * tile + radius + template_width - 1)
+            y1 = min(rect[3], (tile_y + tiles_h) * tile + radius + template_height - 1)
+            if x1 - x0 < template_width or y1 - y0 < template_height:
+                continue
+            searched_area += (x1 - x0) * (y1 - y0)
+            
+            # 外接矩形可能包含其他连通域或未受影响的块，只保留本连通域内的候选
+            new_xs, new_ys, new_scores = self.match_candidates(frame, template_data, plane, (x0, y0, x1, y1))
+            inside = labels[new_ys // tile, new_xs // tile] == i
+            parts.append((new_xs[inside], new_ys[inside], new_scores[inside]))
+            
+        frame.add_stat('incremental_searched_area', searched_area)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+        
+    def select_candidate_peaks(self, template_data, candidates):
+        """对候选峰值做NMS，返回匹配中心点列表 [(x, y, confidence), ...]（与整区匹配的峰值提取顺序相同）"""
+        xs, ys, scores = candidates
+        if xs.size == 0:
+            return []
+        template_height, template_width = template_data['size']
+        
+        # 得分降序，同分按行优先顺序
+        order = np.lexsort((xs, ys, -scores))
+        xs, ys, scores = xs[order], ys[order], scores[order]
+        keep = suppress_nearby(xs, ys, template_width // 3, self.max_matches_per_template)
+        
+        offset_x = template_width // 2
+        offset_y = template_height // 2
+        return [(int(xs[i]) + offset_x, int(ys[i]) + offset_y, float(scores[i])) for i in keep]
+        
+    def run_match_rects(self, frame, template_data, plane, rects):
+        """在多个搜索矩形内匹配并合并结果"""
+        merged = {}
+        for rect in rects:
+            frame.check_cancelled(template_data['template_id'])
+            for x, y, confidence in self.run_match(frame, template_data, plane, rect):
+                # 相邻矩形可能重叠，同一位置只保留一次
+                merged[(x, y)] = confidence
+                
+        template_width = template_data['size'][1]
+        positions = [(x, y, confidence) for (x, y), confidence in merged.items()]
+        positions = self.filter_nearby_matches(positions, min_distance=template_width//3)
+        return positions[:self.max_matches_per_template]
+        
+    def is_track_confirmed(self, template_id, positions):
+        """判断局部搜索结果是否可信（命中数量不减少且置信度没有明显下降）"""
+        track = self.template_tracks.get(template_id)
+        if not positions or track is None:
+            return False
+        if len(positions) < len(track['positions']):
+            return False
+        return positions[0][2] >= track['confidence'] - self.tracking_confidence_drop
+        
+    def update_track(self, template_id, frame, positions, tracked=False):
+        """更新跟踪状态：命中时记录位置，未命中时清除
+
+        tracked 表示结果来自局部跟踪搜索，此时累计连续跟踪帧数；完整搜索的结果将其清零。
+        """
+        if not self.tracking_enabled:
+            return
+        if positions:
+            tracked_frames = 0
+            previous = self.template_tracks.get(template_id)
+            if tracked and previous is not None:
+                tracked_frames = previous['tracked_frames'] + 1
+            self.template_tracks[template_id] = {
+                'positions': list(positions),
+                'confidence': positions[0][2],
+                'frame_size': (frame.width, frame.height),
+                'tracked_frames': tracked_frames
+            }
+        else:
+            self.template_tracks.pop(template_id, None)
             
+    def match_positions(self, frame, template_data, plane='color', rect=None):
+        """在指定平面的搜索区域内匹配模板，返回 [(x, y, confidence), ...]
+
+        rect 为 (x0, y0, x1, y1)，None 表示整帧。
+        """
+        if rect is None:
+            rect = (0, 0, frame.width, frame.height)
+        template_height, template_width = template_data['size']
+        x0, y0, x1, y1 = rect
+        if x1 - x0 < template_width or y1 - y0 < template_height:
+            return []
+            
+        # 透明模板使用掩码匹配，不走金字塔和FFT路径
+        masked = template_data['mask'] is not None
+        
+        if self.pyramid_enabled and not masked:
+            # 由粗到精：低分辨率找候选，全分辨率只在候选附近精修
+            return self.match_template_pyramid(frame, template_data, plane, rect)
+            
+        if (not masked and self.get_template_engine(template_data['template_id']) == 'fft'
+                and rect == (0, 0, frame.width, frame.height)):
+            # 整帧搜索时使用FFT引擎；局部窗口（ROI/跟踪/变化区域）面积小，直接匹配更快
+            return self.match_positions_fft(frame, template_data, plane)
+        
+        # 执行模板匹配
+        search_image = frame.get_plane(plane)[y0:y1, x0:x1]
+        result = self.match_template_image(search_image, template_data, plane)
+        
+        # 向量化峰值提取：局部极大值 + Top-K + 非极大值抑制
+        return self.extract_match_positions(
+            result, template_width, template_height, min_distance=template_width//3, offset=(x0, y0))
+        
+    def match_positions_fft(self, frame, template_data, plane):
+        """FFT引擎整帧匹配 - 同平面同尺寸的FFT模板每帧批量计算一次，结果按模板分发"""
+        template_id = template_data['template_id']
+        template_size = template_data['size']
+        group_key = ('fft_group', plane, template_size, self.current_method,
+                     self.match_threshold, self.max_matches_per_template)
+        
+        group = frame.get_derived(group_key, lambda: self.match_fft_group(
+            frame, plane, self.get_fft_group_members(frame, plane, template_size)))
+        positions = group.get(template_data['fingerprint'])
+        if positions is None:
+            # 本帧批量计算之后才加入的模板单独计算
+            positions = self.match_fft_group(frame, plane, [(template_id, template_data)])[template_data['fingerprint']]
+        return positions
+        
+    def get_fft_group_members(self, frame, plane, template_size):
+        """同一批量计算组的模板：FFT引擎、同平面、同尺寸、整帧搜索，且本帧需要匹配（完全相同的模板只取一个）"""
+        active_ids = frame.active_template_ids
+        fingerprints = set()
+        members = []
+        scale = self.get_window_scale(frame) if self.multiscale_enabled else None
+        for template_id, template_data in list(self.template_images.items()):
+            if self.get_template_engine(template_id) != 'fft' or template_data.get('lazy'):
+                continue
+            # 先做廉价的过滤（未启用、有搜索区域、平面不同），排除级联只对真正参与本组计算的模板运行
+            if active_ids is not None and template_id not in active_ids:
+                continue
+            if template_id in self.template_search_regions or self.get_template_plane(template_id) != plane:
+                continue
+            if scale is not None:
+                template_data = self.get_scaled_template_data(template_data, scale)
+            if template_data['size'] != template_size or template_data['mask'] is not None:
+                continue
+            if template_data['fingerprint'] in fingerprints:
+                continue
+            if self.cascade_enabled and not self.run_cascade(template_data, frame, plane, None)[0]:
+                continue
+            fingerprints.add(template_data['fingerprint'])
+            members.append((template_id, template_data))
+        return members
+        
+    def match_fft_group(self, frame, plane, members):
+        """批量计算一组同尺寸模板，返回 {模板指纹: [(x, y, confidence), ...]}"""
+        if not members:
+            return {}
+        template_height, template_width = members[0][1]['size']
+        templates = [(template_id, template_data['planes'][plane]) for template_id, template_data in members]
+        fingerprints = {template_id: template_data['fingerprint'] for template_id, template_data in members}
+        
+        match_start = time.perf_counter()
+        group = {}
+        for template_id, result in self.fft_engine.match_batch(frame, plane, templates, self.current_method):
+            group[fingerprints[template_id]] = self.extract_match_positions(
+                result, template_width, template_height, min_distance=template_width//3)
+        frame.add_stat('fft_templates', len(members))
+        frame.add_stat('fft_time', time.perf_counter() - match_start)
+        return group
+        
+    def match_template_image(self, search_image, template_data, plane):
+        """对一幅图像执行模板匹配；透明模板只比较不透明像素"""
+        mask_info = template_data['mask']
+        if mask_info is None:
+            return cv2.matchTemplate(search_image, template_data['planes'][plane], self.current_method)
+        return match_masked(search_image, template_data['planes'][plane], mask_info, plane,
+                            self.current_method, self.masked_sparse_max_cost)
+        
+    def to_score_map(self, result):
+        """统一转换为"越大越好"的置信度图"""
+        if self.current_method == cv2.TM_SQDIFF_NORMED:
+            return 1.0 - result
+        return result
+        
+    def extract_match_positions(self, result, template_width, template_height, min_distance, offset=(0, 0)):
+        """从匹配结果图中提取匹配中心点列表 [(x, y, confidence), ...]，按置信度降序"""
+        score_map = self.to_score_map(result)
+        xs, ys, scores = extract_peaks(score_map, self.match_threshold, min_distance, self.max_matches_per_template)
+        
+        # 修改中心点计算方式，使用整数计算避免浮点误差
+        offset_x = offset[0] + template_width // 2
+        offset_y = offset[1] + template_height // 2
+        return [(int(x) + offset_x, int(y) + offset_y, float(conf)) for x, y, conf in zip(xs, ys, scores)]
+            
+    def get_pyramid_levels(self, template_data):
+        """计算模板可用的金字塔层数（缩小后的模板边长不能小于下限）"""
+        template_height, template_width = template_data['size']
+        levels = 0
+        while levels < self.pyramid_levels:
+            if min(template_width, template_height) >> (levels + 1) < self.pyramid_min_template_size:
+                break
+            levels += 1
+        return levels
+        
+    def build_template_pyramid(self, template_data):
+        """预构建模板各平面的金字塔（第0层为原图）"""
+        levels = self.get_pyramid_levels(template_data)
+        pyramids = {}
+        for plane, image in template_data['planes'].items():
+            pyramid = [image]
+            for _ in range(levels):
+                pyramid.append(cv2.pyrDown(pyramid[-1]))
+            pyramids[plane] = pyramid
+        template_data['pyramid'] = pyramids
+        
+    def match_template_pyramid(self, frame, template_data, plane, rect):
+        """金字塔匹配 - 在最粗层搜索区域内匹配找候选，再在全分辨率小窗口内精修"""
+        template = template_data['planes'][plane]
+        template_height, template_width = template_data['size']
+        min_distance = template_width // 3
+        
+        if template_data.get('pyramid') is None:
+            self.build_template_pyramid(template_data)
+        pyramid = template_data['pyramid'][plane]
+        levels = len(pyramid) - 1
+        
+        full_image = frame.get_plane(plane, 0)
+        rect_x0, rect_y0, rect_x1, rect_y1 = rect
+        if levels == 0:
+            # 模板太小无法降采样，退化为全分辨率匹配
+            result = cv2.matchTemplate(full_image[rect_y0:rect_y1, rect_x0:rect_x1], template, self.current_method)
+            return self.extract_match_positions(
+                result, template_width, template_height, min_distance, offset=(rect_x0, rect_y0))
+        
+        scale = 1 << levels
+        coarse_x0 = rect_x0 // scale
+        coarse_y0 = rect_y0 // scale
+        coarse_image = frame.get_plane(plane, levels)[coarse_y0:-(-rect_y1 // scale), coarse_x0:-(-rect_x1 // scale)]
+        coarse_template = pyramid[levels]
+        if coarse_image.shape[0] < coarse_template.shape[0] or coarse_image.shape[1] < coarse_template.shape[1]:
+            return []
+        
+        # 粗匹配：阈值放宽，候选数多于最终结果数
+        coarse_result = self.to_score_map(cv2.matchTemplate(coarse_image, coarse_template, self.current_method))
+        coarse_threshold = max(0.0, self.match_threshold - self.pyramid_coarse_margin)
+        coarse_candidates = max(1, self.max_matches_per_template * self.pyramid_candidate_factor)
+        xs, ys, _ = extract_peaks(coarse_result, coarse_threshold, max(1, min_distance >> levels), coarse_candidates)
+        
+        # 精修：在全分辨率图像中围绕每个候选点的小窗口内匹配（不超出搜索区域）
+        pad = scale + self.pyramid_refine_padding
+        refined = {}
+        
+        for coarse_x, coarse_y in zip(xs, ys):
+            full_x = (int(coarse_x) + coarse_x0) * scale
+            full_y = (int(coarse_y) + coarse_y0) * scale
+            x0 = max(rect_x0, full_x - pad)
+            y0 = max(rect_y0, full_y - pad)
+            x1 = min(rect_x1, full_x + pad + template_width)
+            y1 = min(rect_y1, full_y + pad + template_height)
+            if x1 - x0 < template_width or y1 - y0 < template_height:
+                continue
+                
+            window_result = cv2.matchTemplate(full_image[y0:y1, x0:x1], template, self.current_method)
+            for x, y, confidence in self.extract_match_positions(
+                    window_result, template_width, template_height, min_distance, offset=(x0, y0)):
+                # 相邻窗口可能重叠，同一位置只保留一次
+                refined[(x, y)] = confidence
+        
+        positions = [(x, y, confidence) for (x, y), confidence in refined.items()]
+        positions = self.filter_nearby_matches(positions, min_distance=min_distance)
+        return positions[:self.max_matches_per_template]
+        
     def filter_nearby_matches(self, positions, min_distance=30):
         """过滤距离太近的匹配点"""
         if not positions:
             return []
             
-        filtered = []
-        
         # 按置信度排序
         sorted_positions = sorted(positions, key=lambda x: x[2], reverse=True)
+        xs = [pos[0] for pos in sorted_positions]
+        ys = [pos[1] for pos in sorted_positions]
         
-        for current in sorted_positions:
-            current_x, current_y, current_conf = current
-            
-            # 检查是否与已选择的点距离太近
-            is_far_enough = True
-            for selected in filtered:
-                selected_x, selected_y, selected_conf = selected
-                distance = math.sqrt((current_x - selected_x)**2 + (current_y - selected_y)**2)
-                
-                # 如果距离太近，且当前点的置信度不比已选点高很多，则跳过
-                if distance < min_distance:
-                    # 只有当当前点的置信度比已选点高20%以上时才替换
-                    if current_conf <= selected_conf * 1.2:
-                        is_far_enough = False
-                        break
-            
-            if is_far_enough:
-                filtered.append(current)
-                
-        return filtered
+        keep = suppress_nearby(xs, ys, min_distance, len(sorted_positions))
+        return [sorted_positions[i] for i in keep]
         
     def find_all_templates(self, screenshot):
         """查找所有模板 - 按优先级顺序处理"""
@@ -288,30 +1671,20 @@ class ImageMatcher:
             return results
             
         try:
-            # 计算截图哈希用于缓存
-            screenshot_hash = self.calculate_screenshot_hash(screenshot)
+            # 帧上下文：金字塔、内容哈希等派生数据由所有模板共享
+            frame = self.get_frame_context(screenshot)
             
             # 获取按优先级排序的模板
             priority_sorted_templates = self.get_priority_sorted_templates()
             
             for template_id in priority_sorted_templates:
                 try:
-                    # 检查缓存
-                    cache_key = (template_id, screenshot_hash)
-                    if cache_key in self.cached_results:
-                        results[template_id] = self.cached_results[cache_key]
-                        continue
-                    
-                    # 执行匹配
-                    result = self.find_template(screenshot, template_id)
+                    # 执行匹配（find_template 内部检查结果缓存）
+                    result = self.find_template(frame, template_id)
                     
                     if result:
                         results[template_id] = result
                         
-                        # 缓存结果
-                        if screenshot_hash:
-                            self.cached_results[cache_key] = result
-                        
                         # 如果是高优先级模板匹配成功，可以提前返回
                         priority = result.get('priority', 99)
                         if result.get('found', False) and priority <= 2:
@@ -338,6 +1711,8 @@ class ImageMatcher:
             return results
             
         try:
+            frame = self.get_frame_context(screenshot)
+            
             # 获取按优先级排序的模板
             priority_sorted_templates = self.get_priority_sorted_templates()
             
@@ -349,7 +1724,7 @@ class ImageMatcher:
                     continue
                     
                 try:
-                    result = self.find_template(screenshot, template_id)
+                    result = self.find_template(frame, template_id)
                     if result:
                         results[template_id] = result
                         
@@ -368,15 +1743,11 @@ class ImageMatcher:
         return results
         
     def cleanup_cache(self):
-        """清理缓存"""
+        """清理缓存 - 容量由LRU淘汰保证，这里只清除过期条目"""
         try:
-            # 如果缓存太大，清理一部分
-            if len(self.cached_results) > 100:
-                # 保留最近的50个结果
-                cache_items = list(self.cached_results.items())
-                self.cached_results = dict(cache_items[-50:])
-        except:
-            pass
+            self.result_cache.purge_expired()
+        except Exception as e:
+            print(f"清理缓存失败: {e}")
             
     def get_template_info(self, template_id):
         """获取模板信息"""
@@ -392,7 +1763,8 @@ class ImageMatcher:
             'filename': template_data['filename'],
             'path': template_data['path'],
             'size': template_data['size'],
-            'loaded': True
+            'duplicate_ids': sorted((self.fingerprint_index.get(template_data['fingerprint'], set()) - {template_id}), key=str),
+            'loaded': not template_data.get('lazy', False)
         }
         
     def get_all_templates_info(self):
@@ -413,15 +1785,23 @@ class ImageMatcher:
         """移除模板"""
         try:
             if template_id in self.template_images:
+                self.unregister_fingerprint(template_id)
                 del self.template_images[template_id]
                 
             if template_id in self.template_priorities:
                 del self.template_priorities[template_id]
                 
+            self.template_color_modes.pop(template_id, None)
+            self.template_search_regions.pop(template_id, None)
+            self.learned_regions.pop(template_id, None)
+            self.reset_tracking(template_id)
+            self.incremental_results.pop(template_id, None)
+            self.template_engines.pop(template_id, None)
+            self.fft_engine.clear(template_id)
+            
             # 清理相关缓存
-            cache_keys_to_remove = [key for key in self.cached_results.keys() if key[0] == template_id]
-            for key in cache_keys_to_remove:
-                del self.cached_results[key]
+            self.clear_template_cache(template_id)
+            self._bump_config_revision()
                 
             print(f"已移除模板 {template_id}")
             return True
@@ -434,9 +1814,35 @@ class ImageMatcher:
         """清除所有模板"""
         self.template_images.clear()
         self.template_priorities.clear()
-        self.cached_results.clear()
+        self.template_color_modes.clear()
+        self.template_search_regions.clear()
+        self.learned_regions.clear()
+        self.template_tracks.clear()
+        self.incremental_results.clear()
+        self.template_engines.clear()
+        self.fingerprint_index.clear()
+        self.fft_engine.clear()
+        self.result_cache.clear()
+        with self._gray_calibration_lock:
+            self.gray_speedups.clear()
+            self._gray_calibration_pending.clear()
+        self._bump_config_revision()
         print("已清除所有模板")
         
+    def get_search_area_ratio(self, stats):
+        """计算实际搜索面积占整帧面积的比例"""
+        full_area = stats.get('full_area', 0)
+        if not full_area:
+            return 1.0
+        return stats.get('searched_area', 0) / full_area
+        
+    def get_incremental_skipped_ratio(self, stats):
+        """计算增量匹配跳过的面积比例"""
+        area = stats.get('incremental_area', 0)
+        if not area:
+            return 0.0
+        return 1.0 - stats.get('incremental_searched_area', 0) / area
+        
     def get_statistics(self):
         """获取统计信息"""
         total_templates = len(self.template_images)
@@ -448,10 +1854,44 @@ class ImageMatcher:
                 priority_distribution[priority] = 0
             priority_distribution[priority] += 1
             
+        gray_templates = [tid for tid in self.template_images.keys() if self.get_template_plane(tid) == 'gray']
+        frames = self.frame_stats['frames']
+        
         return {
             'total_templates': total_templates,
             'priority_distribution': priority_distribution,
-            'cache_size': len(self.cached_results),
+            'gray_templates': len(gray_templates),
+            'last_frame_gray_time_saved': self.frame_stats['last_frame'].get('gray_time_saved', 0.0),
+            'last_frame_search_area_ratio': self.get_search_area_ratio(self.frame_stats['last_frame']),
+            'search_region_templates': len(self.template_search_regions),
+            'learned_region_templates': sum(1 for v in self.learned_regions.values() if v['bounds'] is not None),
+            'tracked_templates': len(self.template_tracks),
+            'last_frame_track_hits': self.frame_stats['last_frame'].get('track_hits', 0),
+            'last_frame_track_escalations': self.frame_stats['last_frame'].get('track_escalations', 0),
+            'last_frame_track_full_searches': self.frame_stats['last_frame'].get('track_full_searches', 0),
+            'last_frame_incremental_skipped_ratio': self.get_incremental_skipped_ratio(self.frame_stats['last_frame']),
+            'cascade': self.cascade.get_stats(),
+            'last_frame_cascade_rejected': sum(self.frame_stats['last_frame'].get(f'cascade_{stage}_rejected', 0)
+                                               for stage in RejectionCascade.STAGES),
+            'template_store': self.template_store.get_stats() if self.template_store is not None else None,
+            'plane_pool': self.plane_pool.get_stats(),
+            'masked_templates': sum(1 for data in self.template_images.values() if data['mask'] is not None),
+            'lazy_templates': sum(1 for data in self.template_images.values() if data.get('lazy')),
+            'duplicate_templates': sum(len(ids) - 1 for ids in self.fingerprint_index.values()),
+            'last_frame_shared_jobs': self.frame_stats['last_frame'].get('shared_jobs', 0),
+            'last_frame_cancelled_templates': self.frame_stats['last_frame'].get('cancelled_templates', 0),
+            'last_frame_skipped_templates': self.frame_stats['last_frame'].get('skipped_templates', 0),
+            'last_frame_uncaptured_templates': self.frame_stats['last_frame'].get('uncaptured_templates', 0),
+            'cached_window_scales': len(self.window_scales),
+            'scale_calibration_backoffs': len(self.scale_calibration_failures),
+            'geometry_version': self.geometry_version,
+            'geometry_changes': self.geometry_changes,
+            'fft_engine_templates': sum(1 for tid in self.template_images.keys() if self.get_template_engine(tid) == 'fft'),
+            'fft_cached_spectra': self.fft_engine.get_cached_spectra_count(),
+            'last_frame_fft_time': self.frame_stats['last_frame'].get('fft_time', 0.0),
+            'avg_frame_gray_time_saved': self.frame_stats['gray_time_saved'] / frames if frames else 0.0,
+            'cache_size': len(self.result_cache),
+            'cache': self.result_cache.get_stats(),
             'match_threshold': self.match_threshold,
             'multi_match_threshold': self.multi_match_threshold,
             'max_matches_per_template': self.max_matches_per_template
@@ -461,14 +1901,37 @@ class ImageMatcher:
         """设置匹配方法"""
         if method_name in self.match_methods:
             self.current_method = self.match_methods[method_name]
-            # 清除缓存
-            self.cached_results.clear()
+            self._bump_config_revision()
             print(f"设置匹配方法: {method_name}")
             return True
         else:
             print(f"不支持的匹配方法: {method_name}")
             return False
             
+    def set_pyramid_mode(self, enabled, levels=None):
+        """设置金字塔（由粗到精）匹配模式"""
+        try:
+            self.pyramid_enabled = bool(enabled)
+            if levels is not None:
+                self.pyramid_levels = max(1, int(levels))
+                
+            # 重建模板金字塔
+            for template_data in self.template_images.values():
+                if template_data.get('lazy'):
+                    # 延迟模板解码时按当前设置构建
+                    continue
+                if self.pyramid_enabled:
+                    self.build_template_pyramid(template_data)
+                else:
+                    template_data.pop('pyramid', None)
+                    
+            self._bump_config_revision()
+            print(f"设置金字塔匹配: {'启用' if self.pyramid_enabled else '禁用'}, 层数: {self.pyramid_levels}")
+            return True
+        except (ValueError, TypeError) as e:
+            print(f"设置金字塔匹配失败: {e}")
+            return False
+            
     def get_available_methods(self):
         """获取可用的匹配方法"""
         return list(self.match_methods.keys())
@@ -484,6 +1947,10 @@ class ImageMatcher:
                     invalid_templates.append(template_id)
                     continue
                     
+                # 文件与编译记录一致时无需重新解码
+                if self.template_store is not None and self.template_store.is_current(path):
+                    continue
+                    
                 # 尝试重新加载图像
                 img = cv2.imread(path, cv2.IMREAD_COLOR)
                 if img is None:
@@ -510,14 +1977,19 @@ class ImageMatcher:
                 return False
                 
             # 使用PIL库加载图像，解决中文路径问题
+            alpha = None
             try:
                 from PIL import Image
                 pil_image = Image.open(image_path)
+                # 调色板/灰度+透明的图像统一转换为RGBA，保留透明信息
+                if pil_image.mode in ('P', 'LA', 'PA') or 'transparency' in pil_image.info:
+                    pil_image = pil_image.convert('RGBA')
                 # 转换为numpy数组
                 import numpy as np
                 preselect_img = np.array(pil_image)
-                # 如果是RGBA格式，转换为RGB
+                # 如果是RGBA格式，Alpha通道作为匹配掩码
                 if preselect_img.shape[2] == 4:
+                    alpha = preselect_img[:, :, 3].copy()
                     preselect_img = preselect_img[:, :, :3]
             except Exception as e:
                 print(f"[预选项] 使用PIL加载图像失败，尝试使用OpenCV: {e}")
@@ -542,10 +2014,18 @@ class ImageMatcher:
                 'image': preselect_rgb,
                 'path': image_path,
                 'filename': os.path.basename(image_path),
-                'size': preselect_rgb.shape[:2]  # (height, width)
+                'size': preselect_rgb.shape[:2],  # (height, width)
+                'planes': {'color': preselect_rgb},
+                'mask': None
             }
-            
-            print(f"[预选项] 成功加载预选项图像: {os.path.basename(image_path)}, 尺寸: {preselect_rgb.shape}")
+            if alpha is not None:
+                self.preselect_image['mask'] = build_mask_info(
+                    alpha, self.preselect_image['planes'], self.alpha_mask_threshold)
+            
+            mask_text = ""
+            if self.preselect_image['mask'] is not None:
+                mask_text = f", 不透明像素: {self.preselect_image['mask']['opaque_ratio']:.0%}"
+            print(f"[预选项] 成功加载预选项图像: {os.path.basename(image_path)}, 尺寸: {preselect_rgb.shape}{mask_text}")
             return True
             
         except Exception as e:
@@ -567,6 +2047,23 @@ class ImageMatcher:
         except Exception as e:
             print(f"[预选项] 设置预选项阈值失败: {e}")
 
+    def set_preselect_search_region(self, region):
+        """设置预选项搜索区域 (x, y, width, height)，None 表示整帧"""
+        if region is None:
+            self.preselect_search_region = None
+            print("[预选项] 搜索区域: 整帧")
+            return True
+        try:
+            x, y, width, height = (int(value) for value in region)
+            if width <= 0 or height <= 0:
+                raise ValueError("宽高必须大于0")
+            self.preselect_search_region = (max(0, x), max(0, y), width, height)
+            print(f"[预选项] 搜索区域: {self.preselect_search_region}")
+            return True
+        except (ValueError, TypeError) as e:
+            print(f"[预选项] 设置搜索区域失败: {e}")
+            return False
+            
     def find_preselect_image(self, screenshot):
         """查找预选项图片 - 最高优先级匹配"""
         if not self.preselect_image:
@@ -576,16 +2073,29 @@ class ImageMatcher:
         try:
             preselect_template = self.preselect_image['image']
             
-            # 确保截图是RGB格式
-            if len(screenshot.shape) == 3 and screenshot.shape[2] == 3:
-                search_image = screenshot
-            else:
-                search_image = cv2.cvtColor(screenshot, cv2.COLOR_BGR2RGB)
+            # 确保截图是RGB格式（帧上下文中每帧只转换一次）
+            frame = self.get_frame_context(screenshot)
+            search_image = frame.get_plane('color')
+            
+            # 预选项搜索区域
+            rect = self.get_preselect_rect(frame.width, frame.height)
+            if not frame.covers(rect):
+                print("[预选项] 局部截图未包含预选项搜索区域，本帧跳过")
+                return None
+            offset_x, offset_y = 0, 0
+            if rect is not None:
+                x0, y0, x1, y1 = rect
+                template_height, template_width = preselect_template.shape[:2]
+                if x1 - x0 < template_width or y1 - y0 < template_height:
+                    print(f"[预选项] 搜索区域小于预选项图片: {rect}")
+                    return {'found': False, 'position': None, 'confidence': 0.0}
+                search_image = search_image[y0:y1, x0:x1]
+                offset_x, offset_y = x0, y0
             
             print(f"[预选项] 开始预选项匹配: 模板尺寸={preselect_template.shape}, 截图尺寸={search_image.shape}, 阈值={self.preselect_threshold}")
             
-            # 执行模板匹配
-            result = cv2.matchTemplate(search_image, preselect_template, self.current_method)
+            # 执行模板匹配（透明预选项图片只匹配不透明像素）
+            result = self.match_template_image(search_image, self.preselect_image, 'color')
             
             # 根据匹配方法处理结果
             if self.current_method == cv2.TM_SQDIFF_NORMED:
@@ -605,8 +2115,8 @@ class ImageMatcher:
         
             # 计算中心点位置
             template_height, template_width = preselect_template.shape[:2]
-            center_x = best_location[0] + template_width // 2
-            center_y = best_location[1] + template_height // 2
+            center_x = offset_x + best_location[0] + template_width // 2
+            center_y = offset_y + best_location[1] + template_height // 2
             
             # 详细的调试信息
             print(f"[预选项] 预选项匹配结果: 置信度={best_confidence:.3f}, 位置=({center_x}, {center_y}), 找到={found}")
@@ -684,20 +2194,105 @@ class ImageMatcher:
     def start_new_round(self):
         """开始新的回合"""
         self.round_start_time = time.time()
+        self.reset_tracking()
         print(f"[图像匹配] 开始新回合，延迟时间: {self.round_delay}秒")
         
     def end_round(self):
         """结束当前回合"""
         self.round_start_time = 0
+        self.reset_tracking()
         print("[图像匹配] 回合结束")
 
-    def load_templates_from_directory(self, directory_path, priority, folder_name=None):
+    def get_max_template_id(self):
+        """当前最大的整数模板ID"""
+        return max((tid for tid in self.template_images.keys() if isinstance(tid, int)), default=0)
+        
+    def prepare_template_files(self, image_paths, lazy=False, max_workers=None):
+        """在工作线程中并行解码（延迟模式只读文件头），按 image_paths 顺序逐个产出 (路径, 结果或None)"""
+        if not image_paths:
+            return
+        prepare = self.read_template_size if lazy else self.prepare_template
+        workers = max(1, min(max_workers or self.load_workers, len(image_paths)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='template-loader') as executor:
+            futures = [executor.submit(prepare, image_path) for image_path in image_paths]
+            for image_path, future in zip(image_paths, futures):
+                try:
+                    prepared = future.result()
+                except Exception as e:
+                    print(f"解码模板失败 {image_path}: {e}")
+                    prepared = None
+                yield image_path, prepared
+                
+    def register_prepared_template(self, template_id, image_path, prepared, lazy=False):
+        """注册 prepare_template_files 的结果"""
+        if prepared is None:
+            return False
+        self._bump_config_revision()
+        if lazy:
+            return self.register_lazy_template(template_id, image_path, prepared)
+        return self.register_template(template_id, image_path, prepared, verbose=False)
+        
+    def apply_folder_changes(self, folder_info, added, changed, removed):
+        """只应用文件夹中变化的部分：删除的模板移除，修改的模板以原ID重新加载，新增的模板分配新ID
+        
+        未变化的模板ID、缓存和跟踪状态保持不变；folder_info 的 template_ids / count / file_ids 原地更新。
+        
+        Returns:
+            dict: {'added': [模板ID], 'changed': [模板ID], 'removed': [模板ID], 'failed': [文件路径]}
+        """
+        file_ids = folder_info.setdefault('file_ids', {})
+        lazy = folder_info.get('lazy', False)
+        engine = folder_info.get('engine')
+        result = {'added': [], 'changed': [], 'removed': [], 'failed': []}
+        
+        for image_path in removed:
+            template_id = file_ids.pop(image_path, None)
+            if template_id is not None:
+                self.remove_template(template_id)
+                result['removed'].append(template_id)
+                
+        # 之前加载失败的文件没有模板ID，按新增处理
+        next_id = self.get_max_template_id()
+        for image_path, prepared in self.prepare_template_files(sorted(added + changed), lazy):
+            template_id = file_ids.get(image_path)
+            is_new = template_id is None
+            if is_new:
+                next_id += 1
+                template_id = next_id
+            if not self.register_prepared_template(template_id, image_path, prepared, lazy):
+                result['failed'].append(image_path)
+                continue
+            if is_new:
+                self.set_template_priority(template_id, folder_info['priority'])
+                if engine is not None and engine != self.default_engine:
+                    self.template_engines[template_id] = engine
+                file_ids[image_path] = template_id
+                result['added'].append(template_id)
+            else:
+                result['changed'].append(template_id)
+                
+        removed_ids = set(result['removed'])
+        folder_info['template_ids'] = [tid for tid in folder_info['template_ids'] if tid not in removed_ids] + result['added']
+        folder_info['count'] = len(folder_info['template_ids'])
+        
+        print(f"文件夹变化已应用: {folder_info.get('name')}, 新增: {len(result['added'])}, "
+              f"修改: {len(result['changed'])}, 删除: {len(result['removed'])}, 失败: {len(result['failed'])}")
+        return result
+        
+    def load_templates_from_directory(self, directory_path, priority, folder_name=None, engine=None,
+                                      progress_callback=None, lazy=False, max_workers=None):
         """从文件夹加载模板图像，所有图片使用相同的优先级
         
+        解码和编译在工作线程中并行执行，注册按文件名顺序在调用线程中依次进行（模板ID与串行加载一致）。
+        
         Args:
             directory_path: 文件夹路径
             priority: 所有图片的优先级
             folder_name: 文件夹名称（可选，用于显示）
+            engine: 该模板库使用的匹配引擎（opencv/fft，None 表示默认）
+            progress_callback: 进度回调 callback(已处理数, 总数, 文件名)，在调用线程中调用
+            lazy: 延迟模式 - 只读取文件头，像素在模板首次匹配时解码
+            max_workers: 工作线程数（None 表示使用 self.load_workers）
             
         Returns:
             tuple: (成功加载的图片数量, 加载失败的图片数量, 文件夹信息)
@@ -707,44 +2302,51 @@ class ImageMatcher:
                 print(f"文件夹不存在或不是有效目录: {directory_path}")
                 return 0, 0, None
             
-            # 获取文件夹中的所有图片文件
-            image_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff']
-            image_files = []
-            
-            for file in os.listdir(directory_path):
-                file_path = os.path.join(directory_path, file)
-                if os.path.isfile(file_path) and os.path.splitext(file)[1].lower() in image_extensions:
-                    image_files.append(file_path)
-            
-            if not image_files:
+            # 获取文件夹中的所有图片文件（同时记录修改时间和大小，供变化监视使用）
+            file_index = scan_image_files(directory_path)
+            if not file_index:
                 print(f"文件夹中没有找到图片文件: {directory_path}")
                 return 0, 0, None
             
             # 按文件名排序
-            image_files.sort()
+            image_files = sorted(file_index)
             
             # 找到当前最大的模板ID
-            current_max_id = 0
-            for template_id in self.template_images.keys():
-                if isinstance(template_id, int) and template_id > current_max_id:
-                    current_max_id = template_id
+            current_max_id = self.get_max_template_id()
             
-            # 加载图片
+            # 加载图片：工作线程解码（延迟模式只读文件头），按提交顺序取回结果并注册
             success_count = 0
             failed_count = 0
             template_ids = []
+            file_ids = {}  # 文件路径 -> 模板ID
+            total = len(image_files)
+            load_start = time.time()
+            workers = max(1, min(max_workers or self.load_workers, total))
             
-            for i, image_path in enumerate(image_files):
+            prepared_files = self.prepare_template_files(image_files, lazy, workers)
+            for i, (image_path, prepared) in enumerate(prepared_files):
                 template_id = current_max_id + i + 1
-                
-                if self.set_template_image(template_id, image_path):
+                if self.register_prepared_template(template_id, image_path, prepared, lazy):
                     self.set_template_priority(template_id, priority)  # 所有图片使用相同的优先级
                     template_ids.append(template_id)
+                    file_ids[image_path] = template_id
                     success_count += 1
-                    print(f"从文件夹加载模板 {template_id}: {os.path.basename(image_path)}, 优先级: {priority}")
                 else:
                     failed_count += 1
                     print(f"从文件夹加载模板失败: {image_path}")
+                    
+                if progress_callback is not None:
+                    try:
+                        progress_callback(i + 1, total, os.path.basename(image_path))
+                    except Exception as e:
+                        print(f"加载进度回调失败: {e}")
+            
+            if engine is not None and template_ids:
+                self.set_template_engine(template_ids, engine)
+                
+            # 报告本文件夹中的重复/近似重复模板
+            duplicate_report = self.get_duplicate_report(template_ids)
+            self.print_duplicate_report(duplicate_report)
             
             # 如果未提供文件夹名称，则使用路径的最后一部分
             if folder_name is None:
@@ -757,10 +2359,17 @@ class ImageMatcher:
                 'name': folder_name,
                 'priority': priority,
                 'template_ids': template_ids,
-                'count': success_count
+                'count': success_count,
+                'engine': engine or self.default_engine,
+                'duplicates': duplicate_report,
+                'lazy': bool(lazy),
+                'file_index': file_index,  # 加载时的文件索引 {路径: (修改时间ns, 大小)}
+                'file_ids': file_ids
             }
                 
-            print(f"从文件夹加载完成: {directory_path}, 成功: {success_count}, 失败: {failed_count}")
+            mode_text = "延迟加载" if lazy else f"{workers} 个线程"
+            print(f"从文件夹加载完成: {directory_path}, 成功: {success_count}, 失败: {failed_count}, "
+                  f"优先级: {priority}, {mode_text}, 耗时: {time.time() - load_start:.2f}s")
             return success_count, failed_count, folder_info
             
         except Exception as e:
@@ -0,0 +1,106 @@
+import cv2
+import numpy as np
+
+
+def build_mask_info(alpha, planes, alpha_threshold=128):
+    """根据透明通道构建掩码及其统计量（加载模板时计算一次）
+
+    Args:
+        alpha: 透明通道 (H, W) uint8
+        planes: {'color': RGB图像, 'gray': 灰度图像}
+        alpha_threshold: 不透明度不低于该值的像素参与匹配
+    Returns:
+        dict: 掩码信息；模板完全不透明时返回 None（使用普通匹配）
+    """
+    opaque = alpha >= alpha_threshold
+    count = int(np.count_nonzero(opaque))
+    if count == opaque.size or count == 0:
+        return None
+
+    ys, xs = np.nonzero(opaque)
+    mask = opaque.astype(np.uint8) * 255
+    plane_stats = {}
+    for plane, image in planes.items():
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        values = image[ys, xs].reshape(count, channels).astype(np.float64)
+        centered = values - values.mean(axis=0)
+        plane_stats[plane] = {
+            # 掩码与模板通道数一致，供 cv2.matchTemplate 使用
+            'dense_mask': mask if channels == 1 else cv2.merge([mask] * channels),
+            'values': values.astype(np.float32),
+            'centered': centered.astype(np.float32),
+            'norm': float((values ** 2).sum()),
+            'centered_norm': float((centered ** 2).sum())
+        }
+
+    return {
+        'alpha': alpha,
+        'opaque_count': count,
+        'opaque_ratio': count / opaque.size,
+        'ys': ys,
+        'xs': xs,
+        'planes': plane_stats
+    }
+
+
+def match_masked(image, template, mask_info, plane, method, sparse_max_cost):
+    """带掩码的模板匹配，结果与 cv2.matchTemplate(mask=...) 同尺寸同语义
+
+    不透明像素数 × 通道数 × 结果图面积 不超过 sparse_max_cost 时只对不透明像素逐点累加（稀疏路径），
+    否则使用 OpenCV 的掩码匹配。
+    """
+    result_height = image.shape[0] - template.shape[0] + 1
+    result_width = image.shape[1] - template.shape[1] + 1
+    channels = 1 if image.ndim == 2 else image.shape[2]
+
+    if mask_info['opaque_count'] * channels * result_height * result_width <= sparse_max_cost:
+        return match_sparse(image, mask_info, plane, method, (result_height, result_width))
+
+    result = cv2.matchTemplate(image, template, method, mask=mask_info['planes'][plane]['dense_mask'])
+    # 窗口内方差为0时OpenCV结果为 nan/inf
+    invalid = 1.0 if method == cv2.TM_SQDIFF_NORMED else 0.0
+    return np.nan_to_num(result, nan=invalid, posinf=invalid, neginf=invalid)
+
+
+def match_sparse(image, mask_info, plane, method, result_shape):
+    """稀疏路径：对每个不透明像素，将整幅图像按其偏移平移后累加（只遍历不透明像素）"""
+    stats = mask_info['planes'][plane]
+    result_height, result_width = result_shape
+    channel_planes = [image] if image.ndim == 2 else cv2.split(image)
+    centered = method == cv2.TM_CCOEFF_NORMED
+    weights = stats['centered'] if centered else stats['values']
+
+    numerator = np.zeros(result_shape, dtype=np.float32)
+    window_sums = [np.zeros(result_shape, dtype=np.float64) for _ in channel_planes]
+    window_square = np.zeros(result_shape, dtype=np.float64)
+
+    float_planes = [channel.astype(np.float32) for channel in channel_planes]
+    for k, (y, x) in enumerate(zip(mask_info['ys'], mask_info['xs'])):
+        for c, (channel, float_channel) in enumerate(zip(channel_planes, float_planes)):
+            shifted = float_channel[y:y + result_height, x:x + result_width]
+            cv2.scaleAdd(shifted, float(weights[k, c]), numerator, dst=numerator)
+            window = channel[y:y + result_height, x:x + result_width]
+            cv2.accumulateSquare(window, window_square)
+            if centered:
+                cv2.accumulate(window, window_sums[c])
+
+    numerator = numerator.astype(np.float64)
+    if centered:
+        count = mask_info['opaque_count']
+        energy = window_square - sum(window_sum ** 2 for window_sum in window_sums) / count
+        norm = stats['centered_norm']
+    else:
+        energy = window_square
+        norm = stats['norm']
+
+    denominator = np.sqrt(np.maximum(energy, 0) * norm)
+    valid = denominator > 1e-6 * max(norm, 1.0)
+
+    if method == cv2.TM_SQDIFF_NORMED:
+        result = np.ones(result_shape, dtype=np.float32)
+        np.divide(window_square - 2 * numerator + norm, denominator, out=result, where=valid, casting='unsafe')
+        return np.clip(result, 0.0, 1.0, out=result)
+
+    result = np.zeros(result_shape, dtype=np.float32)
+    np.divide(numerator, denominator, out=result, where=valid, casting='unsafe')
+    return np.clip(result, -1.0, 1.0, out=result)
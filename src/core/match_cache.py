@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def compute_frame_hash(image, sample_step=4):
+    """计算截图内容哈希
+
+    sample_step>1（默认4）时对每隔 sample_step 行采样做SHA-1，再加上整帧的CRC32校验值：
+    只影响未采样行的变化（如1~3像素高的指示条、文字行）也会改变哈希，CRC32 比整帧SHA-1快一倍左右；
+    sample_step=1 时对全部像素做SHA-1。
+    """
+    if image is None:
+        return None
+
+    full = np.ascontiguousarray(image)
+    data = np.ascontiguousarray(full[::sample_step]) if sample_step > 1 else full
+
+    hasher = hashlib.sha1(usedforsecurity=False)
+    # 形状和类型也参与哈希，避免不同尺寸的帧恰好字节相同
+    hasher.update(f"{full.shape}|{full.dtype}|{sample_step}".encode())
+    hasher.update(memoryview(data).cast('B'))
+    if sample_step > 1:
+        hasher.update(zlib.crc32(memoryview(full).cast('B')).to_bytes(4, 'little'))
+    return hasher.hexdigest()
+
+
+class MatchResultCache:
+    """匹配结果缓存 - LRU淘汰 + 条目过期时间（TTL） + 命中统计，线程安全"""
+
+    def __init__(self, max_entries=256, ttl=2.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (过期时间, 结果)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """读取缓存，命中时将条目移到最近使用位置"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expire_time, value = entry
+            if expire_time < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def purge_expired(self):
+        """清除所有已过期条目"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expire_time, _) in self._entries.items() if expire_time < now]
+            for key in expired:
+                del self._entries[key]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def remove_where(self, predicate):
+        """删除满足条件的条目"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """清空缓存（保留统计计数）"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+
+# 局部极大值检测窗口半径上限（像素），更大的抑制距离交给NMS处理
+MAX_LOCAL_MAX_RADIUS = 8
+
+
+def suppress_nearby(xs, ys, min_distance, max_keep):
+    """贪心非极大值抑制 - 输入需已按置信度降序排列，返回保留的下标
+
+    与旧版 filter_nearby_matches 语义一致：距离已保留点小于 min_distance 的点被丢弃。
+    只对候选点循环（数量由Top-K限制），每次抑制都是一次向量化运算。
+    """
+    count = len(xs)
+    if count == 0 or max_keep <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if min_distance <= 0:
+        return np.arange(min(count, max_keep), dtype=np.int64)
+
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    min_distance_sq = int(min_distance) * int(min_distance)
+    suppressed = np.zeros(count, dtype=bool)
+    keep = []
+
+    for i in range(count):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if len(keep) >= max_keep:
+            break
+        dx = xs[i + 1:] - xs[i]
+        dy = ys[i + 1:] - ys[i]
+        suppressed[i + 1:] |= (dx * dx + dy * dy) < min_distance_sq
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+def get_local_max_radius(min_distance):
+    """局部极大值检测窗口半径：某点是否为局部极大值只取决于该半径内的得分"""
+    return max(1, min(MAX_LOCAL_MAX_RADIUS, int(min_distance) // 2))
+
+
+def find_local_maxima(score_map, threshold, min_distance):
+    """NMS之前的候选峰值：得分不低于阈值的局部极大值
+
+    Returns:
+        tuple: (flat_indices, scores) 候选在得分图中的行优先下标（升序）和得分
+    """
+    score_map = np.ascontiguousarray(score_map, dtype=np.float32)
+
+    # 局部极大值：与邻域最大值相等的点（平台上的多个点由NMS去重）
+    radius = get_local_max_radius(min_distance)
+    kernel = np.ones((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+    neighborhood_max = cv2.dilate(score_map, kernel)
+    mask = score_map >= neighborhood_max
+    mask &= score_map >= threshold
+
+    flat_indices = np.flatnonzero(mask)
+    return flat_indices, score_map.ravel()[flat_indices]
+
+
+def extract_peaks(score_map, threshold, min_distance, max_peaks, candidate_factor=4, min_candidates=32):
+    """从匹配得分图中提取峰值（值越大越好）
+
+    流程：局部极大值检测 -> 阈值过滤 -> Top-K候选 -> 非极大值抑制。
+    候选池不足以选出 max_peaks 个峰值时自动扩大，直到覆盖全部候选。
+
+    Returns:
+        tuple: (xs, ys, scores) 三个按得分降序排列的numpy数组，坐标为得分图中的左上角位置
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    if score_map is None or score_map.size == 0 or max_peaks <= 0:
+        return empty
+
+    map_width = score_map.shape[1]
+    flat_indices, scores = find_local_maxima(score_map, threshold, min_distance)
+    if flat_indices.size == 0:
+        return empty
+
+    total = flat_indices.size
+    pool_size = min(total, max(max_peaks * candidate_factor, min_candidates))
+
+    while True:
+        if pool_size < total:
+            pool = np.argpartition(-scores, pool_size - 1)[:pool_size]
+            # 先按下标排序再稳定排序，保证同分时按行优先顺序（与np.where一致）
+            pool.sort()
+            pool = pool[np.argsort(-scores[pool], kind='stable')]
+        else:
+            pool = np.argsort(-scores, kind='stable')
+
+        pool_indices = flat_indices[pool]
+        ys = pool_indices // map_width
+        xs = pool_indices % map_width
+        keep = suppress_nearby(xs, ys, min_distance, max_peaks)
+
+        if len(keep) >= max_peaks or pool_size >= total:
+            break
+        pool_size = min(total, pool_size * 4)
+
+    return xs[keep], ys[keep], scores[pool[keep]]
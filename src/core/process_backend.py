@@ -0,0 +1,374 @@
+import multiprocessing
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# 影响匹配结果的匹配器设置，启动工作进程时复制
+# 跟踪、学习搜索区域和增量匹配依赖同一模板逐帧的历史，而同一模板在各帧可能由不同进程匹配，
+# 工作进程中这些功能始终关闭（不复制对应设置）
+WORKER_CONFIG_ATTRIBUTES = (
+    'match_threshold', 'multi_match_threshold', 'max_matches_per_template', 'current_method',
+    'result_cache_enabled', 'cache_hash_sample_step',
+    'pyramid_enabled', 'pyramid_levels',
+    'default_color_mode', 'template_color_modes', 'gray_auto_max_variance',
+    'template_search_regions',
+    'template_engines', 'default_engine', 'cascade_enabled', 'alpha_mask_threshold',
+    'multiscale_enabled', 'multiscale_scales'
+)
+
+# 共享内存帧槽的头部：int64 帧序号（写入中为 -1），之后为像素数据
+FRAME_HEADER = struct.Struct('q')
+# 帧序号之后是本帧的停止优先级：优先级数字大于该值的模板不再匹配（工作进程看不到主进程的取消令牌）
+STOP_PRIORITY = struct.Struct('q')
+STOP_PRIORITY_OFFSET = 8
+NO_STOP = 2 ** 62
+CANCEL_ALL = -2 ** 62
+FRAME_DATA_OFFSET = 64
+
+
+def export_worker_config(image_matcher):
+    """匹配器设置快照（可序列化，传给工作进程）"""
+    config = {name: getattr(image_matcher, name) for name in WORKER_CONFIG_ATTRIBUTES}
+    config['template_store'] = image_matcher.template_store.directory if image_matcher.template_store is not None else None
+    return config
+
+
+def export_template_bank(image_matcher):
+    """模板库快照 [(模板ID, 文件路径, 延迟模板的尺寸或None), ...]，工作进程按路径自行加载
+
+    延迟模板（包括已在本进程中解码的）在工作进程中同样只注册元数据，首次匹配时才解码。
+    """
+    bank = []
+    for template_id, data in sorted(image_matcher.template_images.items(), key=lambda item: str(item[0])):
+        lazy = data.get('lazy') or data.get('lazy_loaded')
+        bank.append((template_id, data['path'], data['size'] if lazy else None))
+    return bank
+
+
+def pack_result(result):
+    """匹配结果 -> 紧凑记录 (模板ID, 是否找到, 置信度, 所有位置, 模板尺寸)"""
+    return (result['template_id'], result['found'], float(result['confidence']),
+            [tuple(position) for position in result['all_positions']], result.get('template_size'))
+
+
+def unpack_result(record, priority):
+    """紧凑记录 -> 与 ImageMatcher.find_template 相同格式的结果"""
+    template_id, found, confidence, positions, template_size = record
+    return {
+        'found': found,
+        'template_id': template_id,
+        'priority': priority,
+        'position': positions[0] if positions else None,
+        'confidence': confidence,
+        'all_positions': positions,
+        'match_count': len(positions),
+        'template_size': template_size
+    }
+
+
+def attach_shared_memory(name):
+    """连接已存在的共享内存（由发布方负责释放，连接方不登记到资源跟踪器）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数；spawn 的工作进程与发布方共用资源跟踪器，发布方 unlink 时一并注销
+        return shared_memory.SharedMemory(name=name)
+
+
+class _WorkerWindowState:
+    """工作进程中代替窗口管理器，只提供多尺度匹配需要的截图几何信息"""
+
+    def __init__(self):
+        self.last_capture_geometry = None
+
+
+# 工作进程内的状态（每个进程一份）
+_worker = None
+
+
+def _init_worker(config, bank):
+    """工作进程初始化：创建独立的匹配器并加载模板库（优先从模板存储内存映射）"""
+    global _worker
+    from .image_matcher import ImageMatcher
+    from .template_store import TemplateStore
+
+    window_state = _WorkerWindowState()
+    matcher = ImageMatcher(window_state)
+    for name in WORKER_CONFIG_ATTRIBUTES:
+        setattr(matcher, name, config[name])
+    matcher.tracking_enabled = False
+    matcher.incremental_enabled = False
+    if config['template_store']:
+        try:
+            matcher.template_store = TemplateStore(config['template_store'], read_only=True)
+        except Exception as e:
+            print(f"[匹配进程 {os.getpid()}] 打开模板存储失败: {e}")
+
+    for template_id, path, lazy_size in bank:
+        if lazy_size is not None:
+            matcher.register_lazy_template(template_id, path, lazy_size)
+            continue
+        compiled = matcher.prepare_template(path)
+        if compiled is None or not matcher.register_template(template_id, path, compiled, verbose=False):
+            print(f"[匹配进程 {os.getpid()}] 加载模板失败 {template_id}: {path}")
+
+    _worker = {
+        'matcher': matcher,
+        'window_state': window_state,
+        'segments': OrderedDict(),  # 共享内存名称 -> SharedMemory
+        'frame_seq': None,
+        'frame': None
+    }
+
+
+def _ping():
+    return os.getpid()
+
+
+def _get_worker_frame(handle):
+    """读取共享内存中的帧（每帧每进程只复制一次）；帧已被覆盖时返回 None"""
+    if _worker['frame_seq'] == handle['seq']:
+        return _worker['frame']
+
+    segments = _worker['segments']
+    shm = segments.get(handle['name'])
+    if shm is None:
+        shm = attach_shared_memory(handle['name'])
+        segments[handle['name']] = shm
+        while len(segments) > 8:
+            _, old = segments.popitem(last=False)
+            old.close()
+    segments.move_to_end(handle['name'])
+
+    # 序号校验：复制前后序号一致说明复制期间没有被新帧覆盖
+    if FRAME_HEADER.unpack_from(shm.buf, 0)[0] != handle['seq']:
+        return None
+    view = np.ndarray(handle['shape'], dtype=np.dtype(handle['dtype']), buffer=shm.buf, offset=FRAME_DATA_OFFSET)
+    image = view.copy()
+    del view
+    if FRAME_HEADER.unpack_from(shm.buf, 0)[0] != handle['seq']:
+        return None
+
+    _worker['window_state'].last_capture_geometry = handle['geometry']
+    _worker['frame'] = _worker['matcher'].begin_frame(image, handle['geometry'], handle['capture_rects'])
+    _worker['frame_seq'] = handle['seq']
+    return _worker['frame']
+
+
+def write_stop_priority(buf, seq, priority):
+    """降低帧槽中的停止优先级（帧槽已被新帧覆盖时不写入）
+
+    主进程和各工作进程都可能写入，读-改-写之间的竞争最多让停止优先级偏高（少停止一些模板），不影响结果正确性。
+    """
+    if FRAME_HEADER.unpack_from(buf, 0)[0] != seq:
+        return
+    if priority < STOP_PRIORITY.unpack_from(buf, STOP_PRIORITY_OFFSET)[0]:
+        STOP_PRIORITY.pack_into(buf, STOP_PRIORITY_OFFSET, priority)
+
+
+def _match_batch(handle, batch):
+    """工作进程中按顺序匹配一批模板 [(模板ID, 优先级, 是否可抢占), ...]
+
+    可抢占模板命中后本批停止，并通过帧槽通知其他进程停止更低优先级的模板（与线程后端的调度一致）；
+    每个模板之前读取帧槽中的停止优先级：其他批次已命中更高优先级的可抢占模板或本帧已超时时，剩余模板不再匹配。
+
+    Returns:
+        tuple: (帧序号, [紧凑记录, ...], 本批次的帧统计增量)；帧已被覆盖时记录为 None
+    """
+    frame = _get_worker_frame(handle)
+    if frame is None:
+        return handle['seq'], None, {}
+    frame.active_template_ids = handle['active_ids']
+
+    records = []
+    matcher = _worker['matcher']
+    shm = _worker['segments'][handle['name']]
+    stats_before = frame.get_stats()
+    for template_id, priority, preempt in batch:
+        # 未匹配的模板由主进程的调度器计为跳过
+        if (FRAME_HEADER.unpack_from(shm.buf, 0)[0] != handle['seq'] or
+                priority > STOP_PRIORITY.unpack_from(shm.buf, STOP_PRIORITY_OFFSET)[0]):
+            break
+        result = matcher.find_template(frame, template_id)
+        if result is None:
+            continue
+        records.append(pack_result(result))
+        if result.get('found', False) and preempt:
+            write_stop_priority(shm.buf, handle['seq'], priority)
+            break
+    # 统计增量返回给主进程的帧上下文（缓存命中、取消、搜索面积等）
+    stats = {}
+    for name, value in frame.get_stats().items():
+        if isinstance(value, (int, float)) and value != stats_before.get(name, 0):
+            stats[name] = value - stats_before.get(name, 0)
+    return handle['seq'], records, stats
+
+
+class ProcessMatchingBackend:
+    """多进程匹配后端 - 每个工作进程持有独立的模板库，不受GIL限制
+
+    每帧截图只写入一次共享内存（环形的几个帧槽），任务只传递帧槽名称和帧序号，
+    结果以紧凑记录返回。模板库或匹配设置变化（匹配器的设置版本号变化）时自动重启工作进程。
+
+    限制：工作进程中不使用跟踪、学习搜索区域和增量匹配（见 WORKER_CONFIG_ATTRIBUTES），
+    主进程中的这些状态也不会更新；帧统计增量随结果返回并累加到主进程的帧上下文。
+    """
+
+    def __init__(self, workers=None, frame_slots=3):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.frame_slots = frame_slots  # 帧槽数量，大于1时慢任务仍可读取上一帧
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._revision = None  # 当前工作进程加载的匹配器设置版本号
+        self._slots = []  # [SharedMemory 或 None]
+        self._frame_seq = 0
+        self._handle = None  # 最近发布的帧
+
+        self.stats = {'frames': 0, 'batches': 0, 'stale_batches': 0, 'restarts': 0}
+
+    def start(self, image_matcher):
+        """按当前模板库启动工作进程，等待所有进程完成初始化（设置版本号未变化时不重启）"""
+        revision = image_matcher.config_revision
+        with self._lock:
+            if self._executor is not None and revision == self._revision:
+                return
+        config = export_worker_config(image_matcher)
+        bank = export_template_bank(image_matcher)
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self.stats['restarts'] += 1
+            # 使用 spawn：工作进程不继承父进程的线程和窗口句柄（与 Windows 行为一致）
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(config, bank))
+            self._revision = revision
+            executor = self._executor
+
+        # 预热：进程启动和模板加载不计入第一帧的匹配时间
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        print(f"多进程匹配后端已启动: {self.workers} 个进程, 模板: {len(bank)}")
+
+    def shutdown(self):
+        """停止工作进程并释放共享内存"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+            self._revision = None
+            self._handle = None
+            for shm in self._slots:
+                if shm is not None:
+                    shm.close()
+                    try:
+                        shm.unlink()
+                    except FileNotFoundError:
+                        pass
+            self._slots = []
+
+    def publish_frame(self, image_matcher, frame, window_geometry=None):
+        """发布一帧：模板库或设置变化时先重启工作进程，然后把截图写入下一个帧槽"""
+        if image_matcher.config_revision != self._revision:
+            self.start(image_matcher)
+
+        image = np.ascontiguousarray(frame.image)
+        with self._lock:
+            self._frame_seq += 1
+            seq = self._frame_seq
+            index = seq % self.frame_slots
+            while len(self._slots) < self.frame_slots:
+                self._slots.append(None)
+
+            size = FRAME_DATA_OFFSET + image.nbytes
+            shm = self._slots[index]
+            if shm is None or shm.size < size:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+                shm = shared_memory.SharedMemory(create=True, size=size)
+                self._slots[index] = shm
+
+            FRAME_HEADER.pack_into(shm.buf, 0, -1)
+            STOP_PRIORITY.pack_into(shm.buf, STOP_PRIORITY_OFFSET, NO_STOP)
+            view = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf, offset=FRAME_DATA_OFFSET)
+            view[...] = image
+            del view
+            FRAME_HEADER.pack_into(shm.buf, 0, seq)
+
+            self._handle = {
+                'name': shm.name,
+                'seq': seq,
+                'shape': image.shape,
+                'dtype': image.dtype.str,
+                'geometry': window_geometry,
+                'active_ids': frame.active_template_ids,
+                'capture_rects': frame.capture_rects
+            }
+            self.stats['frames'] += 1
+            return self._handle
+
+    def stop_priority(self, handle, priority):
+        """本帧中优先级数字大于 priority 的模板不再开始匹配（CANCEL_ALL 表示全部停止）"""
+        with self._lock:
+            shm = self._slots[handle['seq'] % self.frame_slots] if self._slots else None
+            if shm is not None:
+                write_stop_priority(shm.buf, handle['seq'], priority)
+
+    def cancel_frame(self, handle):
+        """本帧剩余的模板全部不再匹配"""
+        self.stop_priority(handle, CANCEL_ALL)
+
+    def submit(self, template_ids, priority_getter, frame=None, preempt_ids=None):
+        """在工作进程中匹配一批模板（使用最近发布的帧），frame 为主进程的帧上下文（累加统计）
+
+        preempt_ids 中的模板命中时通知其他进程停止匹配更低优先级的模板（None 表示任何命中都停止）；
+        本帧被取消（超时等）时由调用方调用 cancel_frame。
+
+        Returns:
+            Future: 结果为 {模板ID: 结果}，格式与线程后端相同
+        """
+        with self._lock:
+            executor = self._executor
+            handle = self._handle
+        if executor is None or handle is None:
+            raise RuntimeError("多进程匹配后端未启动或没有发布帧")
+
+        outer = Future()
+        batch = [(template_id, priority_getter(template_id), preempt_ids is None or template_id in preempt_ids)
+                 for template_id in template_ids]
+        inner = executor.submit(_match_batch, handle, batch)
+
+        def on_done(done):
+            try:
+                seq, records, stats = done.result()
+            except Exception as e:
+                outer.set_exception(e)
+                return
+            with self._lock:
+                self.stats['batches'] += 1
+                if records is None:
+                    self.stats['stale_batches'] += 1
+            if frame is not None:
+                for name, value in stats.items():
+                    frame.add_stat(name, value)
+            results = {}
+            for record in records or ():
+                results[record[0]] = unpack_result(record, priority_getter(record[0]))
+            outer.set_result(results)
+
+        inner.add_done_callback(on_done)
+        return outer
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['workers'] = self.workers
+        return stats
@@ -0,0 +1,183 @@
+import threading
+
+import cv2
+import numpy as np
+
+from .peak_extractor import extract_peaks
+
+
+class RejectionCascade:
+    """廉价排除级联 - 在完整 matchTemplate 之前用低成本测试排除不在画面中的模板
+
+    第1级：颜色直方图存在性检查（搜索区域的颜色必须能"容纳"模板的颜色）
+    第2级：降采样小图匹配（放宽阈值），通过时给出候选区域，完整匹配只在候选区域内进行
+    """
+
+    STAGES = ('histogram', 'coarse')
+
+    def __init__(self):
+        self.histogram_bins = {'color': 8, 'gray': 32}  # 每通道量化级数
+        self.histogram_min_overlap = 0.6  # 模板颜色在搜索区域中能找到的最低比例
+        self.coarse_levels = 2  # 小图匹配的最大降采样层数
+        self.coarse_min_template_size = 8  # 降采样后模板最小边长
+        self.coarse_margin = 0.2  # 小图匹配阈值放宽量
+        self.coarse_max_candidates = 8  # 候选区域数超过该值时不再限制区域（整区匹配）
+        self.coarse_padding = 2  # 候选区域额外边距（像素）
+
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """重置各级统计"""
+        with self._lock:
+            self.stats = {'checked': 0, 'passed': 0}
+            for stage in self.STAGES:
+                self.stats[f'{stage}_checked'] = 0
+                self.stats[f'{stage}_rejected'] = 0
+
+    def _count(self, frame, name):
+        with self._lock:
+            self.stats[name] += 1
+        frame.add_stat(f'cascade_{name}', 1)
+
+    def get_stats(self):
+        """各级排除率：rejection_rate = 该级排除数 / 进入该级的模板数"""
+        with self._lock:
+            stats = dict(self.stats)
+        for stage in self.STAGES:
+            checked = stats[f'{stage}_checked']
+            stats[f'{stage}_rejection_rate'] = stats[f'{stage}_rejected'] / checked if checked else 0.0
+        stats['pass_rate'] = stats['passed'] / stats['checked'] if stats['checked'] else 0.0
+        return stats
+
+    def compute_histogram(self, image, plane, mask=None):
+        """量化颜色直方图（float32，展平）"""
+        bins = self.histogram_bins[plane]
+        if plane == 'gray':
+            hist = cv2.calcHist([image], [0], mask, [bins], [0, 256])
+        else:
+            hist = cv2.calcHist([image], [0, 1, 2], mask, [bins] * 3, [0, 256] * 3)
+        return hist.ravel()
+
+    def get_template_histogram(self, template_data, plane):
+        """模板直方图（透明模板只统计不透明像素），缓存在模板数据中"""
+        cache = template_data.setdefault('cascade_histograms', {})
+        hist = cache.get(plane)
+        if hist is None:
+            mask = None
+            mask_info = template_data['mask']
+            if mask_info is not None:
+                mask = np.zeros(template_data['size'], dtype=np.uint8)
+                mask[mask_info['ys'], mask_info['xs']] = 1
+            hist = self.compute_histogram(template_data['planes'][plane], plane, mask)
+            cache[plane] = hist
+        return hist
+
+    def get_region_histogram(self, frame, plane, rect):
+        """搜索区域直方图，相邻量化级合并（容忍量化边界附近的颜色偏差），每帧每区域只计算一次"""
+        def compute():
+            x0, y0, x1, y1 = rect
+            hist = self.compute_histogram(frame.get_plane(plane)[y0:y1, x0:x1], plane)
+            bins = self.histogram_bins[plane]
+            shape = (bins,) if plane == 'gray' else (bins, bins, bins)
+            hist = hist.reshape(shape)
+            # 每个量化级取自身及相邻级的最大值
+            padded = np.pad(hist, 1)
+            spread = hist.copy()
+            for offsets in np.ndindex(*([3] * hist.ndim)):
+                window = tuple(slice(o, o + n) for o, n in zip(offsets, shape))
+                np.maximum(spread, padded[window], out=spread)
+            return spread.ravel()
+
+        return frame.get_derived(('cascade_hist', plane, rect), compute)
+
+    def check_histogram(self, frame, template_data, plane, rect):
+        """第1级：模板各颜色在搜索区域中的数量不少于模板自身（允许一定比例缺失）"""
+        template_hist = self.get_template_histogram(template_data, plane)
+        region_hist = self.get_region_histogram(frame, plane, rect)
+        total = float(template_hist.sum())
+        if total <= 0:
+            return True
+        overlap = float(np.minimum(template_hist, region_hist).sum()) / total
+        return overlap >= self.histogram_min_overlap
+
+    def get_coarse_level(self, template_data):
+        """小图匹配使用的降采样层数（0表示模板太小，跳过该级）"""
+        template_height, template_width = template_data['size']
+        level = 0
+        while level < self.coarse_levels and min(template_width, template_height) >> (level + 1) >= self.coarse_min_template_size:
+            level += 1
+        return level
+
+    def check_coarse(self, frame, template_data, plane, rect, method, threshold):
+        """第2级：降采样小图匹配
+
+        Returns:
+            tuple: (是否通过, 候选区域列表或None)；None 表示不限制区域
+        """
+        level = self.get_coarse_level(template_data)
+        if level == 0:
+            return True, None
+
+        cache = template_data.setdefault('cascade_coarse', {})
+        coarse_template = cache.get((plane, level))
+        if coarse_template is None:
+            coarse_template = template_data['planes'][plane]
+            for _ in range(level):
+                coarse_template = cv2.pyrDown(coarse_template)
+            cache[(plane, level)] = coarse_template
+
+        scale = 1 << level
+        rect_x0, rect_y0, rect_x1, rect_y1 = rect
+        coarse_x0 = rect_x0 // scale
+        coarse_y0 = rect_y0 // scale
+        coarse_image = frame.get_plane(plane, level)[coarse_y0:-(-rect_y1 // scale), coarse_x0:-(-rect_x1 // scale)]
+        if coarse_image.shape[0] < coarse_template.shape[0] or coarse_image.shape[1] < coarse_template.shape[1]:
+            return True, None
+
+        result = cv2.matchTemplate(coarse_image, coarse_template, method)
+        if method == cv2.TM_SQDIFF_NORMED:
+            result = 1.0 - result
+        template_height, template_width = template_data['size']
+        xs, ys, _ = extract_peaks(result, max(0.0, threshold - self.coarse_margin),
+                                  max(1, (template_width // 3) >> level), self.coarse_max_candidates + 1)
+        if len(xs) == 0:
+            return False, None
+        if len(xs) > self.coarse_max_candidates:
+            # 候选太多：区域限制意义不大且可能漏掉被截断的候选
+            return True, None
+
+        pad = scale + self.coarse_padding
+        regions = []
+        for x, y in zip(xs, ys):
+            full_x = (int(x) + coarse_x0) * scale
+            full_y = (int(y) + coarse_y0) * scale
+            regions.append((max(rect_x0, full_x - pad), max(rect_y0, full_y - pad),
+                            min(rect_x1, full_x + pad + template_width), min(rect_y1, full_y + pad + template_height)))
+        return True, regions
+
+    def run(self, frame, template_data, plane, rect, method, threshold, use_coarse=True):
+        """依次执行各级测试（各级之间检查帧是否已取消，取消时抛出 MatchCancelled）
+
+        Returns:
+            tuple: (是否通过, 候选区域列表或None)
+        """
+        frame.check_cancelled()
+        self._count(frame, 'checked')
+
+        self._count(frame, 'histogram_checked')
+        if not self.check_histogram(frame, template_data, plane, rect):
+            self._count(frame, 'histogram_rejected')
+            return False, None
+
+        regions = None
+        if use_coarse and template_data['mask'] is None:
+            frame.check_cancelled()
+            self._count(frame, 'coarse_checked')
+            passed, regions = self.check_coarse(frame, template_data, plane, rect, method, threshold)
+            if not passed:
+                self._count(frame, 'coarse_rejected')
+                return False, None
+
+        self._count(frame, 'passed')
+        return True, regions
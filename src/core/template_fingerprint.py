@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+from .match_cache import compute_frame_hash
+
+
+# 差异哈希（dHash）的边长：缩放到 (DHASH_SIZE + 1) x DHASH_SIZE 后比较相邻像素，共 DHASH_SIZE² 位
+DHASH_SIZE = 8
+
+
+def compute_exact_fingerprint(image):
+    """精确指纹 - 像素内容与尺寸完全相同的模板指纹相同"""
+    return compute_frame_hash(image, sample_step=1)
+
+
+def compute_dhash(image):
+    """差异哈希 - 对轻微缩放、平移和压缩噪声不敏感的感知指纹，返回 DHASH_SIZE 字节的位数组"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(image, (DHASH_SIZE + 1, DHASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.ravel())
+
+
+def find_near_duplicates(entries, max_distance, max_size_diff=2, chunk_rows=256):
+    """查找近似重复的模板对
+
+    Args:
+        entries: [(template_id, dhash, (height, width)), ...]
+        max_distance: dHash 汉明距离不超过该值视为近似重复
+        max_size_diff: 模板宽高相差不超过该值（像素）才比较
+        chunk_rows: 每次计算的行数（控制内存占用）
+    Returns:
+        list: [(template_id_a, template_id_b, distance), ...]，按距离升序
+    """
+    if len(entries) < 2:
+        return []
+
+    # 每个 dHash 正好8字节，按 uint64 比较
+    hashes = np.stack([dhash for _, dhash, _ in entries]).view(np.uint64).ravel()
+    sizes = np.array([size for _, _, size in entries], dtype=np.int32)
+    count = len(entries)
+
+    # 按行分块计算汉明距离（只比较 j > i），内存占用为 块大小 × 模板数，不构建完整的 n×n 位矩阵
+    pairs = []
+    for start in range(0, count - 1, chunk_rows):
+        stop = min(count - 1, start + chunk_rows)
+        rows = np.arange(start, stop)
+        xor = hashes[start:stop, np.newaxis] ^ hashes[np.newaxis, :]
+        distances = _popcount64(xor)
+        candidates = distances <= max_distance
+        for axis in range(2):
+            candidates &= np.abs(sizes[start:stop, axis, np.newaxis] - sizes[np.newaxis, :, axis]) <= max_size_diff
+        candidates &= np.arange(count)[np.newaxis, :] > rows[:, np.newaxis]
+        for i, j in zip(*np.nonzero(candidates)):
+            pairs.append((entries[start + i][0], entries[j][0], int(distances[i, j])))
+
+    pairs.sort(key=lambda pair: pair[2])
+    return pairs
+
+
+# 每个字节的置位数（numpy 没有 bitwise_count 时使用）
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _popcount64(values):
+    """uint64 数组逐元素的置位数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
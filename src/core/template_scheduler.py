@@ -0,0 +1,196 @@
+import concurrent.futures
+import threading
+import time
+from collections import deque
+
+
+class TemplateScheduler:
+    """模板匹配调度器 - 共享任务队列，工作线程空闲时主动领取下一个模板，直到本帧全部完成
+
+    队列按优先级排序（数字越小越先匹配），同一优先级内按历史耗时从高到低排列，
+    耗时长的模板先开始，避免最后只剩一个大模板拖住整帧。
+    可抢占的模板（由调用方给出，如可以立即点击的高优先级模板）命中后，优先级更低（数字更大）且尚未开始的模板不再匹配，
+    正在匹配的通过帧上下文的取消令牌中止。
+    """
+
+    def __init__(self, cost_smoothing=0.3):
+        self.cost_smoothing = cost_smoothing  # 耗时估计的指数平滑系数
+        self.costs = {}  # template_id -> 平滑后的匹配耗时（秒）
+
+        self._lock = threading.Lock()
+        self.stats = {'frames': 0, 'matched': 0, 'skipped': 0, 'cancelled': 0, 'timeouts': 0}
+
+    def estimate_cost(self, template_id):
+        """模板的匹配耗时估计；没有记录时使用已知模板的平均值"""
+        cost = self.costs.get(template_id)
+        if cost is not None:
+            return cost
+        if not self.costs:
+            return 0.0
+        return sum(self.costs.values()) / len(self.costs)
+
+    def record_cost(self, template_id, seconds):
+        with self._lock:
+            previous = self.costs.get(template_id)
+            if previous is None:
+                self.costs[template_id] = seconds
+            else:
+                self.costs[template_id] = previous + self.cost_smoothing * (seconds - previous)
+
+    def forget(self, template_id=None):
+        """清除耗时记录（None 表示全部）"""
+        with self._lock:
+            if template_id is None:
+                self.costs.clear()
+            else:
+                self.costs.pop(template_id, None)
+
+    def order_templates(self, template_ids, priorities):
+        """队列顺序：优先级升序，同优先级按耗时估计降序（相同时保持原顺序）"""
+        return sorted(template_ids, key=lambda tid: (priorities[tid], -self.estimate_cost(tid)))
+
+    def run(self, executor, workers, template_ids, priorities, match_func, should_stop=None, timeout=None, frame=None,
+            preempt_ids=None):
+        """匹配一帧中的所有模板
+
+        Args:
+            executor: 执行领取循环的线程池
+            workers: 同时领取任务的工作线程数
+            template_ids: 本帧需要匹配的模板
+            priorities: {template_id: 优先级}
+            match_func: match_func(template_id) -> 结果字典或None
+            should_stop: 返回 True 时停止领取新任务（如暂停匹配、进入回合）
+            timeout: 整帧超时（秒），超时后返回已完成的结果
+            frame: 帧上下文；命中、停止或超时时通过它取消正在进行的匹配
+            preempt_ids: 命中后停止更低优先级模板的模板集合，None 表示任何命中都停止
+        Returns:
+            dict: {template_id: 结果}（只包含已完成的模板）
+        """
+        queue = deque(self.order_templates(template_ids, priorities))
+        results = {}
+        state = {'stop_priority': float('inf'), 'cancelled': False, 'skipped': 0}
+        running = {}  # 正在匹配的模板 -> 优先级
+        lock = threading.Lock()
+
+        def cancel_frame(reason):
+            state['cancelled'] = True
+            if frame is not None:
+                frame.cancel(reason)
+
+        def pull_loop():
+            while True:
+                with lock:
+                    if state['cancelled'] or not queue:
+                        return
+                    template_id = queue.popleft()
+                    if priorities[template_id] > state['stop_priority']:
+                        # 队列按优先级排序，剩余模板的优先级都更低
+                        state['skipped'] += len(queue) + 1
+                        queue.clear()
+                        return
+                    running[template_id] = priorities[template_id]
+                if should_stop is not None and should_stop():
+                    with lock:
+                        running.pop(template_id, None)
+                        state['skipped'] += 1
+                        cancel_frame('stopped')
+                    return
+
+                start = time.perf_counter()
+                try:
+                    result = match_func(template_id)
+                except Exception as e:
+                    print(f"模板 {template_id} 匹配任务异常: {e}")
+                    result = None
+                elapsed = time.perf_counter() - start
+
+                with lock:
+                    running.pop(template_id, None)
+                    if result is None:
+                        # 被取消（或匹配失败），不计入结果和耗时估计
+                        continue
+                    results[template_id] = result
+                self.record_cost(template_id, elapsed)
+
+                with lock:
+                    # 只有可抢占模板的命中才影响其他模板（命中但无法点击时不中止任何匹配）
+                    if result.get('found', False) and (preempt_ids is None or template_id in preempt_ids):
+                        priority = priorities[template_id]
+                        state['stop_priority'] = min(state['stop_priority'], priority)
+                        # 中止正在匹配的更低优先级模板
+                        lower = [tid for tid, p in running.items() if p > priority]
+                        if lower and frame is not None:
+                            frame.cancel_templates(lower)
+
+        futures = [executor.submit(pull_loop) for _ in range(max(1, min(workers, len(queue))))]
+        _, pending = concurrent.futures.wait(futures, timeout=timeout)
+
+        with lock:
+            if pending:
+                # 超时：取消正在执行的模板，不再领取新任务，已完成的结果照常返回
+                cancel_frame('timeout')
+            finished = dict(results)
+            skipped = state['skipped'] + len(queue)
+
+        cancelled = frame.get_stats().get('cancelled_templates', 0) if frame is not None else 0
+        if frame is not None and skipped:
+            frame.add_stat('skipped_templates', skipped)
+
+        with self._lock:
+            self.stats['frames'] += 1
+            self.stats['matched'] += len(finished)
+            self.stats['skipped'] += skipped
+            self.stats['cancelled'] += cancelled
+            if pending:
+                self.stats['timeouts'] += 1
+        return finished
+
+    def run_batches(self, submit_batch, workers, template_ids, priorities, timeout=None, frame=None):
+        """按批次匹配一帧中的所有模板（多进程后端：每个进程每帧只领取一个任务）
+
+        队列顺序与 run 相同，按优先级交错分成 workers 批，每批都从高优先级开始，
+        批内按顺序匹配；可抢占模板的命中如何停止其他模板由 submit_batch 负责。
+
+        Args:
+            submit_batch: submit_batch(模板ID列表) -> Future，结果为 {template_id: 结果}
+            workers: 批次数
+            timeout: 整帧超时（秒），超时后返回已完成批次的结果
+            frame: 帧上下文；超时时通过它取消尚未开始的批次
+        Returns:
+            dict: {template_id: 结果}（只包含已完成的模板）
+        """
+        ordered = self.order_templates(template_ids, priorities)
+        count = max(1, min(workers, len(ordered)))
+        batches = [ordered[index::count] for index in range(count)]
+        futures = [submit_batch(batch) for batch in batches if batch]
+        done, pending = concurrent.futures.wait(futures, timeout=timeout)
+        if pending and frame is not None:
+            frame.cancel('timeout')
+
+        results = {}
+        for future in done:
+            try:
+                results.update(future.result())
+            except Exception as e:
+                print(f"模板批次匹配任务异常: {e}")
+
+        cancelled = frame.get_stats().get('cancelled_templates', 0) if frame is not None else 0
+        # 批次命中后停止的和未完成批次中的模板都计为跳过
+        skipped = max(0, len(ordered) - len(results) - cancelled)
+        if frame is not None and skipped:
+            frame.add_stat('skipped_templates', skipped)
+
+        with self._lock:
+            self.stats['frames'] += 1
+            self.stats['matched'] += len(results)
+            self.stats['skipped'] += skipped
+            self.stats['cancelled'] += cancelled
+            if pending:
+                self.stats['timeouts'] += 1
+        return results
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['tracked_templates'] = len(self.costs)
+        return stats
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class TemplateStore:
+    """编译后的模板存储 - 解码后的图像及派生数据（灰度、金字塔、统计量）保存到可内存映射的文件
+
+    data.bin    所有数组的原始字节，按64字节对齐追加写入，加载时整体内存映射（不复制）
+    index.jsonl 每行一条记录，键为文件路径；同一路径的后写记录覆盖先写记录
+
+    记录按 (路径, 修改时间, 文件大小) 快速校验；修改时间或大小变化时再比较文件内容哈希，
+    内容未变（如仅被touch或复制到其他路径）时直接复用已编译的数组。
+    """
+
+    FORMAT_VERSION = 1
+    ALIGNMENT = 64
+
+    def __init__(self, directory, max_waste_ratio=0.5, read_only=False):
+        self.directory = directory
+        self.max_waste_ratio = max_waste_ratio  # 失效数据占比超过该值时打开存储时压缩
+        self.read_only = read_only  # 只读：不写入、不压缩（供多个进程同时映射同一存储）
+
+        self.data_path = os.path.join(directory, 'data.bin')
+        self.index_path = os.path.join(directory, 'index.jsonl')
+
+        self._lock = threading.Lock()
+        self._entries = {}  # 规范化路径 -> 记录
+        self._by_hash = {}  # 内容哈希 -> 记录
+        self._data = None  # data.bin 的只读内存映射
+        self._data_size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.rehashed = 0  # 修改时间/大小变化但内容未变的次数
+
+        self.open()
+
+    @staticmethod
+    def normalize_path(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    @staticmethod
+    def hash_file(path):
+        """文件内容哈希"""
+        hasher = hashlib.sha1(usedforsecurity=False)
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def open(self):
+        """读取索引；版本不符时重建，失效数据过多时压缩，然后映射数据文件"""
+        if not self.read_only:
+            os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._entries = {}
+            self._by_hash = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as file:
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # 上次写入中断留下的不完整行
+                            continue
+                        if entry.get('version') != self.FORMAT_VERSION:
+                            continue
+                        self._entries[entry['path']] = entry
+                        self._by_hash[entry['content_hash']] = entry
+
+            data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+            # 只保留数据完整的记录
+            self._entries = {path: entry for path, entry in self._entries.items()
+                             if self._entry_end(entry) <= data_size}
+            self._by_hash = {entry['content_hash']: entry for entry in self._entries.values()}
+
+            if not self.read_only:
+                live_size = self._live_size()
+                if data_size and (not self._entries or (data_size - live_size) / data_size > self.max_waste_ratio):
+                    self._compact()
+                elif not os.path.exists(self.index_path):
+                    open(self.data_path, 'wb').close()
+                    open(self.index_path, 'w').close()
+            self._map()
+
+    def _entry_end(self, entry):
+        return max((offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+                    for offset, dtype, shape in entry['arrays'].values()), default=0)
+
+    def _live_size(self):
+        """仍被引用的数据字节数（多个路径可能共享同一份数据）"""
+        spans = set()
+        for entry in self._entries.values():
+            for offset, dtype, shape in entry['arrays'].values():
+                spans.add((offset, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+        return sum(size for _, size in spans)
+
+    def _map(self):
+        self._data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        self._data = np.memmap(self.data_path, dtype=np.uint8, mode='r') if self._data_size else None
+
+    def _compact(self):
+        """重写数据文件，只保留仍被引用的数组（在映射之前调用）"""
+        old_data = np.memmap(self.data_path, dtype=np.uint8, mode='r') if os.path.exists(self.data_path) else None
+        temp_data = self.data_path + '.tmp'
+        temp_index = self.index_path + '.tmp'
+        moved = {}  # 旧偏移 -> 新偏移
+
+        with open(temp_data, 'wb') as data_file, open(temp_index, 'w', encoding='utf-8') as index_file:
+            for entry in self._entries.values():
+                arrays = {}
+                for name, (offset, dtype, shape) in entry['arrays'].items():
+                    if offset not in moved:
+                        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                        moved[offset] = self._write_bytes(data_file, old_data[offset:offset + size])
+                    arrays[name] = [moved[offset], dtype, shape]
+                entry['arrays'] = arrays
+                index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        del old_data
+        os.replace(temp_data, self.data_path)
+        os.replace(temp_index, self.index_path)
+        self._by_hash = {entry['content_hash']: entry for entry in self._entries.values()}
+        print(f"[模板存储] 压缩完成: {len(self._entries)} 条记录")
+
+    def _write_bytes(self, data_file, buffer):
+        """按对齐要求追加写入，返回写入偏移"""
+        position = data_file.tell()
+        padding = -position % self.ALIGNMENT
+        if padding:
+            data_file.write(b'\0' * padding)
+            position += padding
+        data_file.write(memoryview(np.ascontiguousarray(buffer)).cast('B'))
+        return position
+
+    def _view(self, offset, dtype, shape):
+        """内存映射中的只读数组视图（不复制）"""
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self._data is None or offset + size > self._data_size:
+            # 本次运行中追加的数据超出当前映射范围，重新映射
+            self._map()
+        return np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self._data, offset=offset)
+
+    def _materialize(self, entry):
+        compiled = dict(entry['values'])
+        for name, (offset, dtype, shape) in entry['arrays'].items():
+            compiled[name] = self._view(offset, dtype, shape)
+        return compiled
+
+    def is_current(self, path):
+        """已编译记录是否与文件一致（只比较修改时间和大小）"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        entry = self._entries.get(self.normalize_path(path))
+        return entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+    def load(self, path):
+        """加载已编译的模板，文件变化或没有记录时返回 None
+
+        Returns:
+            dict: 数组（内存映射的只读视图）和统计量
+        """
+        key = self.normalize_path(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                self.hits += 1
+                return self._materialize(entry)
+
+            # 修改时间或大小变化（或新路径）：内容相同时复用
+            if entry is None and not self._by_hash:
+                self.misses += 1
+                return None
+            content_hash = self.hash_file(path)
+            source = self._by_hash.get(content_hash)
+            if source is None:
+                self.misses += 1
+                return None
+
+            updated = dict(source, path=key, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            self._append_entry(updated)
+            self.rehashed += 1
+            return self._materialize(updated)
+
+    def save(self, path, compiled):
+        """保存编译结果：ndarray 写入数据文件，其余值（可JSON序列化）写入索引"""
+        if self.read_only:
+            return
+        key = self.normalize_path(path)
+        stat = os.stat(path)
+        content_hash = self.hash_file(path)
+
+        with self._lock:
+            arrays = {}
+            values = {}
+            with open(self.data_path, 'ab') as data_file:
+                for name, value in compiled.items():
+                    if isinstance(value, np.ndarray):
+                        offset = self._write_bytes(data_file, value)
+                        arrays[name] = [offset, value.dtype.str, list(value.shape)]
+                    else:
+                        values[name] = value
+
+            self._append_entry({
+                'version': self.FORMAT_VERSION,
+                'path': key,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'content_hash': content_hash,
+                'values': values,
+                'arrays': arrays
+            })
+
+    def _append_entry(self, entry):
+        if not self.read_only:
+            with open(self.index_path, 'a', encoding='utf-8') as index_file:
+                index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._entries[entry['path']] = entry
+        self._by_hash[entry['content_hash']] = entry
+
+    def get_stats(self):
+        """存储统计信息"""
+        return {
+            'entries': len(self._entries),
+            'data_size': os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rehashed': self.rehashed
+        }
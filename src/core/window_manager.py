@@ -1,31 +1,250 @@
 import subprocess
 from PIL import Image, ImageGrab
 import numpy as np
-import pyautogui
 import os
 import platform
-import win32gui
-import win32ui
-import win32con
-import win32api
-import win32process
 import time
 import ctypes
+import threading
+
+from .frame_sources import FrameSource, merge_capture_rects
+
+# Win32 相关模块只在 Windows 上可用；其他平台使用回放/合成截图源
+try:
+    import win32gui
+    import win32ui
+    import win32con
+    import win32api
+    import win32process
+    HAS_WIN32 = True
+except ImportError:
+    win32gui = win32ui = win32con = win32api = win32process = None
+    HAS_WIN32 = False
+
+try:
+    import pyautogui
+except Exception:
+    # 没有图形环境时 pyautogui 导入会失败
+    pyautogui = None
+
+
+class WindowGeometry:
+    """目标窗口几何信息快照：窗口矩形、客户区尺寸、边框偏移和客户区中心
+
+    version 在窗口句柄、客户区尺寸或边框偏移变化时递增（窗口只移动位置时不变），
+    下游缓存（缩放比例、跟踪位置、学习到的搜索区域等）据此判断是否失效。
+    """
+
+    __slots__ = ('handle', 'window_rect', 'client_width', 'client_height', 'border_width', 'title_height',
+                 'version', 'update_time')
+
+    def __init__(self, handle, window_rect, client_width, client_height, version=0):
+        self.handle = handle
+        self.window_rect = tuple(window_rect)  # 屏幕坐标 (左, 上, 右, 下)
+        self.client_width = client_width
+        self.client_height = client_height
+        # 边框和标题栏的偏移
+        self.border_width = ((window_rect[2] - window_rect[0]) - client_width) // 2
+        self.title_height = (window_rect[3] - window_rect[1]) - client_height - self.border_width
+        self.version = version
+        self.update_time = time.perf_counter()
+
+    @property
+    def client_size(self):
+        return self.client_width, self.client_height
+
+    @property
+    def center(self):
+        """客户区中心（客户区坐标）"""
+        return self.client_width // 2, self.client_height // 2
+
+    @property
+    def client_origin(self):
+        """客户区左上角的屏幕坐标"""
+        return self.window_rect[0] + self.border_width, self.window_rect[1] + self.title_height
+
+    def get_layout(self):
+        """影响截图和点击坐标换算的部分（不含窗口位置）"""
+        return self.handle, self.client_width, self.client_height, self.border_width, self.title_height
+
+    def get_age(self):
+        return time.perf_counter() - self.update_time
+
+
+class Win32WindowSource(FrameSource):
+    """Win32 窗口截图源 - 用 BitBlt 截取目标窗口客户区，支持最小化和被遮挡的窗口"""
+
+    name = 'win32'
+    is_window = True
+    layout = 'BGRA'
+
+    def __init__(self, window_manager):
+        super().__init__()
+        self.window_manager = window_manager
+
+    @property
+    def handle(self):
+        return self.window_manager.target_window_handle
+
+    def get_client_size(self):
+        geometry = self.window_manager.get_geometry()
+        return geometry.client_size if geometry is not None else None
+
+    def _blit(self, mfc_dc, save_dc, rect, border_width, title_height):
+        """用 BitBlt 截取客户区中的一个矩形，返回BGRA视图"""
+        x0, y0, x1, y1 = rect
+        width, height = x1 - x0, y1 - y0
+        save_bitmap = win32ui.CreateBitmap()
+        save_bitmap.CreateCompatibleBitmap(mfc_dc, width, height)
+        save_dc.SelectObject(save_bitmap)
+        try:
+            # 使用BitBlt替代PrintWindow，确保能捕获最小化窗口
+            save_dc.BitBlt((0, 0), (width, height), mfc_dc, (border_width + x0, title_height + y0), win32con.SRCCOPY)
+            # 获取位图数据
+            bmp_str = save_bitmap.GetBitmapBits(True)
+        finally:
+            win32gui.DeleteObject(save_bitmap.GetHandle())
+        return np.frombuffer(bmp_str, dtype=np.uint8).reshape(height, width, 4)
+
+    def grab(self, rects=None):
+        hwnd = self.handle
+        if not hwnd:
+            print("[窗口管理器] 未设置目标窗口句柄")
+            return None
+
+        try:
+            # 检查窗口是否存在和有效
+            if not win32gui.IsWindow(hwnd):
+                print(f"[窗口管理器] 目标窗口句柄无效: {hwnd}")
+                return None
+
+            # 每帧截图时刷新一次窗口几何信息（点击、窗口中心等使用缓存）
+            geometry = self.window_manager.refresh_geometry()
+            left, top, right, bottom = geometry.window_rect
+            width = right - left
+            height = bottom - top
+
+            if width <= 0 or height <= 0:
+                print(f"[窗口管理器] 窗口尺寸无效: {width}x{height}")
+                return None
+
+            client_width, client_height = geometry.client_size
+            border_width = geometry.border_width
+            title_height = geometry.title_height
+
+            # 局部截图：只截取合并后的矩形，写入客户区大小的画布（坐标保持为客户区坐标）
+            rects = merge_capture_rects(rects, client_width, client_height) if rects else None
+
+            try:
+                # 获取窗口DC
+                hwnd_dc = win32gui.GetWindowDC(hwnd)
+                try:
+                    mfc_dc = win32ui.CreateDCFromHandle(hwnd_dc)
+                    save_dc = mfc_dc.CreateCompatibleDC()
+                    try:
+                        if rects is None:
+                            # 直接以原始BGRA布局返回位图数据的视图（不复制）；
+                            # 彩色/灰度平面由帧上下文在首次使用时转换（每帧一次，缓冲区复用）
+                            image = self._blit(mfc_dc, save_dc, (0, 0, client_width, client_height), border_width, title_height)
+                        else:
+                            image = self._get_canvas((client_height, client_width, 4))
+                            for x0, y0, x1, y1 in rects:
+                                image[y0:y1, x0:x1] = self._blit(mfc_dc, save_dc, (x0, y0, x1, y1), border_width, title_height)
+                    finally:
+                        # 清理资源
+                        save_dc.DeleteDC()
+                        mfc_dc.DeleteDC()
+                    
+                    self.last_geometry = (hwnd, client_width, client_height)
+                    self.last_rects = rects
+                    
+                    if rects is None:
+                        print(f"[窗口管理器] 截图成功: {client_width}x{client_height}")
+                    return image
+                finally:
+                    win32gui.ReleaseDC(hwnd, hwnd_dc)
+            except Exception as e:
+                print(f"[窗口管理器] BitBlt方法失败: {e}")
+
+            print("[窗口管理器] 所有截图方法都失败")
+            return None
+            
+        except Exception as e:
+            print(f"[窗口管理器] 截图异常: {e}")
+            import traceback
+            print(f"[窗口管理器] 详细错误: {traceback.format_exc()}")
+            return None
+
 
 class WindowManager:
-    """窗口管理器 - 处理窗口操作和后台点击"""
+    """窗口管理器 - 处理窗口操作和后台点击
+
+    截图通过截图源获取：默认是 Win32 窗口截图，也可以设置为回放或合成截图源（没有真实窗口时只记录点击）。
+    """
     
     def __init__(self):
         self.target_window_handle = None
         self.target_window_id = None
+        self.last_capture_geometry = None  # 最近一次截图的 (窗口句柄, 客户区宽, 客户区高)
+        self.window_source = Win32WindowSource(self)
+        self.frame_source = self.window_source  # 当前截图源
+        self.capture_rects = None  # 局部截图矩形 [(x0, y0, x1, y1), ...]（客户区坐标），None 表示整帧
+        self.last_capture_rects = None  # 最近一次截图实际截取的矩形
+        
+        # 窗口几何缓存：截图时每帧刷新一次，点击和计算窗口中心时直接使用
+        self.geometry = None  # WindowGeometry
+        self.geometry_version = 0  # 窗口句柄、客户区尺寸或边框偏移变化时递增
+        self.geometry_max_age = 0.5  # 超过该时间没有刷新（没有在截图）时重新读取（秒）
+        self._geometry_lock = threading.Lock()
+        self.geometry_stats = {'refreshes': 0, 'hits': 0, 'changes': 0}
         
         # 禁用pyautogui的安全模式
-        pyautogui.FAILSAFE = False
+        if pyautogui is not None:
+            pyautogui.FAILSAFE = False
         
+        if not HAS_WIN32:
+            print("[窗口管理器] 未安装 pywin32，只能使用回放/合成截图源")
         print("[窗口管理器] 初始化完成")
 
+    def set_frame_source(self, source):
+        """设置截图源（None 表示恢复为目标窗口截图）
+
+        非窗口截图源以其标识代替窗口句柄，匹配流程无需修改。
+        """
+        if self.frame_source is not self.window_source:
+            self.frame_source.close()
+        self.geometry = None
+        if source is None or source is self.window_source:
+            self.frame_source = self.window_source
+            self.target_window_id = None
+            self.target_window_handle = None
+            print("[窗口管理器] 截图源: 目标窗口")
+            return True
+        if not source.open():
+            self.frame_source = self.window_source
+            return False
+        self.frame_source = source
+        self.target_window_id = source.handle
+        self.target_window_handle = source.handle
+        self.last_capture_geometry = None
+        print(f"[窗口管理器] 截图源: {source.name} ({source.handle})")
+        return True
+
+    def set_capture_rects(self, rects):
+        """设置之后截图只截取的矩形（客户区坐标），None 表示整帧
+
+        截图仍为客户区大小，矩形以外的像素保留之前截图的内容，匹配坐标和点击坐标不需要换算。
+        """
+        self.capture_rects = list(rects) if rects else None
+        
+    def uses_window_source(self):
+        """当前是否从真实窗口截图（点击、窗口状态等需要窗口句柄的操作才可用）"""
+        return self.frame_source.is_window
+
     def get_window_list(self):
         """获取所有可见窗口的列表"""
+        if not HAS_WIN32:
+            return []
         windows = []
         def enum_windows_callback(hwnd, windows):
             if win32gui.IsWindowVisible(hwnd):
@@ -46,14 +265,21 @@ class WindowManager:
         """设置目标窗口"""
         try:
             print(f"[窗口管理器] 设置目标窗口: {window_id}")
+            if not HAS_WIN32:
+                print("[窗口管理器] 未安装 pywin32，无法设置目标窗口")
+                return False
             
             # 验证窗口ID
             if not win32gui.IsWindow(window_id):
                 print(f"[窗口管理器] 无效的窗口ID: {window_id}")
                 return False
             
+            if self.frame_source is not self.window_source:
+                self.frame_source.close()
+                self.frame_source = self.window_source
             self.target_window_id = window_id
             self.target_window_handle = window_id
+            self.geometry = None
             
             # 获取窗口信息进行验证
             try:
@@ -79,84 +305,95 @@ class WindowManager:
             return False
 
     def get_window_screenshot(self):
-        """获取窗口截图 - 支持最小化和被遮挡的窗口"""
+        """获取截图 - 来自当前截图源（默认为目标窗口，支持最小化和被遮挡的窗口）；设置了局部截图矩形时只截取这些矩形"""
         if not self.target_window_handle:
             print("[窗口管理器] 未设置目标窗口句柄")
             return None
-
+        
         try:
-            # 检查窗口是否存在和有效
-            if not win32gui.IsWindow(self.target_window_handle):
-                print(f"[窗口管理器] 目标窗口句柄无效: {self.target_window_handle}")
-                return None
-
-            # 获取窗口矩形
-            window_rect = win32gui.GetWindowRect(self.target_window_handle)
-            left, top, right, bottom = window_rect
-            width = right - left
-            height = bottom - top
-
-            if width <= 0 or height <= 0:
-                print(f"[窗口管理器] 窗口尺寸无效: {width}x{height}")
-                return None
-
-            # 获取客户区矩形
-            client_rect = win32gui.GetClientRect(self.target_window_handle)
-            client_width = client_rect[2]
-            client_height = client_rect[3]
-
-            # 计算边框和标题栏的偏移
-            border_width = ((right - left) - client_width) // 2
-            title_height = (bottom - top) - client_height - border_width
-
-            try:
-                # 获取窗口DC
-                hwnd_dc = win32gui.GetWindowDC(self.target_window_handle)
-                try:
-                    mfc_dc = win32ui.CreateDCFromHandle(hwnd_dc)
-                    save_dc = mfc_dc.CreateCompatibleDC()
-                    save_bitmap = win32ui.CreateBitmap()
-                    save_bitmap.CreateCompatibleBitmap(mfc_dc, client_width, client_height)
-                    save_dc.SelectObject(save_bitmap)
-
-                    # 使用BitBlt替代PrintWindow，确保能捕获最小化窗口
-                    save_dc.BitBlt((0, 0), (client_width, client_height), mfc_dc, (border_width, title_height), win32con.SRCCOPY)
-                    
-                    # 获取位图数据
-                    bmp_str = save_bitmap.GetBitmapBits(True)
-                    
-                    # 清理资源
-                    win32gui.DeleteObject(save_bitmap.GetHandle())
-                    save_dc.DeleteDC()
-                    mfc_dc.DeleteDC()
-                    
-                    # 转换为numpy数组
-                    img_array = np.frombuffer(bmp_str, dtype='uint8')
-                    img_array.shape = (client_height, client_width, 4)
-                    
-                    # 转换为RGB格式
-                    img_rgb = img_array[:, :, [2, 1, 0]]  # BGR -> RGB
-                    
-                    print(f"[窗口管理器] 截图成功: {client_width}x{client_height}")
-                    return img_rgb
-                finally:
-                    win32gui.ReleaseDC(self.target_window_handle, hwnd_dc)
-            except Exception as e:
-                print(f"[窗口管理器] BitBlt方法失败: {e}")
+            image = self.frame_source.grab(self.capture_rects)
+        except Exception as e:
+            print(f"[窗口管理器] 截图异常: {e}")
+            return None
+        if image is not None:
+            self.last_capture_geometry = self.frame_source.get_geometry()
+            self.last_capture_rects = self.frame_source.last_rects
+            if not self.frame_source.is_window:
+                # 回放/合成截图源的画面尺寸随截图更新（窗口截图源在截图时已刷新）
+                self._store_geometry(self.frame_source.handle, (0, 0, image.shape[1], image.shape[0]),
+                                     image.shape[1], image.shape[0])
+        return image
+        
+    def refresh_geometry(self):
+        """重新读取目标窗口的几何信息（窗口截图源每帧截图时调用一次）
 
-            print("[窗口管理器] 所有截图方法都失败")
+        Returns:
+            WindowGeometry: 最新的几何信息；没有目标窗口（或截图源尚未截图）时返回 None
+        """
+        handle = self.target_window_handle
+        if not handle:
             return None
-            
+        if self.frame_source.is_window:
+            window_rect = win32gui.GetWindowRect(handle)
+            client_rect = win32gui.GetClientRect(handle)
+            return self._store_geometry(handle, window_rect, client_rect[2], client_rect[3])
+        size = self.frame_source.get_client_size()
+        if size is None:
+            return None
+        return self._store_geometry(handle, (0, 0, size[0], size[1]), size[0], size[1])
+        
+    def _store_geometry(self, handle, window_rect, client_width, client_height):
+        """更新几何缓存，句柄、客户区尺寸或边框偏移变化时递增版本号"""
+        with self._geometry_lock:
+            previous = self.geometry
+            geometry = WindowGeometry(handle, window_rect, client_width, client_height, self.geometry_version)
+            changed = previous is None or previous.get_layout() != geometry.get_layout()
+            if changed:
+                self.geometry_version += 1
+                geometry.version = self.geometry_version
+                self.geometry_stats['changes'] += 1
+            self.geometry_stats['refreshes'] += 1
+            self.geometry = geometry
+        if changed and previous is not None and previous.handle == handle:
+            print(f"[窗口管理器] 窗口几何变化: 客户区 {previous.client_width}x{previous.client_height} -> "
+                  f"{client_width}x{client_height}, 版本 {geometry.version}")
+        return geometry
+        
+    def get_geometry(self, max_age=None):
+        """缓存的窗口几何信息；缓存属于其他窗口或超过 max_age 秒没有刷新（例如没有在截图）时重新读取
+
+        Returns:
+            WindowGeometry: 几何信息，无法获取时返回 None
+        """
+        geometry = self.geometry
+        max_age = self.geometry_max_age if max_age is None else max_age
+        if geometry is not None and geometry.handle == self.target_window_handle and geometry.get_age() <= max_age:
+            self.geometry_stats['hits'] += 1
+            return geometry
+        try:
+            return self.refresh_geometry()
         except Exception as e:
-            print(f"[窗口管理器] 截图异常: {e}")
-            import traceback
-            print(f"[窗口管理器] 详细错误: {traceback.format_exc()}")
+            print(f"[窗口管理器] 获取窗口几何信息失败: {e}")
+            return geometry if geometry is not None and geometry.handle == self.target_window_handle else None
+        
+    def get_geometry_stats(self):
+        stats = dict(self.geometry_stats)
+        stats['version'] = self.geometry_version
+        return stats
+        
+    def get_client_size(self):
+        """目标窗口（或截图源画面）的客户区尺寸 (宽, 高)"""
+        if not self.target_window_handle:
             return None
+        geometry = self.get_geometry()
+        return geometry.client_size if geometry is not None else None
         
     def get_window_state(self):
         """获取窗口状态"""
         if not self.target_window_handle:
             return "未设置"
+        if not self.frame_source.is_window:
+            return self.frame_source.get_state()
         
         try:
             # 检查窗口是否存在
@@ -202,15 +439,19 @@ class WindowManager:
         if not self.target_window_handle:
             print("[窗口管理器] 未设置目标窗口")
             return False
+        if not self.frame_source.is_window:
+            # 回放/合成截图源没有窗口，只记录点击
+            print(f"[窗口管理器] 记录点击({self.frame_source.name}): ({int(x)}, {int(y)}), 按键={button}")
+            return self.frame_source.click(x, y, button)
         
         try:
             if window_relative:
                 # 添加实际点击坐标的输出
                 print(f"[窗口管理器] 收到点击请求: 原始坐标=({x}, {y}), 按键={button}")
                 
-                # 获取客户区信息用于调试
-                client_rect = win32gui.GetClientRect(self.target_window_handle)
-                print(f"[窗口管理器] 客户区大小: {client_rect}")
+                # 客户区信息用于调试（使用几何缓存，不重新查询窗口）
+                geometry = self.get_geometry()
+                print(f"[窗口管理器] 客户区大小: {geometry.client_size if geometry is not None else '未知'}")
                 
                 # 将浮点数坐标转换为整数 - 使用int而非round，避免四舍五入导致的偏移
                 x = int(x)
@@ -283,17 +524,16 @@ class WindowManager:
             else:
                 # 绝对坐标模式 - 转换为窗口相对坐标
                 try:
-                    # 获取窗口客户区位置
-                    client_rect = win32gui.GetClientRect(self.target_window_handle)
-                    window_rect = win32gui.GetWindowRect(self.target_window_handle)
-                    
-                    # 计算边框和标题栏的偏移
-                    border_width = ((window_rect[2] - window_rect[0]) - client_rect[2]) // 2
-                    title_height = (window_rect[3] - window_rect[1]) - client_rect[3] - border_width
+                    # 客户区左上角的屏幕坐标（几何缓存）
+                    geometry = self.get_geometry()
+                    if geometry is None:
+                        print("[窗口管理器] 无法获取窗口几何信息")
+                        return False
+                    origin_x, origin_y = geometry.client_origin
                     
                     # 将屏幕坐标转换为窗口客户区坐标
-                    relative_x = x - (window_rect[0] + border_width)
-                    relative_y = y - (window_rect[1] + title_height)
+                    relative_x = x - origin_x
+                    relative_y = y - origin_y
                     
                     print(f"[窗口管理器] 坐标转换: 屏幕({x}, {y}) -> 窗口内({relative_x}, {relative_y})")
                     
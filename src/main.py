@@ -13,6 +13,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from core.window_manager import WindowManager
 from core.image_matcher import ImageMatcher
 from core.controller import Controller
+from core.frame_recorder import RecordingFrameSource, is_recording_file
+from core.frame_sources import ReplayFrameSource
 
 class MainWindow:
     """主窗口类 - 支持多图片独立鼠标按键设置和后台操作"""
@@ -54,6 +56,7 @@ class MainWindow:
         # 连接控制器回调
         self.controller.set_log_callback(self.log_message)
         self.controller.set_match_callback(self.on_match_found)
+        self.controller.set_folder_change_callback(self.on_folder_templates_changed)
         
         # 开始窗口状态监控
         self.start_window_state_monitoring()
@@ -1059,9 +1062,13 @@ class MainWindow:
                 if priority is None:  # 用户取消
                     return
                     
-                # 加载文件夹中的模板
-                success_count, failed_count, folder_info = self.controller.load_templates_from_directory(
-                    directory_path, priority, folder_name)
+                # 加载文件夹中的模板（后台线程解码，加载期间刷新界面以显示进度）
+                previous_status = self.status_info.cget('text')
+                try:
+                    success_count, failed_count, folder_info = self.controller.load_templates_from_directory(
+                        directory_path, priority, folder_name, progress_callback=self.show_load_progress)
+                finally:
+                    self.status_info.config(text=previous_status)
                 
                 if success_count > 0 and folder_info:
                     self.log_message(f"从文件夹成功加载 {success_count} 个模板图像，优先级: {priority}")
@@ -1069,6 +1076,9 @@ class MainWindow:
                     # 添加到文件夹列表
                     self.add_folder_to_ui(folder_info)
                     
+                    # 监视文件夹变化，新增/修改/删除的图片自动生效
+                    self.controller.watch_template_folder(folder_info)
+                    
                     messagebox.showinfo("加载成功", f"成功加载 {success_count} 个模板图像\n失败 {failed_count} 个")
                 else:
                     self.log_message(f"从文件夹加载模板失败")
@@ -1080,6 +1090,11 @@ class MainWindow:
         except Exception as e:
             self.log_message(f"选择模板文件夹失败: {e}")
 
+    def show_load_progress(self, done, total, filename):
+        """在状态栏显示文件夹加载进度"""
+        self.status_info.config(text=f"状态: 加载模板 {done}/{total} {filename}")
+        self.root.update_idletasks()
+
     def add_folder_to_ui(self, folder_info):
         """将文件夹添加到UI界面"""
         try:
@@ -1105,8 +1120,9 @@ class MainWindow:
             self.folder_templates[folder_id]['priority_var'] = priority_var
             
             # 图片数量
-            ttk.Label(self.folder_list_frame, text=str(folder_info['count']), width=8).grid(
-                row=row, column=2, padx=5, pady=2)
+            count_label = ttk.Label(self.folder_list_frame, text=str(folder_info['count']), width=8)
+            count_label.grid(row=row, column=2, padx=5, pady=2)
+            self.folder_templates[folder_id]['count_label'] = count_label
             
             # 启用复选框
             enabled_check = ttk.Checkbutton(
@@ -1130,6 +1146,18 @@ class MainWindow:
         except Exception as e:
             self.log_message(f"添加文件夹到界面失败: {e}")
 
+    def on_folder_templates_changed(self, folder_info, changes):
+        """模板文件夹热重载后更新界面中的图片数量（在监视线程中调用）"""
+        def update():
+            folder_data = self.folder_templates.get(folder_info['name'])
+            if folder_data and 'count_label' in folder_data:
+                folder_data['count_label'].config(text=str(folder_info['count']))
+                
+        try:
+            self.root.after(0, update)
+        except Exception:
+            pass
+            
     def on_folder_priority_changed(self, event, folder_id):
         """文件夹优先级变更事件"""
         try:
@@ -1166,6 +1194,7 @@ class MainWindow:
         try:
             enabled = self.folder_templates[folder_id]['enabled_var'].get()
             folder_info = self.folder_templates[folder_id]['info']
+            folder_info['enabled'] = enabled  # 热重载新增的模板沿用文件夹的启用状态
             
             # 更新所有属于该文件夹的模板启用状态
             success_count = 0
@@ -1246,6 +1275,7 @@ class MainWindow:
         try:
             if messagebox.askyesno("确认删除", f"确定要删除文件夹 {folder_id} 中的所有模板吗？"):
                 folder_info = self.folder_templates[folder_id]['info']
+                self.controller.unwatch_template_folder(folder_id)
                 template_ids = folder_info['template_ids'].copy()  # 复制一份，避免在迭代过程中修改
                 
                 # 移除所有模板
@@ -1278,11 +1308,42 @@ def main():
         # 初始化图像匹配器
         image_matcher = ImageMatcher(window_manager)
         
+        # 编译后的模板存储：解码结果落盘，再次启动时直接内存映射
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        image_matcher.set_template_store(os.path.join(project_root, 'cache', 'templates'))
+        
         # 初始化游戏控制器
         controller = Controller(window_manager, image_matcher)
         
         # 初始化并显示主窗口
         main_window = MainWindow(window_manager, controller)
+        
+        # 可选的截图优化（默认关闭）: --capture-thread 独立截图线程, --partial-capture 只截取搜索区域
+        if '--capture-thread' in sys.argv[1:]:
+            controller.set_capture_thread(True)
+        if '--partial-capture' in sys.argv[1:]:
+            controller.set_partial_capture(True)
+        
+        # 回放模式: python main.py --replay <视频文件、截图文件夹或帧录制文件(.frec)> [--max-speed]
+        if '--replay' in sys.argv[1:-1]:
+            replay_path = sys.argv[sys.argv.index('--replay') + 1]
+            realtime = '--max-speed' not in sys.argv
+            if is_recording_file(replay_path):
+                source = RecordingFrameSource(replay_path, realtime=realtime)
+                if not realtime:
+                    # 最快速度回放录制时逐帧匹配（不跳帧）、按录制的帧时间判断点击间隔、每帧匹配所有模板，结果可重复
+                    controller.set_capture_thread(False)
+                    controller.set_deterministic_scheduling(True)
+            else:
+                source = ReplayFrameSource(replay_path, realtime=realtime)
+            if controller.set_frame_source(source):
+                main_window.selected_window_id = window_manager.target_window_id
+        
+        # 帧录制: python main.py --record <录制文件.frec>（开始匹配后录制截图和匹配、点击事件）
+        if '--record' in sys.argv[1:-1]:
+            # 录制时同样每帧匹配所有模板，回放可复现录制时的点击
+            controller.set_deterministic_scheduling(True)
+            controller.start_recording(sys.argv[sys.argv.index('--record') + 1])
         print("程序启动成功！支持多线程螺旋点击和优先级控制")
         main_window.run()
         